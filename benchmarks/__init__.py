@@ -0,0 +1,48 @@
+"""
+Benchmarks do bot contra um banco sintético.
+
+    # 1. Gera um bot.db de rascunho (10k usuários, 5M submissões)
+    python -m benchmarks.generate --db scratch/bot.db --usuarios 10000 --submissoes 5000000
+
+    # 2. Mede os caminhos quentes contra uma cópia dele e grava o JSON
+    python -m benchmarks.run --db scratch/bot.db --saida resultados/hoje.json
+
+    # 3. Compara duas rodadas
+    python -m benchmarks.compare resultados/ontem.json resultados/hoje.json
+
+O gerador grava "<db>.meta.json" ao lado do banco (grupos, volumes, seed);
+o runner lê esse arquivo para configurar o bot do mesmo jeito.
+"""
+
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def meta_path(db_path: str) -> str:
+    return db_path + ".meta.json"
+
+
+def load_meta(db_path: str) -> dict:
+    with open(meta_path(db_path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def import_bot(db_path: str, chat_ids):
+    """
+    Importa o bot.py apontando para 'db_path'. A configuração do bot é lida
+    do ambiente na importação, então tudo precisa estar definido antes.
+    """
+    os.environ.update(
+        TELEGRAM_TOKEN=os.environ.get("TELEGRAM_TOKEN", "123:benchmark"),
+        GROUP_CHAT_ID=",".join(str(chat_id) for chat_id in chat_ids),
+        DB_PATH=db_path,
+        DB_SHARDS="1",
+    )
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    import bot
+
+    return bot
@@ -0,0 +1,54 @@
+"""
+Compara duas rodadas de benchmarks.run (antes e depois).
+
+    python -m benchmarks.compare resultados/antes.json resultados/depois.json
+"""
+
+import argparse
+import json
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries_per_op")
+
+
+def load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def delta(before: float, after: float) -> str:
+    if not before:
+        return "   novo" if after else "      ="
+    change = (after - before) / before * 100
+    return f"{change:+6.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("antes")
+    parser.add_argument("depois")
+    args = parser.parse_args()
+
+    before, after = load(args.antes), load(args.depois)
+    print(f"antes:  {before['git_revision']} ({before['started_at']})")
+    print(f"depois: {after['git_revision']} ({after['started_at']})")
+    if before["dataset"]["counts"] != after["dataset"]["counts"]:
+        print("Aviso: as rodadas usaram bancos com volumes diferentes.")
+    print()
+
+    print(f"{'caso':34}" + "".join(f"{metric:>24}" for metric in METRICS))
+    for name in sorted(set(before["cases"]) | set(after["cases"])):
+        old, new = before["cases"].get(name), after["cases"].get(name)
+        if old is None or new is None:
+            print(f"{name:34} (só em {'depois' if old is None else 'antes'})")
+            continue
+        print(
+            f"{name:34}"
+            + "".join(
+                f"{old[metric]:>8.2f} → {new[metric]:>7.2f} {delta(old[metric], new[metric])}"
+                for metric in METRICS
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Bot API do Telegram falsa, local, para testes de carga.
+
+Implementa getMe, getUpdates (long polling), sendMessage, editMessageText e
+answerCallbackQuery (o resto responde ok), com latência configurável e
+respostas 429 (RetryAfter) injetadas. Registra quando cada update foi
+entregue ao bot e quando saiu a primeira resposta a ele.
+
+Para usar com o bot de verdade:
+
+    python -m benchmarks.fake_api --porta 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081/bot python bot.py
+
+O benchmarks.load sobe esta API no próprio processo e gera a carga.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "ProveIt",
+    "username": "prove_it_bot",
+}
+CHARGE_USER = re.compile(r"tg://user\?id=(\d+)")
+
+
+def _decode_params(headers: dict, body: bytes) -> dict:
+    """Parâmetros do PTB: form-urlencoded com valores não-string em JSON."""
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body or b"{}")
+    params = {}
+    for name, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+async def _read_request(reader):
+    """Lê um request HTTP/1.1. Retorna (método, caminho, headers, corpo) ou None."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+
+class FakeBotAPI:
+    """
+    Estado da API falsa: fila de updates pendentes, mensagens enviadas pelo
+    bot e os tempos de entrega/resposta de cada update.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+
+        self._pending = []  # Updates ainda não confirmados (offset)
+        self._new_update = asyncio.Event()
+        self.polled = asyncio.Event()  # O bot já chamou getUpdates
+        self.message_ids = iter(range(10_000_000, 10**12))
+
+        self.pushed_at = {}  # update_id -> quando entrou na fila
+        self.delivered_at = {}  # update_id -> 1º getUpdates que o entregou
+        self.replied_at = {}  # update_id -> 1ª resposta do bot
+        self._by_message = {}  # (chat_id, message_id) -> update_id
+        self._by_callback = {}  # callback_query_id -> update_id
+
+        self.sent = []  # Mensagens enviadas pelo bot (dicts do sendMessage)
+        self.charges = {}  # (chat_id, user_id) -> message_id da cobrança
+        self.keyboards = {}  # chat_id -> (message_id, reply_markup) mais recente
+        self.calls = {}  # método -> nº de chamadas
+        self.injected_429 = 0
+
+    # --- Lado do gerador de carga ---
+
+    def push(self, update: dict, message_id: int = None, callback_id: str = None):
+        """Coloca um update na fila do getUpdates."""
+        update_id = update["update_id"]
+        self.pushed_at[update_id] = time.perf_counter()
+        if message_id is not None:
+            chat_id = update["message"]["chat"]["id"]
+            self._by_message[(chat_id, message_id)] = update_id
+        if callback_id is not None:
+            self._by_callback[callback_id] = update_id
+        self._pending.append(update)
+        self._new_update.set()
+
+    def next_message_id(self) -> int:
+        return next(self.message_ids)
+
+    # --- Métodos da Bot API ---
+
+    def _replied(self, update_id):
+        if update_id is not None and update_id not in self.replied_at:
+            self.replied_at[update_id] = time.perf_counter()
+
+    def _message(self, chat_id, text, reply_markup=None):
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Carga"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = reply_markup
+        return message
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        self.polled.set()
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self._pending[:limit]
+        now = time.perf_counter()
+        for update in batch:
+            self.delivered_at.setdefault(update["update_id"], now)
+        return batch
+
+    async def send_message(self, params):
+        chat_id = int(params["chat_id"])
+        text = str(params.get("text", ""))
+        reply_to = (params.get("reply_parameters") or {}).get("message_id")
+        if reply_to is None:
+            reply_to = params.get("reply_to_message_id")
+        if reply_to is not None:
+            self._replied(self._by_message.get((chat_id, int(reply_to))))
+
+        message = self._message(chat_id, text, params.get("reply_markup"))
+        self.sent.append(message)
+        if "responda a esta mensagem" in text:
+            match = CHARGE_USER.search(text)
+            if match:
+                self.charges[(chat_id, int(match.group(1)))] = message["message_id"]
+        if params.get("reply_markup"):
+            self.keyboards[chat_id] = (message["message_id"], params["reply_markup"])
+        return message
+
+    async def edit_message_text(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        message = self._message(chat_id, str(params.get("text", "")))
+        message["message_id"] = int(params.get("message_id") or 0)
+        if params.get("reply_markup"):
+            self.keyboards[chat_id] = (message["message_id"], params["reply_markup"])
+        return message
+
+    async def answer_callback_query(self, params):
+        self._replied(self._by_callback.get(str(params.get("callback_query_id"))))
+        return True
+
+    METHODS = {
+        "getme": lambda self, params: BOT_USER,
+        "getupdates": get_updates,
+        "sendmessage": send_message,
+        "editmessagetext": edit_message_text,
+        "answercallbackquery": answer_callback_query,
+    }
+    THROTTLED = ("sendmessage", "editmessagetext")
+
+    async def call(self, method: str, params: dict):
+        """Executa um método. Retorna (status HTTP, corpo JSON)."""
+        method = method.lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method != "getupdates" and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        if method in self.THROTTLED and self.rng.random() < self.error_rate:
+            self.injected_429 += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        handler = self.METHODS.get(method)
+        if handler is None:
+            return 200, {"ok": True, "result": True}  # deleteWebhook, etc.
+        result = handler(self, params)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return 200, {"ok": True, "result": result}
+
+    # --- Servidor HTTP ---
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                _, path, headers, body = request
+                # /bot<token>/<método>
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                status, payload = await self.call(method, _decode_params(headers, body))
+                data = json.dumps(payload).encode()
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                        "Content-Type: application/json\r\n"
+                        f"Content-Length: {len(data)}\r\n\r\n"
+                    ).encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            pass  # Servidor fechado no meio de um long polling
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        """Sobe o servidor. Retorna o asyncio.Server."""
+        return await asyncio.start_server(self._serve, host, port)
+
+
+async def _serve_forever(args):
+    api = FakeBotAPI(args.latencia, args.jitter, args.taxa_429, args.retry_after)
+    server = await api.start(args.host, args.porta)
+    print(f"API falsa em http://{args.host}:{args.porta}/bot (Ctrl+C para sair)")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8081)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos")
+    parser.add_argument("--jitter", type=float, default=0.0, help="segundos")
+    parser.add_argument(
+        "--taxa-429", type=float, default=0.0, help="fração de envios com 429"
+    )
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Gera um bot.db sintético para os benchmarks.
+
+Usa as migrações do próprio bot.py (o schema é sempre o atual) e insere em
+lotes grandes, uma transação por lote. O resultado é reprodutível pela seed.
+
+    python -m benchmarks.generate --db scratch/bot.db \\
+        --usuarios 10000 --submissoes 5000000 --ciclos 6 --grupos 2
+
+Ciclos antigos ficam encerrados (30 dias cada, para trás) e o último é o
+ciclo ativo que o bot criaria hoje. Cada usuário manda no máximo 2
+comprovantes por semana, com timestamps crescentes com o id, como em
+produção; sem --ciclos, o histórico é longo o bastante para caber o
+volume pedido (5M submissões de 10k usuários dão ~78 ciclos).
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import import_bot, meta_path
+
+BATCH = 50_000
+FIRST_USER_ID = 10_000_000
+FIRST_CHAT_ID = -1_000_000_000_000
+CYCLE_DAYS = 30
+TARGET_FILL = 0.75  # Ocupação média do limite semanal quando --ciclos não é dado
+
+
+def batched(rows, size=BATCH):
+    """Agrupa um gerador de linhas em listas de até 'size'."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(bot, query, rows):
+    """Insere em lotes (uma transação e um commit por lote). Retorna o total."""
+    total = 0
+    for batch in batched(rows):
+        with bot.transaction(immediate=True) as conn:
+            conn.executemany(query, batch)
+        total += len(batch)
+    return total
+
+
+def create_cycles(bot, chat_id: int, count: int):
+    """Ciclos 1..count-1 encerrados e o ciclo ativo de hoje. Retorna [(num, início, fim)]."""
+    today = datetime.now(bot.TIMEZONE).date()
+    with bot.transaction(immediate=True):
+        active = bot._load_cycle_context(chat_id, today)
+    if active.cycle_num is None:
+        raise SystemExit("O bot não tem ciclo ativo hoje (desafio encerrado).")
+
+    # O ciclo ativo vira o último: renumera e insere os antigos antes dele
+    cycles = []
+    end = active.start_date - timedelta(days=1)
+    for num in range(count - 1, 0, -1):
+        start = end - timedelta(days=CYCLE_DAYS - 1)
+        cycles.append((num, start, end))
+        end = start - timedelta(days=1)
+    cycles.reverse()
+    with bot.transaction(immediate=True):
+        bot.db_execute(
+            "UPDATE cycles SET cycle_num = ? WHERE chat_id = ? AND cycle_num = ?",
+            (count, chat_id, active.cycle_num),
+        )
+        bot.db_executemany(
+            "INSERT INTO cycles (chat_id, cycle_num, start_date, end_date, winner_user_id, is_active) VALUES (?, ?, ?, ?, NULL, 0)",
+            [(chat_id, num, start, end) for num, start, end in cycles],
+        )
+    return cycles + [(count, active.start_date, today)]
+
+
+def week_windows(start, end, tz, now):
+    """Divide [start, end] nos pedaços de cada semana ISO (até 'now' no ciclo ativo)."""
+    cursor = datetime.combine(start, datetime.min.time(), tz)
+    stop = min(datetime.combine(end + timedelta(days=1), datetime.min.time(), tz), now)
+    while cursor < stop:
+        monday = cursor - timedelta(days=cursor.weekday())
+        next_monday = datetime.combine(
+            (monday + timedelta(days=7)).date(), datetime.min.time(), tz
+        )
+        window_end = min(next_monday, stop)
+        yield cursor, window_end
+        cursor = window_end
+
+
+def submission_rows(rng, bot, chat_id, members, cycles, fill, now):
+    """
+    Submissões semana a semana: cada usuário manda 0, 1 ou 2 comprovantes
+    por semana (binomial com taxa 'fill'), com timestamps crescentes.
+    """
+    for cycle_num, start, end in cycles:
+        for window_start, window_end in week_windows(start, end, bot.TIMEZONE, now):
+            week_num = window_start.isocalendar()[1]
+            seconds = (window_end - window_start).total_seconds()
+            week = [
+                (window_start + timedelta(seconds=rng.uniform(0, seconds)), user_id)
+                for user_id in members
+                for _ in range((rng.random() < fill) + (rng.random() < fill))
+            ]
+            week.sort()
+            for ts, user_id in week:
+                yield (
+                    chat_id,
+                    user_id,
+                    ts.isoformat(" "),
+                    rng.choice((3, 5)),
+                    week_num,
+                    cycle_num,
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", required=True, help="caminho do bot.db de rascunho")
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--grupos", type=int, default=1)
+    parser.add_argument(
+        "--ciclos",
+        type=int,
+        help="ciclos por grupo (padrão: o suficiente para as submissões "
+        "caberem no limite de 2 por semana, ~75%% de ocupação)",
+    )
+    parser.add_argument("--submissoes", type=int, default=100_000)
+    parser.add_argument("--horarios", type=int, default=3, help="por usuário")
+    parser.add_argument("--dividas", type=int, default=20_000)
+    parser.add_argument("--depositos", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sobrescrever", action="store_true")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.sobrescrever:
+            parser.error(f"{args.db} já existe (use --sobrescrever)")
+        root, ext = os.path.splitext(args.db)
+        archive = f"{root}.archive{ext}"  # Arquivo morto (bot.archive_path)
+        for path in (args.db, meta_path(args.db), archive):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+
+    if args.ciclos is None:
+        weeks = args.submissoes / (args.usuarios * 2 * TARGET_FILL)
+        args.ciclos = max(2, math.ceil(weeks / (CYCLE_DAYS / 7)))
+
+    rng = random.Random(args.seed)
+    chat_ids = [FIRST_CHAT_ID - i for i in range(args.grupos)]
+    bot = import_bot(args.db, chat_ids)
+    started = time.perf_counter()
+    bot.init_db()
+
+    user_ids = [FIRST_USER_ID + i for i in range(args.usuarios)]
+    members = {
+        chat_id: user_ids[i :: args.grupos] for i, chat_id in enumerate(chat_ids)
+    }
+    now = datetime.now(bot.TIMEZONE)
+    counts = {}
+
+    with bot.use_pool(bot._db_pool):
+        counts["users"] = insert(
+            bot,
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+            ((u, f"user{u}", f"User{u}") for u in user_ids),
+        )
+        counts["chat_members"] = insert(
+            bot,
+            "INSERT INTO chat_members (chat_id, user_id, joined_at) VALUES (?, ?, ?)",
+            (
+                (chat_id, u, now.isoformat(" "))
+                for chat_id in chat_ids
+                for u in members[chat_id]
+            ),
+        )
+        counts["schedules"] = insert(
+            bot,
+            "INSERT INTO schedules (chat_id, user_id, day_of_week, time_of_day) VALUES (?, ?, ?, ?)",
+            (
+                (
+                    chat_id,
+                    u,
+                    rng.choice(list(bot.WEEKDAY_INDEX)),
+                    f"{rng.randrange(5, 23):02d}:{rng.randrange(0, 60, 5):02d}",
+                )
+                for chat_id in chat_ids
+                for u in members[chat_id]
+                for _ in range(args.horarios)
+            ),
+        )
+
+        cycles = {
+            chat_id: create_cycles(bot, chat_id, args.ciclos) for chat_id in chat_ids
+        }
+        counts["cycles"] = args.ciclos * len(chat_ids)
+
+        # Taxa por usuário/semana que dá o volume pedido (no máximo 2 por semana)
+        user_weeks = sum(
+            len(members[chat_id])
+            * sum(
+                1
+                for _, start, end in cycles[chat_id]
+                for _ in week_windows(start, end, bot.TIMEZONE, now)
+            )
+            for chat_id in chat_ids
+        )
+        fill = min(1.0, args.submissoes / (2 * user_weeks))
+        if fill == 1.0:
+            print(
+                f"Aviso: só cabem {2 * user_weeks} submissões em {args.ciclos} "
+                "ciclos com o limite de 2 por semana (aumente --ciclos)."
+            )
+
+        counts["submissions"] = sum(
+            insert(
+                bot,
+                "INSERT INTO submissions (chat_id, user_id, timestamp, points_awarded, week_num, cycle_num) VALUES (?, ?, ?, ?, ?, ?)",
+                submission_rows(
+                    rng, bot, chat_id, members[chat_id], cycles[chat_id], fill, now
+                ),
+            )
+            for chat_id in chat_ids
+        )
+
+        def debt_rows():
+            for i in range(args.dividas):
+                chat_id = rng.choice(chat_ids)
+                yield (
+                    chat_id,
+                    rng.choice(members[chat_id]),
+                    rng.randrange(1, 53),
+                    float(rng.randrange(5, 55, 5)),
+                    1_000_000 + i,
+                    int(rng.random() < 0.7),
+                )
+
+        counts["debts"] = insert(
+            bot,
+            "INSERT INTO debts (chat_id, user_id, week_num, amount, message_id_to_reply, paid) VALUES (?, ?, ?, ?, ?, ?)",
+            debt_rows(),
+        )
+
+        def deposit_rows():
+            for _ in range(args.depositos):
+                chat_id = rng.choice(chat_ids)
+                cycle_num, start, end = rng.choice(cycles[chat_id])
+                ts = datetime.combine(start, datetime.min.time(), bot.TIMEZONE)
+                ts += timedelta(
+                    seconds=rng.uniform(0, ((end - start).days + 1) * 86400)
+                )
+                yield (
+                    chat_id,
+                    rng.choice(members[chat_id]),
+                    float(rng.randrange(5, 55, 5)),
+                    ts.isoformat(" "),
+                    cycle_num,
+                )
+
+        counts["pote"] = insert(
+            bot,
+            "INSERT INTO pote (chat_id, user_id, amount, timestamp, cycle_num) VALUES (?, ?, ?, ?, ?)",
+            deposit_rows(),
+        )
+
+        # Tabelas derivadas e estatísticas do planner, como depois de uso real
+        bot.rebuild_scores()
+        bot.rebuild_pote_balances()
+        bot.db_execute("ANALYZE")
+        bot.db_execute("PRAGMA wal_checkpoint(TRUNCATE)")  # Banco num arquivo só
+
+    bot._db_pool.close()
+    elapsed = time.perf_counter() - started
+    meta = {
+        "generated_at": now.isoformat(),
+        "seed": args.seed,
+        "chat_ids": chat_ids,
+        "cycles": args.ciclos,
+        "weekly_fill": round(fill, 3),
+        "counts": counts,
+        "seconds": round(elapsed, 1),
+        "db_bytes": os.path.getsize(args.db),
+    }
+    with open(meta_path(args.db), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    print(json.dumps(meta, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Teste de carga ponta a ponta: o bot.py de verdade (num subprocesso, banco
+temporário) falando por long polling com a API falsa do benchmarks.fake_api.
+
+Fases:
+  1. aquecimento: cada usuário manda uma foto, o admin roda /debug_weekly
+     (gera as cobranças) e /submissoes (teclado para a paginação) em cada grupo;
+  2. carga: updates na taxa pedida (laço aberto), com a mistura de fotos,
+     respostas às cobranças com comprovante, /leaderboard e cliques de página;
+  3. relatório: latência update -> 1ª resposta (p50/p95/p99) e updates/s
+     sustentados, no total e por tipo.
+
+    python -m benchmarks.load --grupos 10 --usuarios 50 --taxa 200 --duracao 30 \\
+        --mix foto=60,pix=10,leaderboard=20,pagina=10 --latencia 0.02 --taxa-429 0.01
+
+Por padrão a fila de envio do bot roda sem os limites do Telegram (para
+medir o bot); --limites-reais mantém os limites de produção.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+from benchmarks import REPO_ROOT
+from benchmarks.fake_api import BOT_USER, FakeBotAPI
+
+ADMIN_ID = 42
+FIRST_CHAT_ID = -1_000_000_100_000
+FIRST_USER_ID = 20_000_000
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"foto", "pix", "leaderboard", "pagina"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"tipos desconhecidos: {', '.join(unknown)}")
+    return mix
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def latency_summary(latencies) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "n": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+class LoadGenerator:
+    """Monta updates realistas e os entrega à API falsa."""
+
+    def __init__(self, api: FakeBotAPI, chat_ids, users_per_chat: int, seed: int):
+        self.api = api
+        self.rng = random.Random(seed)
+        self.chat_ids = chat_ids
+        self.members = {
+            chat_id: [
+                FIRST_USER_ID + i * users_per_chat + j for j in range(users_per_chat)
+            ]
+            for i, chat_id in enumerate(chat_ids)
+        }
+        self.update_ids = itertools.count(1)
+        self.kinds = {}  # update_id -> tipo
+        self.paid = set()  # Cobranças já respondidas
+
+    def _user(self, user_id: int) -> dict:
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+        }
+
+    def _message(self, chat_id: int, user_id: int, **fields) -> dict:
+        return {
+            "message_id": self.api.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": "Carga"},
+            "from": self._user(user_id),
+            **fields,
+        }
+
+    def _push_message(self, kind: str, message: dict) -> int:
+        update_id = next(self.update_ids)
+        self.kinds[update_id] = kind
+        self.api.push(
+            {"update_id": update_id, "message": message},
+            message_id=message["message_id"],
+        )
+        return update_id
+
+    def photo(
+        self, chat_id: int, user_id: int = None, reply_to: dict = None, kind="foto"
+    ):
+        user_id = user_id or self.rng.choice(self.members[chat_id])
+        fields = {
+            "photo": [
+                {"file_id": "x", "file_unique_id": "x", "width": 90, "height": 90}
+            ]
+        }
+        if reply_to:
+            fields["reply_to_message"] = reply_to
+        return self._push_message(kind, self._message(chat_id, user_id, **fields))
+
+    def command(self, chat_id: int, command: str, user_id: int = None, kind=None):
+        user_id = user_id or self.rng.choice(self.members[chat_id])
+        message = self._message(
+            chat_id,
+            user_id,
+            text=command,
+            entities=[{"type": "bot_command", "offset": 0, "length": len(command)}],
+        )
+        return self._push_message(kind or command.lstrip("/"), message)
+
+    def pix(self, chat_id: int):
+        """Comprovante respondendo à cobrança de um usuário (ou foto, se não há cobrança)."""
+        for (charge_chat, user_id), message_id in self.api.charges.items():
+            if charge_chat == chat_id and (chat_id, user_id) not in self.paid:
+                self.paid.add((chat_id, user_id))
+                charge = {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "supergroup", "title": "Carga"},
+                    "from": BOT_USER,
+                    "text": "cobrança",
+                }
+                return self.photo(chat_id, user_id, reply_to=charge, kind="pix")
+        return self.photo(chat_id)
+
+    def page_click(self, chat_id: int):
+        """Clique em "Próxima" no teclado de /submissoes do grupo."""
+        keyboard = self.api.keyboards.get(chat_id)
+        data = None
+        if keyboard:
+            message_id, markup = keyboard
+            for row in markup.get("inline_keyboard", []):
+                for button in row:
+                    if button.get("callback_data", "").startswith("subs_"):
+                        data = button["callback_data"]
+        if data is None:
+            return self.command(chat_id, "/leaderboard")
+
+        update_id = next(self.update_ids)
+        self.kinds[update_id] = "pagina"
+        callback_id = f"cb{update_id}"
+        self.api.push(
+            {
+                "update_id": update_id,
+                "callback_query": {
+                    "id": callback_id,
+                    "from": self._user(self.rng.choice(self.members[chat_id])),
+                    "chat_instance": str(chat_id),
+                    "data": data,
+                    "message": {
+                        "message_id": message_id,
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "supergroup", "title": "Carga"},
+                        "from": BOT_USER,
+                        "text": "Submissões",
+                    },
+                },
+            },
+            callback_id=callback_id,
+        )
+        return update_id
+
+    def random_update(self, mix: dict):
+        chat_id = self.rng.choice(self.chat_ids)
+        kind = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        if kind == "pix":
+            return self.pix(chat_id)
+        if kind == "leaderboard":
+            return self.command(chat_id, "/leaderboard")
+        if kind == "pagina":
+            return self.page_click(chat_id)
+        return self.photo(chat_id)
+
+
+async def wait_replies(api: FakeBotAPI, update_ids, timeout: float) -> bool:
+    """Espera todos os updates terem resposta (True) ou o timeout (False)."""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(update_id in api.replied_at for update_id in update_ids):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def run(args):
+    api = FakeBotAPI(
+        latency=args.latencia,
+        jitter=args.jitter,
+        error_rate=0.0,  # Sem 429 no aquecimento
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    server = await api.start("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    workdir = tempfile.mkdtemp(prefix="load-")
+    chat_ids = [FIRST_CHAT_ID - i for i in range(args.grupos)]
+    env = {
+        **os.environ,
+        "TELEGRAM_TOKEN": "123:load",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{port}/bot",
+        "GROUP_CHAT_ID": ",".join(map(str, chat_ids)),
+        "ADMIN_USER_IDS": str(ADMIN_ID),
+        "DB_PATH": os.path.join(workdir, "bot.db"),
+        "BOT_MODE": "polling",
+    }
+    if not args.limites_reais:
+        env.update(
+            OUTBOX_GLOBAL_RATE="1e9",
+            OUTBOX_CHAT_PER_MINUTE="1e9",
+            OUTBOX_CHAT_BURST="1e9",
+        )
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        bot = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "bot.py",
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=log,
+            stderr=log,
+        )
+    try:
+        await asyncio.wait_for(api.polled.wait(), timeout=60)
+        return await measure(api, args, chat_ids, log_path)
+    except asyncio.TimeoutError:
+        raise SystemExit(f"O bot não começou o polling (log em {log_path})")
+    finally:
+        if bot.returncode is None:
+            bot.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(bot.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                bot.kill()
+        server.close()
+
+
+async def measure(api: FakeBotAPI, args, chat_ids, log_path):
+    generator = LoadGenerator(api, chat_ids, args.usuarios, args.seed)
+
+    # 1. Aquecimento (fora das métricas)
+    print(f"Aquecendo {len(chat_ids)} grupo(s) x {args.usuarios} usuários...")
+    warmup = [
+        generator.photo(chat_id, user_id)
+        for chat_id in chat_ids
+        for user_id in generator.members[chat_id]
+    ]
+    await wait_replies(api, warmup, args.espera)
+    warmup = [
+        generator.command(chat_id, "/debug_weekly", ADMIN_ID) for chat_id in chat_ids
+    ] + [generator.command(chat_id, "/submissoes", ADMIN_ID) for chat_id in chat_ids]
+    await wait_replies(api, warmup, args.espera)
+    deadline = time.perf_counter() + args.espera
+    while len(api.charges) < len(chat_ids) * args.usuarios:
+        if time.perf_counter() > deadline:
+            break
+        await asyncio.sleep(0.05)
+    print(f"{len(api.charges)} cobranças e {len(api.keyboards)} teclados prontos.")
+
+    # 2. Carga em laço aberto (não espera as respostas para mandar o próximo)
+    api.error_rate = args.taxa_429
+    total = int(args.taxa * args.duracao)
+    print(f"Enviando {total} updates a {args.taxa:g}/s por {args.duracao:g}s...")
+    started = time.perf_counter()
+    load = []
+    for i in range(total):
+        delay = started + i / args.taxa - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        load.append(generator.random_update(args.mix))
+    sent_in = time.perf_counter() - started
+    drained = await wait_replies(api, load, args.espera)
+
+    # 3. Relatório
+    replied = [u for u in load if u in api.replied_at]
+    latencies = {}
+    for update_id in replied:
+        latency = api.replied_at[update_id] - api.pushed_at[update_id]
+        latencies.setdefault(generator.kinds[update_id], []).append(latency)
+    last_reply = max((api.replied_at[u] for u in replied), default=started)
+    elapsed = max(last_reply - started, sent_in)
+
+    report = {
+        "params": {k: v for k, v in vars(args).items() if k not in ("saida",)},
+        "offered_rate": round(total / sent_in, 1) if sent_in else None,
+        "sustained_updates_per_s": round(len(replied) / elapsed, 1),
+        "updates": total,
+        "replied": len(replied),
+        "unanswered": total - len(replied),
+        "drained": drained,
+        "latency": latency_summary([x for xs in latencies.values() for x in xs]),
+        "latency_by_kind": {
+            kind: latency_summary(values) for kind, values in sorted(latencies.items())
+        },
+        "api_calls": api.calls,
+        "injected_429": api.injected_429,
+        "bot_log": log_path,
+    }
+
+    summary = report["latency"]
+    print(
+        f"{len(replied)}/{total} respondidos | oferta {report['offered_rate']}/s | "
+        f"sustentado {report['sustained_updates_per_s']}/s | "
+        f"p50 {summary['p50_ms']}ms p95 {summary['p95_ms']}ms "
+        f"p99 {summary['p99_ms']}ms máx {summary['max_ms']}ms"
+    )
+    for kind, values in report["latency_by_kind"].items():
+        print(
+            f"  {kind:12} n={values['n']:6} p50 {values['p50_ms']:8.2f}ms "
+            f"p99 {values['p99_ms']:8.2f}ms"
+        )
+    print(f"429 injetados: {api.injected_429} | log do bot: {log_path}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--grupos", type=int, default=5)
+    parser.add_argument("--usuarios", type=int, default=20, help="por grupo")
+    parser.add_argument("--taxa", type=float, default=100, help="updates/s")
+    parser.add_argument("--duracao", type=float, default=20, help="segundos")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("foto=60,pix=10,leaderboard=20,pagina=10"),
+    )
+    parser.add_argument("--latencia", type=float, default=0.02, help="RTT da API (s)")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument(
+        "--espera", type=float, default=30, help="tempo máximo de espera das respostas"
+    )
+    parser.add_argument("--limites-reais", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="grava o relatório em JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.saida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.saida)), exist_ok=True)
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Relatório gravado em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Mede os caminhos quentes do bot contra um banco gerado por benchmarks.generate.
+
+Cada caso roda N vezes com um Bot falso (nenhuma chamada sai para o
+Telegram, a fila de envio fica sem rate limit) e registra latência
+(p50/p95/p99/máx) e quantos comandos SQL cada operação executou.
+
+    python -m benchmarks.run --db scratch/bot.db --saida resultados/hoje.json
+
+Por padrão roda numa cópia do banco, então escritas (dívidas do relatório
+semanal, fotos) não contaminam a próxima rodada.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks import REPO_ROOT, import_bot, load_meta
+
+# Comandos que não contam como consulta (controle de transação)
+_CONTROL = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "PRAGMA")
+
+
+class QueryCounter:
+    """Conta os comandos SQL de todas as conexões do bot (via trace callback)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def trace(self, statement: str):
+        if not statement.lstrip().upper().startswith(_CONTROL):
+            self.count += 1
+
+    def install(self, bot):
+        connect = bot.SQLitePool._connect
+        counter = self
+
+        def traced_connect(pool):
+            conn = connect(pool)
+            conn.set_trace_callback(counter.trace)
+            return conn
+
+        bot.SQLitePool._connect = traced_connect
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def summarize(latencies, queries):
+    latencies = sorted(latencies)
+    return {
+        "n": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "queries_per_op": round(sum(queries) / len(queries), 2),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_fake_bot(bot):
+    """ExtBot cujos envios não saem da máquina (devolvem uma Message local)."""
+    from telegram import Chat, Message
+    from telegram.ext import ExtBot
+
+    message_ids = itertools.count(1)
+
+    class FakeBot(ExtBot):
+        async def send_message(self, chat_id, text, *args, **kwargs):
+            message = Message(
+                next(message_ids),
+                datetime.now(bot.TIMEZONE),
+                Chat(chat_id, "supergroup"),
+            )
+            message.set_bot(self)
+            return message
+
+        async def edit_message_text(self, *args, **kwargs):
+            return True
+
+    return FakeBot("123:benchmark")
+
+
+def message_update(fake_bot, chat_id, user_id, update_id, text=None, photo=False):
+    from telegram import Update
+
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup"},
+        "from": {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+        },
+    }
+    if text:
+        message["text"] = text
+        message["entities"] = [
+            {"type": "bot_command", "offset": 0, "length": len(text)}
+        ]
+    if photo:
+        message["photo"] = [
+            {"file_id": "x", "file_unique_id": "x", "width": 1, "height": 1}
+        ]
+    return Update.de_json({"update_id": update_id, "message": message}, fake_bot)
+
+
+async def run_cases(bot, meta, args, counter):
+    chat_id = meta["chat_ids"][0]
+    fake_bot = make_fake_bot(bot)
+    app = type("FakeApp", (), {"bot": fake_bot})()
+    db = bot.db_for(chat_id)
+    cycle_num = await bot.current_cycle(chat_id)
+    members = [
+        row["user_id"]
+        for row in await db.fetch_all(
+            "SELECT user_id FROM chat_members WHERE chat_id = ? ORDER BY user_id",
+            (chat_id,),
+        )
+    ]
+    update_ids = itertools.count(1)
+    users = itertools.cycle(members)
+    pages = {"keyboard": None}
+
+    async def weekly_report():
+        await bot.run_weekly_report(app, chat_id)
+
+    async def pote_report():
+        bot.render_cache.bump(chat_id)
+        await bot.run_daily_pote_report(app, chat_id)
+
+    def pote(cold):
+        async def case():
+            if cold:
+                bot.render_cache.bump(chat_id)
+            update = message_update(
+                fake_bot, chat_id, next(users), next(update_ids), "/pote"
+            )
+            await bot.pote_command(update, None)
+
+        return case
+
+    def leaderboard(cold):
+        async def case():
+            if cold:
+                bot.render_cache.bump(chat_id)
+            update = message_update(
+                fake_bot, chat_id, next(users), next(update_ids), "/leaderboard"
+            )
+            await bot.leaderboard_command(update, None)
+
+        return case
+
+    async def submissions_first_page():
+        await db.run(bot.build_submissions_keyboard, chat_id, cycle_num)
+
+    async def submissions_next_page():
+        # Cada execução clica em "Próxima" a partir da página anterior
+        keyboard = pages["keyboard"]
+        nav = [
+            button.callback_data
+            for row in (keyboard.inline_keyboard if keyboard else [])
+            for button in row
+            if button.callback_data.startswith("subs_n_")
+        ]
+        if nav:
+            _, mode, anchor = nav[0].split("_", 2)
+            page, cursor = bot.parse_page_anchor(anchor)
+            keyboard, _ = await db.run(
+                bot.build_submissions_keyboard, chat_id, cycle_num, page, mode, cursor
+            )
+        else:
+            keyboard, _ = await db.run(
+                bot.build_submissions_keyboard, chat_id, cycle_num
+            )
+        pages["keyboard"] = keyboard
+
+    async def handle_photo():
+        update = message_update(
+            fake_bot, chat_id, next(users), next(update_ids), photo=True
+        )
+        await bot.handle_photo(update, None)
+
+    heavy = max(3, args.repeticoes // 10)
+    cases = [
+        ("run_weekly_report", weekly_report, heavy),
+        ("run_daily_pote_report", pote_report, args.repeticoes),
+        ("pote_command", pote(True), args.repeticoes),
+        ("pote_command_cache", pote(False), args.repeticoes),
+        ("leaderboard_command", leaderboard(True), args.repeticoes),
+        ("leaderboard_command_cache", leaderboard(False), args.repeticoes),
+        ("build_submissions_keyboard_p1", submissions_first_page, args.repeticoes),
+        ("build_submissions_keyboard_next", submissions_next_page, args.repeticoes),
+        ("handle_photo", handle_photo, args.repeticoes),
+    ]
+    if args.casos:
+        cases = [case for case in cases if case[0] in args.casos]
+
+    results = {}
+    for name, case, repeat in cases:
+        await case()  # Aquecimento (cache de páginas, statements preparados)
+        latencies, queries = [], []
+        for _ in range(repeat):
+            before = counter.count
+            started = time.perf_counter()
+            await case()
+            latencies.append(time.perf_counter() - started)
+            queries.append(counter.count - before)
+        results[name] = summarize(latencies, queries)
+        print(
+            f"{name:34} p50 {results[name]['p50_ms']:9.2f}ms  "
+            f"p95 {results[name]['p95_ms']:9.2f}ms  "
+            f"{results[name]['queries_per_op']:6.1f} queries/op"
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--db", required=True, help="banco gerado pelo generate")
+    parser.add_argument("--saida", help="arquivo JSON de resultados")
+    parser.add_argument("--repeticoes", type=int, default=50)
+    parser.add_argument("--casos", nargs="*", help="roda só estes casos")
+    parser.add_argument(
+        "--sem-copia", action="store_true", help="roda direto no banco (sem cópia)"
+    )
+    args = parser.parse_args()
+
+    meta = load_meta(args.db)
+    db_path = args.db
+    if not args.sem_copia:
+        db_path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bot.db")
+        shutil.copy2(args.db, db_path)
+
+    bot = import_bot(db_path, meta["chat_ids"])
+    counter = QueryCounter()
+    counter.install(bot)  # Antes de abrir qualquer conexão
+    bot.init_db()
+    # Sem rate limit: mede o bot, não o limite do Telegram
+    bot.outbox = bot.Outbox(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    try:
+        results = asyncio.run(run_cases(bot, meta, args, counter))
+    finally:
+        for shard in bot._shards:
+            shard.stop()
+            shard.pool.close()
+        if not args.sem_copia:
+            shutil.rmtree(os.path.dirname(db_path), ignore_errors=True)
+
+    report = {
+        "started_at": started_at,
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "repetitions": args.repeticoes,
+        "dataset": meta,
+        "cases": results,
+    }
+    output = args.saida or f"bench-{started_at.replace(':', '')}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados gravados em {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,29 @@
 # Certifique-se de que 'os' também está importado
 import os
+import asyncio
+import bisect
+import csv
+import functools
+import gzip
+import heapq
+import hmac
+import html
+import json
 import logging
+import pickle
 import sqlite3
 import os
-from datetime import datetime, time, timedelta
+import queue
+import re
+import signal
+import tempfile
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque, namedtuple
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from time import monotonic, perf_counter
 import pytz  # Para lidar com fuso horário
 
 from telegram import (
@@ -15,16 +35,25 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
     ConversationHandler,
     CallbackQueryHandler,
+    TypeHandler,
 )
 from telegram.constants import ParseMode
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+from apscheduler.executors.asyncio import AsyncIOExecutor
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import datetime_to_utc_timestamp
 
 # --- Configuração Inicial ---
 
@@ -37,6 +66,7 @@ logger = logging.getLogger(__name__)
 # Token do BotFather (COLOQUE O SEU AQUI)
 # (Melhor prática é usar variáveis de ambiente, mas para simplificar, colocamos aqui)
 TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN")
+# Um ou mais grupos, separados por vírgula. Ex: "-100123" ou "-100123,-100456"
 GROUP_CHAT_ID_STR = os.environ.get("GROUP_CHAT_ID")
 ADMIN_USER_IDS_STR = os.environ.get("ADMIN_USER_IDS")  # Ex: "123,456,789"
 
@@ -65,15 +95,91 @@ else:
         ADMIN_USER_IDS = []
 
 try:
-    GROUP_CHAT_ID = int(GROUP_CHAT_ID_STR)
+    # Um ou mais grupos de desafio, separados por vírgula
+    GROUP_CHAT_IDS = [
+        int(chat_id.strip())
+        for chat_id in GROUP_CHAT_ID_STR.split(",")
+        if chat_id.strip()
+    ]
 except ValueError:
     logger.critical("GROUP_CHAT_ID não é um número válido.")
     exit()
 
+if not GROUP_CHAT_IDS:
+    logger.critical("GROUP_CHAT_ID não contém nenhum grupo! Saindo.")
+    exit()
+
+# Grupo principal: os dados de antes do suporte a vários grupos pertencem a ele
+GROUP_CHAT_ID = GROUP_CHAT_IDS[0]
+
+
+# Caminho do banco (no Fly.io fica no volume montado em /app/data)
+DB_PATH = os.environ.get("DB_PATH", "data/bot.db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+# Quantidade de shards (arquivos SQLite) entre os quais os grupos são divididos
+DB_SHARDS = max(1, int(os.environ.get("DB_SHARDS", "1")))
+# Profiler de consultas dos helpers db_* (DB_PROFILE=1 liga; custa um
+# perf_counter e uma normalização de SQL por comando). Acima de
+# DB_PROFILE_SLOW_MS o plano (EXPLAIN QUERY PLAN) é capturado.
+DB_PROFILE = os.environ.get("DB_PROFILE") == "1"
+DB_PROFILE_SLOW_MS = float(os.environ.get("DB_PROFILE_SLOW_MS", "50"))
 
 # Fuso horário de Brasília
 TIMEZONE = pytz.timezone("America/Sao_Paulo")
 
+# Máximo de mensagens de cobrança enviadas ao mesmo tempo no relatório semanal
+WEEKLY_REPORT_SEND_CONCURRENCY = 5
+
+# Duração da janela de prompt (enviar dentro dela vale 5 pontos em vez de 3)
+PROMPT_WINDOW = timedelta(hours=1)
+
+# Fila de envio: limites do Telegram (mensagens/segundo no total, mensagens/
+# minuto e rajada por grupo). Só mude por ambiente em testes de carga contra
+# a API falsa (benchmarks.load).
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CHAT_PER_MINUTE = float(os.environ.get("OUTBOX_CHAT_PER_MINUTE", "20"))
+OUTBOX_CHAT_BURST = float(os.environ.get("OUTBOX_CHAT_BURST", "5"))
+
+# Faixas de prioridade da fila (menor = mais urgente)
+PRIORITY_CRITICAL = 0  # Prompts e lembretes com hora marcada
+PRIORITY_INTERACTIVE = 1  # Respostas a comandos e fotos
+PRIORITY_BULK = 2  # Relatórios e cobranças em massa
+PRIORITY_NAMES = {
+    PRIORITY_CRITICAL: "critical",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BULK: "bulk",
+}
+
+# Quantos updates são processados ao mesmo tempo (os de um mesmo usuário
+# num mesmo grupo continuam em fila, na ordem de chegada)
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "64"))
+
+# URL base da Bot API (padrão: a oficial). Ex: "http://127.0.0.1:8081/bot"
+# para apontar o bot para a API falsa do benchmarks.fake_api.
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+
+# Modo de recebimento de updates: "polling" (padrão) ou "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# URL pública registrada no Telegram (se vazia, o setWebhook fica a cargo de quem faz o deploy)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+
+# Endpoint de métricas no formato do Prometheus (desligado se METRICS_PORT vazia).
+# Por padrão só escuta na máquina local (ex: o agente de métricas do Fly.io).
+METRICS_PORT = int(os.environ.get("METRICS_PORT") or 0)
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+
+if BOT_MODE not in ("polling", "webhook"):
+    logger.critical(f"BOT_MODE inválido: '{BOT_MODE}'. Use 'polling' ou 'webhook'.")
+    exit()
+
+if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+    logger.critical("Modo webhook exige a variável WEBHOOK_SECRET! Saindo.")
+    exit()
+
 # Estados para a conversa de edição de horário
 (STATE_SELECT_SCHEDULE, STATE_GET_DAY, STATE_GET_TIME) = range(3)
 
@@ -91,12 +197,880 @@ INITIAL_USERS = {
 }
 # NOTA: O ID 0 é um placeholder. O bot vai pegar o ID real quando o /start for usado no grupo.
 
+# --- Métricas (formato texto do Prometheus) ---
+# Registro em memória, sem dependências extras. Contadores e histogramas são
+# atualizados também pelas threads dos workers do banco, por isso o lock.
+
+METRICS_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Contador monotônico por combinação de labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Histogram:
+    """Histograma (buckets cumulativos, _sum e _count) por combinação de labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [contagem por bucket (+Inf no fim), soma]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [
+                    [0] * (len(self.buckets) + 1),
+                    0.0,
+                ]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def samples(self):
+        with self._lock:
+            series = {k: (list(v[0]), v[1]) for k, v in self._series.items()}
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Valor lido na hora da coleta: 'func' devolve um número ou {labels: valor}."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, func, labels=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.func()
+        values = value if isinstance(value, dict) else {(): value}
+        for label_values, number in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {number}"
+
+
+class MetricsRegistry:
+    """Conjunto de métricas do bot, renderizado no formato texto 0.0.4."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels=()) -> Histogram:
+        return self.register(Histogram(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, func, labels=()) -> Gauge:
+        return self.register(Gauge(name, help_text, func, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning(f"Métrica {metric.name} falhou na coleta: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HANDLER_SECONDS = metrics.histogram(
+    "prove_it_handler_seconds", "Duração dos handlers do bot.", ("handler",)
+)
+HANDLER_ERRORS = metrics.counter(
+    "prove_it_handler_errors_total", "Exceções nos handlers do bot.", ("handler",)
+)
+DB_QUERY_SECONDS = metrics.histogram(
+    "prove_it_db_query_seconds",
+    "Duração dos comandos SQL dos helpers db_*.",
+    ("operation",),
+)
+DB_ERRORS = metrics.counter(
+    "prove_it_db_errors_total", "Erros de SQLite nos helpers db_*.", ("operation",)
+)
+TELEGRAM_API_SECONDS = metrics.histogram(
+    "prove_it_telegram_api_seconds", "Latência das chamadas à Bot API.", ("method",)
+)
+TELEGRAM_API_ERRORS = metrics.counter(
+    "prove_it_telegram_api_errors_total",
+    "Chamadas à Bot API que falharam, por tipo de erro.",
+    ("method", "error"),
+)
+JOB_SECONDS = metrics.histogram(
+    "prove_it_job_seconds", "Duração das execuções dos jobs agendados.", ("job",)
+)
+JOB_LATENESS = metrics.histogram(
+    "prove_it_job_lateness_seconds",
+    "Atraso entre o horário previsto e o início real dos jobs.",
+    ("job",),
+)
+JOB_ERRORS = metrics.counter(
+    "prove_it_job_errors_total", "Execuções de jobs que terminaram em erro.", ("job",)
+)
+
+
+def timed_handler(callback):
+    """Envolve o callback de um handler para medir a duração e as exceções."""
+    name = getattr(callback, "__name__", str(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(perf_counter() - started, name)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mede cada chamada à Bot API (latência e erros por método)."""
+
+    async def post(self, url: str, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(perf_counter() - started, method)
+
+
 # --- Funções do Banco de Dados (SQLite) ---
 
+# Tabelas cujas linhas de ciclos encerrados vão para o arquivo morto, com as
+# colunas na ordem usada nas cópias (a chave primária primeiro). O livro-caixa
+# do pote fica sempre na tabela quente: é a fonte do /auditar_pote.
+ARCHIVED_TABLES = {
+    "submissions": (
+        "submission_id",
+        "chat_id",
+        "user_id",
+        "timestamp",
+        "points_awarded",
+        "week_num",
+        "cycle_num",
+    ),
+    "debts": (
+        "debt_id",
+        "chat_id",
+        "user_id",
+        "week_num",
+        "amount",
+        "message_id_to_reply",
+        "paid",
+        "cycle_num",
+    ),
+}
 
-def init_db():
-    """Cria as tabelas do banco de dados se não existirem."""
-    conn = sqlite3.connect("data/bot.db")
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS archive.submissions (
+        submission_id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        timestamp DATETIME NOT NULL,
+        points_awarded INTEGER NOT NULL,
+        week_num INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_submissions_cycle "
+    "ON submissions (chat_id, cycle_num, timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS archive.debts (
+        debt_id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        week_num INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        message_id_to_reply INTEGER,
+        paid INTEGER NOT NULL,
+        cycle_num INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_archive_debts_cycle "
+    "ON debts (chat_id, cycle_num)",
+)
+
+
+def archive_path(path: str) -> str:
+    """Arquivo morto de um banco (ex: data/bot.db -> data/bot.archive.db)."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.archive{ext}"
+
+
+def create_archive_views(conn: sqlite3.Connection):
+    """Views temporárias *_all: tabela quente UNION ALL arquivo morto."""
+    for table, columns in ARCHIVED_TABLES.items():
+        cols = ", ".join(columns)
+        conn.execute(
+            f"CREATE TEMP VIEW IF NOT EXISTS {table}_all AS "
+            f"SELECT {cols} FROM main.{table} "
+            f"UNION ALL SELECT {cols} FROM archive.{table}"
+        )
+
+
+def drop_archive_views(conn: sqlite3.Connection):
+    """
+    Remove as views *_all da conexão. O ALTER TABLE revalida todas as views,
+    inclusive as temporárias, e as migrações antigas rodam antes de as
+    colunas que elas usam existirem.
+    """
+    for table in ARCHIVED_TABLES:
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}_all")
+
+
+class SQLitePool:
+    """
+    Pool pequeno de conexões SQLite de longa duração.
+
+    Cada conexão é aberta uma única vez com WAL e pragmas ajustados, e
+    mantém um cache de statements preparados. As conexões rodam em modo
+    autocommit; transações explícitas são abertas por transaction().
+    """
+
+    PRAGMAS = (
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",  # Seguro com WAL, 1 fsync por checkpoint
+        "PRAGMA cache_size = -16000",  # ~16 MB de cache de páginas
+        "PRAGMA mmap_size = 134217728",  # 128 MB mapeados em memória
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA busy_timeout = 30000",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4,
+        cached_statements: int = 256,
+        archive: str = None,
+    ):
+        self.path = path
+        self.archive = archive  # Arquivo morto anexado como "archive" (opcional)
+        self.size = max(1, size)
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30,
+            isolation_level=None,  # Autocommit; BEGIN/COMMIT são explícitos
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        if self.archive:
+            self._attach_archive(conn)
+        return conn
+
+    def _attach_archive(self, conn: sqlite3.Connection):
+        """
+        Anexa o arquivo morto e cria as views *_all (tabela quente + arquivo)
+        desta conexão, para as consultas históricas.
+        """
+        conn.execute("ATTACH DATABASE ? AS archive", (self.archive,))
+        conn.execute("PRAGMA archive.journal_mode = WAL")
+        conn.execute("PRAGMA archive.synchronous = NORMAL")
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        create_archive_views(conn)
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._all) < self.size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+        return self._idle.get()  # Pool cheio: espera uma conexão livre
+
+    def _release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()  # Nunca devolve uma transação pendurada ao pool
+        self._idle.put(conn)
+
+    def in_transaction(self) -> bool:
+        """Indica se a thread atual está dentro de um transaction()."""
+        return getattr(self._local, "depth", 0) > 0
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão (ou reaproveita a da transação em curso)."""
+        bound = getattr(self._local, "conn", None)
+        if bound is not None:
+            yield bound
+            return
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """
+        Agrupa vários comandos em uma única transação (um único fsync).
+        Os helpers db_* chamados dentro do bloco usam a mesma conexão.
+        Blocos aninhados viram SAVEPOINTs. Não use 'await' dentro do bloco.
+        """
+        with self.connection() as conn:
+            depth = getattr(self._local, "depth", 0)
+            outer = getattr(self._local, "conn", None)
+            if depth == 0:
+                self._local.conn = conn
+                conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            else:
+                conn.execute(f"SAVEPOINT sp_{depth}")
+            self._local.depth = depth + 1
+            try:
+                yield conn
+            except BaseException:
+                if depth == 0:
+                    conn.rollback()
+                else:
+                    conn.execute(f"ROLLBACK TO sp_{depth}")
+                    conn.execute(f"RELEASE sp_{depth}")
+                raise
+            else:
+                if depth == 0:
+                    conn.commit()
+                else:
+                    conn.execute(f"RELEASE sp_{depth}")
+            finally:
+                self._local.depth = depth
+                if depth == 0:
+                    self._local.conn = outer
+
+    def bind_thread(self) -> sqlite3.Connection:
+        """Dedica uma conexão nova à thread atual (usado pelo worker do AsyncDB)."""
+        conn = self._connect()
+        with self._lock:
+            self._all.append(conn)
+        self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Fecha todas as conexões do pool (usado no shutdown)."""
+        with self._lock:
+            for conn in self._all:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._all.clear()
+            self._idle = queue.LifoQueue()
+
+
+_db_pool = SQLitePool(DB_PATH, size=DB_POOL_SIZE, archive=archive_path(DB_PATH))
+
+# Pool do shard em uso na thread atual (cada worker do AsyncDB fixa o seu)
+_shard_local = threading.local()
+
+
+def _active_pool() -> SQLitePool:
+    """Pool que os helpers db_* usam nesta thread (padrão: shard 0)."""
+    return getattr(_shard_local, "pool", None) or _db_pool
+
+
+@contextmanager
+def use_pool(pool: SQLitePool):
+    """Faz os helpers db_* desta thread usarem outro pool (ex: migrar um shard)."""
+    outer = getattr(_shard_local, "pool", None)
+    _shard_local.pool = pool
+    try:
+        yield pool
+    finally:
+        _shard_local.pool = outer
+
+
+def transaction(immediate: bool = False):
+    """Atalho para transaction() no pool do shard atual."""
+    return _active_pool().transaction(immediate=immediate)
+
+
+class AsyncDB:
+    """
+    API assíncrona do banco para os handlers (ex: await db.fetch_one(...)).
+
+    Todos os comandos vão para uma fila atendida por uma única thread
+    dedicada, então o event loop nunca espera por SQLite/fsync. Escritas
+    consecutivas na fila são agrupadas em uma só transação (group commit),
+    cada uma em seu próprio SAVEPOINT para que uma falha não derrube as outras.
+    """
+
+    def __init__(self, pool: SQLitePool, max_batch: int = 64, name: str = "db-worker"):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.name = name
+        self._requests = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Sobe a thread do worker (idempotente)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name=self.name, daemon=True
+                )
+                self._thread.start()
+
+    def stop(self):
+        """Processa o que já está na fila e encerra o worker."""
+        with self._start_lock:
+            if self._thread is None:
+                return
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    # --- API pública (corrotinas) ---
+
+    async def fetch_one(self, query, params=()):
+        return await self._submit(False, db_query_one, query, params)
+
+    async def fetch_all(self, query, params=()):
+        return await self._submit(False, db_query_all, query, params)
+
+    async def execute(self, query, params=()):
+        """Escrita com group commit. Retorna o lastrowid (ou None em erro)."""
+        try:
+            return await self._submit(True, db_execute, query, params)
+        except sqlite3.Error:
+            return None  # Já foi logado pelo db_execute
+
+    async def executemany(self, query, seq_of_params):
+        try:
+            return await self._submit(True, db_executemany, query, list(seq_of_params))
+        except sqlite3.Error:
+            return None
+
+    async def run(self, func, *args):
+        """Roda uma função síncrona (que usa os helpers db_*) no worker."""
+        return await self._submit(False, func, *args)
+
+    async def run_in_transaction(self, func, *args):
+        """Roda uma função síncrona no worker, atomicamente, junto do group commit."""
+        return await self._submit(True, func, *args)
+
+    def submit_write(self, func, *args) -> asyncio.Future:
+        """
+        Como run_in_transaction, mas para código síncrono rodando no loop (ex:
+        job store do APScheduler): enfileira e devolve o future sem esperar.
+        """
+        return self._submit(True, func, *args)
+
+    # --- Internals ---
+
+    def _submit(self, is_write, func, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.start()
+        self._requests.put((is_write, func, args, future, loop))
+        return future
+
+    @staticmethod
+    def _resolve(future, result=None, error=None):
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _deliver(self, item, result=None, error=None):
+        _, _, _, future, loop = item
+        loop.call_soon_threadsafe(self._resolve, future, result, error)
+
+    def _run_single(self, item):
+        _, func, args, _, _ = item
+        try:
+            self._deliver(item, result=func(*args))
+        except Exception as e:
+            self._deliver(item, error=e)
+
+    def _run_batch(self, batch):
+        outcomes = []
+        try:
+            with self.pool.transaction(immediate=True):
+                for item in batch:
+                    _, func, args, _, _ = item
+                    try:
+                        with self.pool.transaction():  # SAVEPOINT por item
+                            outcomes.append((func(*args), None))
+                    except Exception as e:
+                        outcomes.append((None, e))
+        except Exception as e:
+            logger.error(f"Erro no DB (group commit de {len(batch)} escritas): {e}")
+            outcomes = [(None, e)] * len(batch)
+        for item, (result, error) in zip(batch, outcomes):
+            self._deliver(item, result, error)
+
+    def _worker(self):
+        _shard_local.pool = self.pool  # Os helpers db_* desta thread usam este shard
+        self.pool.bind_thread()
+        drained = object()
+        item = self._requests.get()
+        while item is not None:
+            if not item[0]:
+                self._run_single(item)
+                item = self._requests.get()
+                continue
+
+            # Junta as escritas consecutivas já enfileiradas em um só commit
+            batch = [item]
+            item = drained
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None or not nxt[0]:
+                    item = nxt
+                    break
+                batch.append(nxt)
+            self._run_batch(batch)
+            if item is drained:
+                item = self._requests.get()
+
+
+# --- Shards (um arquivo SQLite + um worker por shard) ---
+# Cada grupo vive inteiro em um shard, escolhido uma única vez (chat_id %
+# DB_SHARDS) e gravado na tabela chats do shard 0, que também guarda o job
+# store do agendador. Grupos em shards diferentes não disputam o mesmo
+# arquivo nem a mesma thread de escrita.
+
+
+def shard_path(index: int) -> str:
+    """Arquivo do shard: o shard 0 é o próprio DB_PATH."""
+    if index == 0:
+        return DB_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}.shard{index}{ext}"
+
+
+_shards = [AsyncDB(_db_pool, name="db-worker-0")]  # Índice = número do shard
+_chat_shards = {}  # chat_id -> shard (só os grupos autorizados)
+
+
+def open_shard(index: int) -> AsyncDB:
+    """AsyncDB do shard 'index', abrindo os shards que ainda faltam."""
+    while len(_shards) <= index:
+        n = len(_shards)
+        path = shard_path(n)
+        pool = SQLitePool(path, size=DB_POOL_SIZE, archive=archive_path(path))
+        _shards.append(AsyncDB(pool, name=f"db-worker-{n}"))
+    return _shards[index]
+
+
+def db_for(chat_id: int) -> AsyncDB:
+    """AsyncDB do shard onde ficam os dados do grupo."""
+    return _shards[_chat_shards.get(chat_id, 0)]
+
+
+_SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SQL_SPACES = re.compile(r"\s+")
+
+
+def sql_fingerprint(query: str) -> str:
+    """SQL normalizado: literais viram '?', listas IN (?, ?, ...) viram (...)."""
+    query = _SQL_STRING.sub("?", query)
+    query = _SQL_NUMBER.sub("?", query)
+    query = _SQL_IN_LIST.sub("(...)", query)
+    return _SQL_SPACES.sub(" ", query).strip()
+
+
+class QueryProfiler:
+    """
+    Tempo de cada comando dos helpers db_*, agrupado por fingerprint do SQL.
+
+    Guarda as últimas 'window' amostras de cada fingerprint (para o p99) e
+    os totais desde o boot. Na primeira vez que um fingerprint passa de
+    'slow_ms', o EXPLAIN QUERY PLAN é capturado com os mesmos parâmetros.
+    """
+
+    def __init__(
+        self,
+        enabled: bool,
+        slow_ms: float,
+        window: int = 200,
+        max_fingerprints: int = 500,
+    ):
+        self.enabled = enabled
+        self.slow = slow_ms / 1000
+        self.window = window
+        self.max_fingerprints = max_fingerprints
+        self._stats = {}  # fingerprint -> dict
+        self._lock = threading.Lock()
+
+    def record(self, query: str, params, seconds: float):
+        fingerprint = sql_fingerprint(query)
+        with self._lock:
+            entry = self._stats.get(fingerprint)
+            if entry is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    self._evict()
+                entry = self._stats[fingerprint] = {
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                    "slow": 0,
+                    "samples": deque(maxlen=self.window),
+                    "plan": None,
+                }
+            entry["count"] += 1
+            entry["total"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            entry["samples"].append(seconds)
+            slow = seconds >= self.slow
+            if slow:
+                entry["slow"] += 1
+            explain = slow and entry["plan"] is None and params is not None
+        if explain:
+            plan = self._explain(query, params)
+            with self._lock:
+                entry["plan"] = plan
+
+    def _evict(self):
+        """Descarta o fingerprint de menor tempo total (chamado com o lock)."""
+        victim = min(self._stats, key=lambda k: self._stats[k]["total"])
+        del self._stats[victim]
+
+    @staticmethod
+    def _explain(query: str, params):
+        try:
+            with _active_pool().connection() as conn:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        except sqlite3.Error as e:
+            return [f"(sem plano: {e})"]
+        return [row["detail"] for row in rows]
+
+    def report(self, top: int = 10) -> dict:
+        """Top-N fingerprints por tempo total e por p99."""
+        with self._lock:
+            rows = []
+            for fingerprint, entry in self._stats.items():
+                samples = sorted(entry["samples"])
+                rows.append(
+                    {
+                        "sql": fingerprint,
+                        "count": entry["count"],
+                        "total": entry["total"],
+                        "avg": entry["total"] / entry["count"],
+                        "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+                        "max": entry["max"],
+                        "slow": entry["slow"],
+                        "plan": entry["plan"],
+                    }
+                )
+        return {
+            "fingerprints": len(rows),
+            "by_total": sorted(rows, key=lambda r: r["total"], reverse=True)[:top],
+            "by_p99": sorted(rows, key=lambda r: r["p99"], reverse=True)[:top],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_profiler = QueryProfiler(DB_PROFILE, DB_PROFILE_SLOW_MS)
+
+
+def _timed_db(operation: str):
+    """
+    Mede a duração de um helper db_* (prove_it_db_query_seconds) e, com
+    DB_PROFILE=1, passa cada comando pelo query_profiler.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(query, params=()):
+            started = perf_counter()
+            try:
+                return func(query, params)
+            finally:
+                elapsed = perf_counter() - started
+                DB_QUERY_SECONDS.observe(elapsed, operation)
+                if query_profiler.enabled:
+                    # executemany recebe uma lista de parâmetros: sem EXPLAIN
+                    query_profiler.record(
+                        query, None if operation == "executemany" else params, elapsed
+                    )
+
+        return wrapper
+
+    return decorator
+
+
+@_timed_db("execute")
+def db_execute(query, params=()):
+    """Função helper para executar comandos no DB."""
+    try:
+        with _active_pool().connection() as conn:
+            cursor = conn.execute(query, params)
+            return cursor.lastrowid
+    except sqlite3.Error as e:
+        DB_ERRORS.inc("execute")
+        logger.error(f"Erro no DB (write): {e}")
+        if _active_pool().in_transaction():
+            raise  # Deixa o transaction() desfazer o bloco inteiro
+        return None
+
+
+@_timed_db("executemany")
+def db_executemany(query, seq_of_params):
+    """Função helper para escrita em lote (uma transação, um fsync)."""
+    try:
+        with transaction() as conn:
+            cursor = conn.executemany(query, seq_of_params)
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        DB_ERRORS.inc("executemany")
+        logger.error(f"Erro no DB (write em lote): {e}")
+        if _active_pool().in_transaction():
+            raise
+        return None
+
+
+@_timed_db("query_one")
+def db_query_one(query, params=()):
+    """Função helper para buscar um resultado no DB."""
+    try:
+        with _active_pool().connection() as conn:
+            return conn.execute(query, params).fetchone()
+    except sqlite3.Error as e:
+        DB_ERRORS.inc("query_one")
+        logger.error(f"Erro no DB (query_one): {e}")
+        if _active_pool().in_transaction():
+            raise
+        return None
+
+
+@_timed_db("query_all")
+def db_query_all(query, params=()):
+    """Função helper para buscar múltiplos resultados no DB."""
+    try:
+        with _active_pool().connection() as conn:
+            return conn.execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        DB_ERRORS.inc("query_all")
+        logger.error(f"Erro no DB (query_all): {e}")
+        if _active_pool().in_transaction():
+            raise
+        return None
+
+
+# --- Migrações do Schema ---
+# Cada migração roda uma única vez, em ordem, dentro de uma transação, e fica
+# registrada na tabela schema_version. Para mudar o schema, adicione um novo
+# passo no final de MIGRATIONS (nunca edite um passo que já foi aplicado).
+
+
+def _column_exists(conn, table: str, column: str) -> bool:
+    return any(
+        row["name"] == column for row in conn.execute(f"PRAGMA table_info({table})")
+    )
+
+
+def _add_column(conn, table: str, column: str, definition: str):
+    """Adiciona uma coluna só se ela ainda não existir (seguro para bancos antigos)."""
+    if not _column_exists(conn, table, column):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _migration_001_initial_schema(conn):
+    """Tabelas originais (IF NOT EXISTS, então é no-op no data/bot.db existente)."""
     cursor = conn.cursor()
 
     # Tabela de Usuários
@@ -182,76 +1156,1694 @@ def init_db():
     """
     )
 
-    conn.commit()
-    conn.close()
-    logger.info("Banco de dados inicializado.")
 
+def _migration_002_hot_path_indexes(conn):
+    """Índices cobrindo as consultas quentes (evita full scans que crescem com o histórico)."""
+    # Limite de 2 por semana e soma semanal de pontos (handle_photo / relatório)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_user_cycle_week "
+        "ON submissions (user_id, cycle_num, week_num, points_awarded)"
+    )
+    # Leaderboard / vencedor do ciclo e listagem paginada de /submissoes
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_cycle_ts "
+        "ON submissions (cycle_num, timestamp)"
+    )
+    # Resposta com comprovante de PIX à mensagem de cobrança
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_debts_reply "
+        "ON debts (message_id_to_reply, user_id, paid)"
+    )
+    # SUM(amount) do pote e contribuições por usuário no ciclo
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_pote_cycle_user "
+        "ON pote (cycle_num, user_id, amount)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_schedules_user ON schedules (user_id)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cycles_active "
+        "ON cycles (is_active, start_date, end_date)"
+    )
+    conn.execute("ANALYZE")  # Atualiza as estatísticas para o planner usar os índices
 
-def db_execute(query, params=()):
-    """Função helper para executar comandos no DB."""
-    try:
-        conn = sqlite3.connect("data/bot.db")
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return cursor.lastrowid
-    except sqlite3.Error as e:
-        logger.error(f"Erro no DB (write): {e}")
-        return None
 
+def _migration_003_weekly_report_index(conn):
+    """Índice (ciclo, semana, usuário) para o relatório semanal agregado."""
+    # Também atende o COUNT por usuário/semana, então substitui o índice anterior
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_cycle_week_user "
+        "ON submissions (cycle_num, week_num, user_id, points_awarded)"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_submissions_user_cycle_week")
 
-def db_query_one(query, params=()):
-    """Função helper para buscar um resultado no DB."""
-    try:
-        conn = sqlite3.connect("data/bot.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        result = cursor.fetchone()
-        conn.close()
-        return result
-    except sqlite3.Error as e:
-        logger.error(f"Erro no DB (query_one): {e}")
-        return None
+
+def _migration_004_materialized_scores(conn):
+    """Placar materializado por usuário/ciclo/semana e por usuário/ciclo."""
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS scores (
+        user_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        week_num INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, cycle_num, week_num)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS cycle_scores (
+        cycle_num INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (cycle_num, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_scores_cycle_week "
+        "ON scores (cycle_num, week_num, user_id, points)"
+    )
+    # SQL do schema desta versão (rebuild_scores() acompanha o schema atual)
+    conn.execute(
+        "INSERT INTO scores (user_id, cycle_num, week_num, points, submissions) "
+        "SELECT user_id, cycle_num, week_num, SUM(points_awarded), COUNT(*) "
+        "FROM submissions GROUP BY user_id, cycle_num, week_num"
+    )
+    conn.execute(
+        "INSERT INTO cycle_scores (cycle_num, user_id, points, submissions) "
+        "SELECT cycle_num, user_id, SUM(points), SUM(submissions) "
+        "FROM scores GROUP BY cycle_num, user_id"
+    )
+
+
+def _migration_005_prompt_windows(conn):
+    """Janelas de prompt (5 pontos) persistidas, para sobreviver a restarts."""
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS prompt_windows (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        opened_at DATETIME NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_prompt_windows_expires "
+        "ON prompt_windows (expires_at)"
+    )
+
+
+def _migration_006_scheduler_jobstore(conn):
+    """Tabela do job store persistente do APScheduler."""
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS apscheduler_jobs (
+        id TEXT PRIMARY KEY,
+        next_run_time REAL,
+        job_state BLOB NOT NULL
+    )
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_apscheduler_jobs_next_run "
+        "ON apscheduler_jobs (next_run_time)"
+    )
+
+
+def _migration_007_drop_per_schedule_jobs(conn):
+    """Remove os jobs reminder_*/prompt_* antigos (agora há um único dispatcher)."""
+    conn.execute(
+        "DELETE FROM apscheduler_jobs "
+        "WHERE id LIKE 'reminder\\_%' ESCAPE '\\' OR id LIKE 'prompt\\_%' ESCAPE '\\'"
+    )
+    conn.execute("UPDATE schedules SET job_id_reminder = NULL, job_id_prompt = NULL")
+
+
+def _migration_008_multi_group(conn):
+    """
+    Suporte a vários grupos: chat_id em todas as tabelas do desafio, ciclos e
+    placares numerados por grupo, e o diretório de grupos -> shard.
+    Os dados existentes pertencem ao grupo principal (GROUP_CHAT_ID).
+    """
+    now = datetime.now(TIMEZONE)
+
+    # Diretório de grupos (lido só no shard 0); os dados antigos ficam no shard 0
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chats (
+        chat_id INTEGER PRIMARY KEY,
+        shard INTEGER NOT NULL,
+        registered_at DATETIME NOT NULL
+    )
+    """
+    )
+    if _active_pool() is _db_pool:
+        conn.execute(
+            "INSERT OR IGNORE INTO chats (chat_id, shard, registered_at) VALUES (?, 0, ?)",
+            (GROUP_CHAT_ID, now),
+        )
+
+    # Participantes de cada grupo (users continua guardando nome/username)
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS chat_members (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        joined_at DATETIME NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO chat_members (chat_id, user_id, joined_at) "
+        "SELECT ?, user_id, ? FROM users",
+        (GROUP_CHAT_ID, now),
+    )
+
+    for table in ("schedules", "submissions", "debts", "pote"):
+        _add_column(conn, table, "chat_id", "INTEGER")
+        conn.execute(
+            f"UPDATE {table} SET chat_id = ? WHERE chat_id IS NULL", (GROUP_CHAT_ID,)
+        )
+
+    # Índices passam a começar pelo grupo
+    for index in (
+        "idx_schedules_user",
+        "idx_submissions_cycle_ts",
+        "idx_submissions_cycle_week_user",
+        "idx_debts_reply",
+        "idx_pote_cycle_user",
+    ):
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_schedules_chat_user "
+        "ON schedules (chat_id, user_id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_chat_cycle_ts "
+        "ON submissions (chat_id, cycle_num, timestamp)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_chat_cycle_week_user "
+        "ON submissions (chat_id, cycle_num, week_num, user_id, points_awarded)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_debts_reply "
+        "ON debts (chat_id, message_id_to_reply, user_id, paid)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_pote_cycle_user "
+        "ON pote (chat_id, cycle_num, user_id, amount)"
+    )
+
+    # Ciclos numerados por grupo: a chave vira (chat_id, cycle_num)
+    conn.execute(
+        """
+    CREATE TABLE cycles_new (
+        chat_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        start_date DATE NOT NULL,
+        end_date DATE NOT NULL,
+        winner_user_id INTEGER,
+        is_active INTEGER DEFAULT 1,
+        PRIMARY KEY (chat_id, cycle_num)
+    )
+    """
+    )
+    conn.execute(
+        "INSERT INTO cycles_new (chat_id, cycle_num, start_date, end_date, winner_user_id, is_active) "
+        "SELECT ?, cycle_num, start_date, end_date, winner_user_id, is_active FROM cycles",
+        (GROUP_CHAT_ID,),
+    )
+    conn.execute("DROP TABLE cycles")
+    conn.execute("ALTER TABLE cycles_new RENAME TO cycles")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_cycles_active "
+        "ON cycles (chat_id, is_active, start_date, end_date)"
+    )
+
+    # Placares com o grupo na chave (recalculados a partir de submissions)
+    conn.execute("DROP TABLE scores")
+    conn.execute("DROP TABLE cycle_scores")
+    conn.execute(
+        """
+    CREATE TABLE scores (
+        chat_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        week_num INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, user_id, cycle_num, week_num)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        """
+    CREATE TABLE cycle_scores (
+        chat_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, cycle_num, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_scores_cycle_week "
+        "ON scores (chat_id, cycle_num, week_num, user_id, points)"
+    )
+    # SQL do schema desta versão (rebuild_scores() acompanha o schema atual)
+    conn.execute(
+        "INSERT INTO scores (chat_id, user_id, cycle_num, week_num, points, submissions) "
+        "SELECT chat_id, user_id, cycle_num, week_num, SUM(points_awarded), COUNT(*) "
+        "FROM submissions GROUP BY chat_id, user_id, cycle_num, week_num"
+    )
+    conn.execute(
+        "INSERT INTO cycle_scores (chat_id, cycle_num, user_id, points, submissions) "
+        "SELECT chat_id, cycle_num, user_id, SUM(points), SUM(submissions) "
+        "FROM scores GROUP BY chat_id, cycle_num, user_id"
+    )
+    conn.execute("ANALYZE")
+
+
+def _migration_009_pote_ledger(conn):
+    """Pote como livro-caixa só de inserção, com saldos correntes por ciclo e usuário."""
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS pote_totals (
+        chat_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        deposits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, cycle_num)
+    ) WITHOUT ROWID
+    """
+    )
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS pote_balances (
+        chat_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        total REAL NOT NULL DEFAULT 0,
+        deposits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, cycle_num, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+    # Lançamentos não são editados: correções entram como valor negativo
+    conn.execute(
+        """
+    CREATE TRIGGER IF NOT EXISTS pote_append_only
+    BEFORE UPDATE ON pote
+    BEGIN
+        SELECT RAISE(ABORT, 'pote é só de inserção');
+    END
+    """
+    )
+    # SQL do schema desta versão (rebuild_pote_balances() acompanha o schema atual)
+    conn.execute(
+        "INSERT INTO pote_balances (chat_id, cycle_num, user_id, total, deposits) "
+        "SELECT chat_id, cycle_num, user_id, SUM(amount), COUNT(*) "
+        "FROM pote GROUP BY chat_id, cycle_num, user_id"
+    )
+    conn.execute(
+        "INSERT INTO pote_totals (chat_id, cycle_num, total, deposits) "
+        "SELECT chat_id, cycle_num, SUM(total), SUM(deposits) "
+        "FROM pote_balances GROUP BY chat_id, cycle_num"
+    )
+
+
+def _migration_010_job_runs(conn):
+    """Execuções dos jobs críticos (para refazer uma única vez as que se perderam)."""
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS job_runs (
+        job_id TEXT NOT NULL,
+        job_name TEXT NOT NULL,
+        scheduled_at REAL NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL,
+        status TEXT NOT NULL DEFAULT 'running',
+        replayed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (job_id, scheduled_at)
+    ) WITHOUT ROWID
+    """
+    )
+
+
+def _migration_011_cycle_archive(conn):
+    """Ciclo nas dívidas, marca de ciclo arquivado e resumo por usuário dos ciclos arquivados."""
+    # Dívidas antigas ficam com cycle_num NULL (não há como saber o ciclo só
+    # pela semana) e continuam na tabela quente.
+    _add_column(conn, "debts", "cycle_num", "INTEGER")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_debts_cycle ON debts (chat_id, cycle_num, paid)"
+    )
+    _add_column(conn, "cycles", "archived_at", "DATETIME")
+    conn.execute(
+        """
+    CREATE TABLE IF NOT EXISTS cycle_summaries (
+        chat_id INTEGER NOT NULL,
+        cycle_num INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        points INTEGER NOT NULL DEFAULT 0,
+        submissions INTEGER NOT NULL DEFAULT 0,
+        pote_total REAL NOT NULL DEFAULT 0,
+        pote_deposits INTEGER NOT NULL DEFAULT 0,
+        debts INTEGER NOT NULL DEFAULT 0,
+        debt_total REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, cycle_num, user_id)
+    ) WITHOUT ROWID
+    """
+    )
+
+
+def _migration_012_restore_pote(conn):
+    """Devolve ao livro-caixa os lançamentos do pote que foram para o arquivo morto."""
+    archived = (
+        conn.execute(
+            "SELECT 1 FROM pragma_database_list WHERE name = 'archive'"
+        ).fetchone()
+        and conn.execute(
+            "SELECT 1 FROM archive.sqlite_master WHERE type = 'table' AND name = 'pote'"
+        ).fetchone()
+    )
+    if not archived:
+        return
+    conn.execute(
+        "INSERT OR IGNORE INTO main.pote "
+        "(deposit_id, chat_id, user_id, amount, timestamp, cycle_num) "
+        "SELECT deposit_id, chat_id, user_id, amount, timestamp, cycle_num "
+        "FROM archive.pote"
+    )
+    # Os saldos desses ciclos tinham sido apagados no arquivamento
+    restored = "(chat_id, cycle_num) IN (SELECT chat_id, cycle_num FROM archive.pote)"
+    conn.execute(f"DELETE FROM pote_balances WHERE {restored}")
+    conn.execute(f"DELETE FROM pote_totals WHERE {restored}")
+    conn.execute(
+        "INSERT INTO pote_balances (chat_id, cycle_num, user_id, total, deposits) "
+        "SELECT chat_id, cycle_num, user_id, SUM(amount), COUNT(*) "
+        f"FROM main.pote WHERE {restored} GROUP BY chat_id, cycle_num, user_id"
+    )
+    conn.execute(
+        "INSERT INTO pote_totals (chat_id, cycle_num, total, deposits) "
+        "SELECT chat_id, cycle_num, SUM(total), SUM(deposits) "
+        f"FROM pote_balances WHERE {restored} GROUP BY chat_id, cycle_num"
+    )
+    conn.execute("DROP TABLE archive.pote")
+
+
+def _migration_013_submissions_page_index(conn):
+    """Paginação de /submissoes por submission_id (o rowid fica no fim do índice)."""
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_submissions_chat_cycle "
+        "ON submissions (chat_id, cycle_num)"
+    )
+
+
+MIGRATIONS = [
+    (1, "schema inicial", _migration_001_initial_schema),
+    (2, "índices das consultas quentes", _migration_002_hot_path_indexes),
+    (3, "índice do relatório semanal", _migration_003_weekly_report_index),
+    (4, "placar materializado", _migration_004_materialized_scores),
+    (5, "janelas de prompt persistentes", _migration_005_prompt_windows),
+    (6, "job store do agendador", _migration_006_scheduler_jobstore),
+    (7, "dispatcher único de horários", _migration_007_drop_per_schedule_jobs),
+    (8, "vários grupos", _migration_008_multi_group),
+    (9, "livro-caixa do pote", _migration_009_pote_ledger),
+    (10, "execuções dos jobs críticos", _migration_010_job_runs),
+    (11, "arquivo morto dos ciclos encerrados", _migration_011_cycle_archive),
+    (12, "pote arquivado de volta ao livro-caixa", _migration_012_restore_pote),
+    (13, "índice da paginação de submissões", _migration_013_submissions_page_index),
+]
+
+
+def get_schema_version() -> int:
+    row = db_query_one("SELECT MAX(version) AS version FROM schema_version")
+    return row["version"] if row and row["version"] else 0
+
+
+def migrate_db():
+    """Aplica as migrações pendentes no banco do shard atual."""
+    db_execute(
+        """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at DATETIME NOT NULL
+    )
+    """
+    )
+    current = get_schema_version()
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with transaction(immediate=True) as conn:
+            drop_archive_views(conn)
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now(TIMEZONE)),
+            )
+            if _active_pool().archive:
+                create_archive_views(conn)
+        logger.info(f"Migração {version} aplicada: {description}")
+
+    logger.info(
+        f"Banco de dados {_active_pool().path} inicializado (schema v{get_schema_version()})."
+    )
+
+
+def assign_chat_shards(chat_ids, shard_count: int) -> dict:
+    """
+    Grava o shard de cada grupo novo (chat_id % shard_count) no diretório do
+    shard 0 e retorna {chat_id: shard}. Um grupo nunca muda de shard sozinho,
+    mesmo que DB_SHARDS mude depois.
+    """
+    now = datetime.now(TIMEZONE)
+    with transaction(immediate=True):
+        db_executemany(
+            "INSERT OR IGNORE INTO chats (chat_id, shard, registered_at) VALUES (?, ?, ?)",
+            [(chat_id, chat_id % shard_count, now) for chat_id in chat_ids],
+        )
+        rows = db_query_all("SELECT chat_id, shard FROM chats")
+    return {row["chat_id"]: row["shard"] for row in rows if row["chat_id"] in chat_ids}
+
+
+def init_db():
+    """Migra o shard 0, distribui os grupos entre os shards e migra os demais."""
+    with use_pool(_db_pool):
+        migrate_db()
+        _chat_shards.clear()
+        _chat_shards.update(assign_chat_shards(GROUP_CHAT_IDS, DB_SHARDS))
+
+    shard_count = max([DB_SHARDS] + [shard + 1 for shard in _chat_shards.values()])
+    for index in range(1, shard_count):
+        with use_pool(open_shard(index).pool):
+            migrate_db()
+
+    for chat_id in GROUP_CHAT_IDS:
+        logger.info(f"Grupo {chat_id} -> shard {_chat_shards[chat_id]}")
+
+
+# --- Placar Materializado (scores / cycle_scores) ---
+# Os totais são mantidos na mesma transação de cada insert/delete em
+# submissions, então leaderboard e vencedor leem O(usuários) linhas.
+
+WEEKLY_SUBMISSION_LIMIT = 2  # Comprovantes que contam por semana
+
+# Total de submissões por (chat_id, cycle_num) para o "Pág X de Y" de
+# /submissoes. Só é recontado depois de um insert/delete em submissions.
+_submission_counts = {}
+
+
+def submission_count(chat_id: int, cycle_num: int) -> int:
+    """Total de submissões do ciclo (em cache até a próxima escrita)."""
+    key = (chat_id, cycle_num)
+    if key not in _submission_counts:
+        row = db_query_one(
+            "SELECT COUNT(*) as count FROM submissions WHERE chat_id = ? AND cycle_num = ?",
+            key,
+        )
+        _submission_counts[key] = row["count"] if row else 0
+    return _submission_counts[key]
+
+
+def _apply_score_delta(
+    chat_id: int, user_id: int, cycle_num: int, week_num: int, points: int, count: int
+):
+    """Soma (ou subtrai) pontos/submissões nos placares semanal e do ciclo."""
+    db_execute(
+        """
+        INSERT INTO scores (chat_id, user_id, cycle_num, week_num, points, submissions)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (chat_id, user_id, cycle_num, week_num) DO UPDATE SET
+            points = points + excluded.points,
+            submissions = submissions + excluded.submissions
+    """,
+        (chat_id, user_id, cycle_num, week_num, points, count),
+    )
+    db_execute(
+        """
+        INSERT INTO cycle_scores (chat_id, cycle_num, user_id, points, submissions)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (chat_id, cycle_num, user_id) DO UPDATE SET
+            points = points + excluded.points,
+            submissions = submissions + excluded.submissions
+    """,
+        (chat_id, cycle_num, user_id, points, count),
+    )
+
+
+def admit_submission(
+    chat_id: int,
+    user_id: int,
+    username: str,
+    first_name: str,
+    points: int,
+    week_num: int,
+    cycle_num: int,
+    close_window: bool = False,
+):
+    """
+    Caminho de escrita de um comprovante de hábito, numa única transação
+    IMMEDIATE: cadastra o usuário e só insere a submissão (fechando a janela
+    de prompt, se havia) se a cota semanal ainda não estiver cheia. A cota é
+    lida do placar materializado (scores.submissions), dentro do próprio
+    INSERT, então duas fotos simultâneas não passam do limite.
+
+    Retorna o novo nº de submissões da semana, ou None se a cota já estava cheia.
+    """
+    with transaction(immediate=True) as conn:
+        register_member(chat_id, user_id, username, first_name)
+        cursor = conn.execute(
+            """
+            INSERT INTO submissions (chat_id, user_id, timestamp, points_awarded, week_num, cycle_num)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE COALESCE((
+                SELECT submissions FROM scores
+                WHERE chat_id = ? AND user_id = ? AND cycle_num = ? AND week_num = ?
+            ), 0) < ?
+        """,
+            (
+                chat_id,
+                user_id,
+                datetime.now(TIMEZONE),
+                points,
+                week_num,
+                cycle_num,
+                chat_id,
+                user_id,
+                cycle_num,
+                week_num,
+                WEEKLY_SUBMISSION_LIMIT,
+            ),
+        )
+        if cursor.rowcount == 0:
+            return None  # A janela continua aberta para um próximo comprovante
+        if close_window:
+            conn.execute(
+                "DELETE FROM prompt_windows WHERE chat_id = ? AND user_id = ?",
+                (chat_id, user_id),
+            )
+        _submission_counts.pop((chat_id, cycle_num), None)
+        render_cache.bump(chat_id)
+        _apply_score_delta(chat_id, user_id, cycle_num, week_num, points, 1)
+        row = db_query_one(
+            "SELECT submissions FROM scores WHERE chat_id = ? AND user_id = ? AND cycle_num = ? AND week_num = ?",
+            (chat_id, user_id, cycle_num, week_num),
+        )
+        return row["submissions"]
+
+
+def delete_submission(chat_id: int, submission_id: int) -> bool:
+    """Apaga uma submissão do grupo e desconta do placar (rodar em transação)."""
+    sub = db_query_one(
+        "SELECT user_id, points_awarded, week_num, cycle_num FROM submissions WHERE submission_id = ? AND chat_id = ?",
+        (submission_id, chat_id),
+    )
+    if not sub:
+        return False
+    db_execute("DELETE FROM submissions WHERE submission_id = ?", (submission_id,))
+    _submission_counts.pop((chat_id, sub["cycle_num"]), None)
+    render_cache.bump(chat_id)
+    _apply_score_delta(
+        chat_id,
+        sub["user_id"],
+        sub["cycle_num"],
+        sub["week_num"],
+        -sub["points_awarded"],
+        -1,
+    )
+    return True
+
+
+_SCORES_FROM_SUBMISSIONS = """
+    SELECT chat_id, user_id, cycle_num, week_num,
+           SUM(points_awarded) AS points, COUNT(*) AS submissions
+    FROM submissions
+    GROUP BY chat_id, user_id, cycle_num, week_num
+"""
+
+
+def rebuild_scores():
+    """Recalcula os placares do zero a partir da tabela submissions."""
+    render_cache.bump_all()
+    with transaction():
+        db_execute("DELETE FROM scores")
+        db_execute("DELETE FROM cycle_scores")
+        db_execute(
+            "INSERT INTO scores (chat_id, user_id, cycle_num, week_num, points, submissions) "
+            + _SCORES_FROM_SUBMISSIONS
+        )
+        db_execute(
+            """
+            INSERT INTO cycle_scores (chat_id, cycle_num, user_id, points, submissions)
+            SELECT chat_id, cycle_num, user_id, SUM(points), SUM(submissions)
+            FROM scores
+            GROUP BY chat_id, cycle_num, user_id
+        """
+        )
+
+
+def verify_scores() -> int:
+    """Compara o placar materializado com submissions. Retorna o nº de linhas divergentes."""
+    row = db_query_one(
+        f"""
+        WITH fresh AS ({_SCORES_FROM_SUBMISSIONS}),
+        stored AS (
+            SELECT chat_id, user_id, cycle_num, week_num, points, submissions
+            FROM scores WHERE submissions != 0 OR points != 0
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM fresh EXCEPT SELECT * FROM stored))
+          + (SELECT COUNT(*) FROM (SELECT * FROM stored EXCEPT SELECT * FROM fresh))
+          + (SELECT COUNT(*) FROM (
+                SELECT chat_id, cycle_num, user_id, points, submissions FROM cycle_scores
+                WHERE submissions != 0 OR points != 0
+                EXCEPT
+                SELECT chat_id, cycle_num, user_id, SUM(points), SUM(submissions)
+                FROM scores GROUP BY chat_id, cycle_num, user_id
+            )) AS drift
+    """
+    )
+    return row["drift"] if row else 0
+
+
+# --- Pote (livro-caixa e saldos correntes) ---
+# A tabela pote é o livro-caixa: só recebe inserts. pote_totals (por ciclo)
+# e pote_balances (por ciclo e usuário) são atualizados na mesma transação
+# de cada depósito, então confirmação, /pote e fim de ciclo não somam nada.
+
+
+def record_pote_deposit(
+    chat_id: int, user_id: int, amount: float, cycle_num: int
+) -> float:
+    """Lança um depósito no pote e atualiza os saldos (rodar em transação). Retorna o total do ciclo."""
+    db_execute(
+        "INSERT INTO pote (chat_id, user_id, amount, timestamp, cycle_num) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, user_id, amount, datetime.now(TIMEZONE), cycle_num),
+    )
+    render_cache.bump(chat_id)
+    db_execute(
+        """
+        INSERT INTO pote_balances (chat_id, cycle_num, user_id, total, deposits)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT (chat_id, cycle_num, user_id) DO UPDATE SET
+            total = total + excluded.total,
+            deposits = deposits + 1
+    """,
+        (chat_id, cycle_num, user_id, amount),
+    )
+    db_execute(
+        """
+        INSERT INTO pote_totals (chat_id, cycle_num, total, deposits)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT (chat_id, cycle_num) DO UPDATE SET
+            total = total + excluded.total,
+            deposits = deposits + 1
+    """,
+        (chat_id, cycle_num, amount),
+    )
+    return pote_total(chat_id, cycle_num)
+
+
+def pote_total(chat_id: int, cycle_num: int) -> float:
+    """Total do pote no ciclo (uma linha de pote_totals)."""
+    row = db_query_one(
+        "SELECT total FROM pote_totals WHERE chat_id = ? AND cycle_num = ?",
+        (chat_id, cycle_num),
+    )
+    return row["total"] if row else 0.0
+
+
+_POTE_FROM_LEDGER = """
+    SELECT chat_id, cycle_num, user_id, ROUND(SUM(amount), 2) AS total, COUNT(*) AS deposits
+    FROM pote
+    GROUP BY chat_id, cycle_num, user_id
+"""
+
+
+def rebuild_pote_balances():
+    """Recalcula os saldos do pote do zero a partir do livro-caixa."""
+    render_cache.bump_all()
+    with transaction():
+        db_execute("DELETE FROM pote_balances")
+        db_execute("DELETE FROM pote_totals")
+        db_execute(
+            "INSERT INTO pote_balances (chat_id, cycle_num, user_id, total, deposits) "
+            + _POTE_FROM_LEDGER
+        )
+        db_execute(
+            """
+            INSERT INTO pote_totals (chat_id, cycle_num, total, deposits)
+            SELECT chat_id, cycle_num, SUM(total), SUM(deposits)
+            FROM pote_balances
+            GROUP BY chat_id, cycle_num
+        """
+        )
+
+
+def verify_pote_balances() -> int:
+    """Compara os saldos com o livro-caixa (centavos). Retorna o nº de linhas divergentes."""
+    row = db_query_one(
+        f"""
+        WITH fresh AS ({_POTE_FROM_LEDGER}),
+        stored AS (
+            SELECT chat_id, cycle_num, user_id, ROUND(total, 2), deposits
+            FROM pote_balances WHERE deposits != 0
+        ),
+        fresh_totals AS (
+            SELECT chat_id, cycle_num, ROUND(SUM(amount), 2), COUNT(*)
+            FROM pote GROUP BY chat_id, cycle_num
+        ),
+        stored_totals AS (
+            SELECT chat_id, cycle_num, ROUND(total, 2), deposits
+            FROM pote_totals WHERE deposits != 0
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM fresh EXCEPT SELECT * FROM stored))
+          + (SELECT COUNT(*) FROM (SELECT * FROM stored EXCEPT SELECT * FROM fresh))
+          + (SELECT COUNT(*) FROM (
+                SELECT * FROM fresh_totals EXCEPT SELECT * FROM stored_totals
+            ))
+          + (SELECT COUNT(*) FROM (
+                SELECT * FROM stored_totals EXCEPT SELECT * FROM fresh_totals
+            )) AS drift
+    """
+    )
+    return row["drift"] if row else 0
+
+
+# --- Arquivo Morto (ciclos encerrados) ---
+# Uma semana depois do fim do ciclo (passados os replays e pagamentos
+# atrasados), as submissões e dívidas pagas do ciclo vão para o arquivo morto
+# anexado (archive.*) e os placares viram uma linha de resumo por usuário em
+# cycle_summaries. Dívidas em aberto ficam na tabela quente até serem pagas.
+# O pote (livro-caixa e saldos) não sai da tabela quente, para o
+# /auditar_pote continuar conferindo todos os ciclos. As views
+# submissions_all/debts_all juntam as duas.
+#
+# O resumo é uma foto do momento do arquivamento: uma dívida paga depois
+# (pay_debt) não muda as colunas debts/debt_total de cycle_summaries.
+
+ARCHIVE_AFTER = timedelta(days=7)
+
+
+def _cycle_filter(table: str) -> str:
+    if table == "debts":
+        return "chat_id = ? AND cycle_num = ? AND paid = 1"
+    return "chat_id = ? AND cycle_num = ?"
+
+
+def archive_cycle(chat_id: int, cycle_num: int):
+    """
+    Arquiva um ciclo encerrado. Retorna {tabela: linhas movidas}, ou None se
+    o ciclo não existe, ainda está ativo ou já foi arquivado.
+
+    Em WAL a transação não é atômica entre dois arquivos, então a cópia é
+    commitada antes: se o processo cair no meio, as linhas ficam nos dois
+    lados e a próxima rodada termina o serviço (a cópia é INSERT OR IGNORE).
+    """
+    cycle = db_query_one(
+        "SELECT is_active, archived_at FROM cycles WHERE chat_id = ? AND cycle_num = ?",
+        (chat_id, cycle_num),
+    )
+    if cycle is None or cycle["is_active"] or cycle["archived_at"]:
+        return None
+    key = (chat_id, cycle_num)
+
+    # 1. Copia as linhas cruas para o arquivo morto (só archive.* é escrito)
+    with transaction(immediate=True) as conn:
+        for table, columns in ARCHIVED_TABLES.items():
+            cols = ", ".join(columns)
+            conn.execute(
+                f"INSERT OR IGNORE INTO archive.{table} ({cols}) "
+                f"SELECT {cols} FROM main.{table} WHERE {_cycle_filter(table)}",
+                key,
+            )
+
+    # 2. Resumo por usuário (foto de agora), apaga as linhas quentes e marca o
+    # ciclo (só main.*)
+    with transaction(immediate=True) as conn:
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO cycle_summaries
+                (chat_id, cycle_num, user_id, points, submissions,
+                 pote_total, pote_deposits, debts, debt_total)
+            SELECT ?, ?, user_id, SUM(points), SUM(submissions),
+                   SUM(pote_total), SUM(pote_deposits), SUM(debts), SUM(debt_total)
+            FROM (
+                SELECT user_id, points, submissions, 0 AS pote_total,
+                       0 AS pote_deposits, 0 AS debts, 0 AS debt_total
+                FROM cycle_scores WHERE chat_id = ? AND cycle_num = ?
+                UNION ALL
+                SELECT user_id, 0, 0, total, deposits, 0, 0
+                FROM pote_balances WHERE chat_id = ? AND cycle_num = ?
+                UNION ALL
+                SELECT user_id, 0, 0, 0, 0, COUNT(*), SUM(amount)
+                FROM debts WHERE chat_id = ? AND cycle_num = ?
+                GROUP BY user_id
+            )
+            GROUP BY user_id
+        """,
+            key * 4,
+        )
+        moved = {}
+        for table in ARCHIVED_TABLES:
+            moved[table] = conn.execute(
+                f"DELETE FROM main.{table} WHERE {_cycle_filter(table)}", key
+            ).rowcount
+        for table in ("scores", "cycle_scores"):
+            conn.execute(
+                f"DELETE FROM {table} WHERE chat_id = ? AND cycle_num = ?", key
+            )
+        conn.execute(
+            "UPDATE cycles SET archived_at = ? WHERE chat_id = ? AND cycle_num = ?",
+            (datetime.now(TIMEZONE), chat_id, cycle_num),
+        )
+    _submission_counts.pop(key, None)
+    render_cache.bump(chat_id)
+    return moved
+
+
+def archive_paid_debts(chat_id: int) -> int:
+    """Move as dívidas de ciclos já arquivados que foram pagas depois do arquivamento."""
+    cols = ", ".join(ARCHIVED_TABLES["debts"])
+    where = (
+        "chat_id = ? AND paid = 1 AND cycle_num IN "
+        "(SELECT cycle_num FROM cycles WHERE chat_id = ? AND archived_at IS NOT NULL)"
+    )
+    with transaction(immediate=True) as conn:
+        conn.execute(
+            f"INSERT OR IGNORE INTO archive.debts ({cols}) "
+            f"SELECT {cols} FROM main.debts WHERE {where}",
+            (chat_id, chat_id),
+        )
+    with transaction(immediate=True) as conn:
+        return conn.execute(
+            f"DELETE FROM main.debts WHERE {where}", (chat_id, chat_id)
+        ).rowcount
+
+
+def archive_closed_cycles(chat_id: int, now: date = None) -> dict:
+    """Arquiva os ciclos do grupo encerrados há mais de ARCHIVE_AFTER. Retorna {ciclo: movidas}."""
+    now = now or datetime.now(TIMEZONE).date()
+    cycles = db_query_all(
+        "SELECT cycle_num FROM cycles WHERE chat_id = ? AND is_active = 0 "
+        "AND archived_at IS NULL AND end_date < ? ORDER BY cycle_num",
+        (chat_id, now - ARCHIVE_AFTER),
+    )
+    archived = {}
+    for row in cycles or []:
+        moved = archive_cycle(chat_id, row["cycle_num"])
+        if moved is not None:
+            archived[row["cycle_num"]] = moved
+    late_debts = archive_paid_debts(chat_id)
+    if late_debts:
+        logger.info(f"Chat {chat_id}: {late_debts} dívidas pagas de ciclos arquivados.")
+    return archived
+
+
+async def run_cycle_archival(context: Application, chat_id: int):
+    """Job diário: leva os ciclos encerrados do grupo para o arquivo morto."""
+    archived = await db_for(chat_id).run(archive_closed_cycles, chat_id)
+    for cycle_num, moved in archived.items():
+        logger.info(f"Chat {chat_id}: ciclo {cycle_num} arquivado ({moved}).")
+
+
+# --- Exportação de Ciclos (/exportar) ---
+# Cada tabela do ciclo é lida por um cursor do SQLite em lotes (fetchmany),
+# passa por um gerador e é gravada direto num .gz temporário. Tudo roda numa
+# thread à parte, fora do worker do shard: a memória não cresce com o
+# tamanho do ciclo e nem o event loop nem as escritas ficam esperando. As
+# views *_all incluem os ciclos que já foram para o arquivo morto.
+
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_BATCH = 1000  # Linhas por fetchmany
+EXPORT_MAX_BYTES = 50 * 1024 * 1024  # Limite de upload de documentos da Bot API
+
+EXPORT_QUERIES = {
+    "submissoes": """
+        SELECT s.submission_id, s.user_id, u.username, u.first_name,
+               s.timestamp, s.week_num, s.points_awarded
+        FROM submissions_all s LEFT JOIN users u ON u.user_id = s.user_id
+        WHERE s.chat_id = ? AND s.cycle_num = ?
+    """,
+    "dividas": """
+        SELECT d.debt_id, d.user_id, u.username, u.first_name,
+               d.week_num, d.amount, d.paid
+        FROM debts_all d LEFT JOIN users u ON u.user_id = d.user_id
+        WHERE d.chat_id = ? AND d.cycle_num = ?
+    """,
+    "pote": """
+        SELECT p.deposit_id, p.user_id, u.username, u.first_name,
+               p.timestamp, p.amount
+        FROM pote p LEFT JOIN users u ON u.user_id = p.user_id
+        WHERE p.chat_id = ? AND p.cycle_num = ?
+    """,
+}
+
+
+def iter_cursor(cursor: sqlite3.Cursor, batch: int = EXPORT_BATCH):
+    """Gera as linhas do cursor em lotes, sem nunca carregar o resultado inteiro."""
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            return
+        yield from rows
+
+
+def _write_csv(f, columns, rows) -> int:
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_jsonl(f, columns, rows) -> int:
+    count = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+EXPORT_WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl}
+
+
+def remove_export_files(files):
+    for _, path, _ in files:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def export_cycle(chat_id: int, cycle_num: int, fmt: str) -> list:
+    """
+    Grava submissões, dívidas e depósitos do ciclo em arquivos .gz temporários
+    (rodar numa thread à parte). Retorna [(tabela, caminho, linhas)]; quem
+    chama apaga os arquivos com remove_export_files().
+    """
+    write = EXPORT_WRITERS[fmt]
+    files = []
+    try:
+        # Uma transação de leitura: as três tabelas saem do mesmo snapshot
+        with use_pool(db_for(chat_id).pool), transaction() as conn:
+            for name, query in EXPORT_QUERIES.items():
+                cursor = conn.execute(query, (chat_id, cycle_num))
+                columns = [column[0] for column in cursor.description]
+                handle, path = tempfile.mkstemp(
+                    prefix=f"exportar_{name}_", suffix=f".{fmt}.gz"
+                )
+                os.close(handle)
+                files.append((name, path, 0))
+                with gzip.open(path, "wt", encoding="utf-8", newline="") as f:
+                    count = write(f, columns, iter_cursor(cursor))
+                files[-1] = (name, path, count)
+    except BaseException:
+        remove_export_files(files)
+        raise
+    return files
+
+
+# --- Cache de Mensagens Renderizadas (/leaderboard e /pote) ---
+
+
+class RenderCache:
+    """
+    Texto já renderizado por (chat, ciclo, visão), carimbado com a versão
+    dos dados do grupo. Toda escrita que muda placar ou pote (submissão
+    inserida/deletada, depósito) incrementa a versão do grupo na mesma
+    transação, e o texto só é refeito quando o carimbo não bate mais.
+    """
+
+    def __init__(self):
+        self._versions = {}  # chat_id -> versão dos dados
+        self._entries = {}  # (chat_id, cycle_num, view) -> (versão, texto)
+        self.hits = 0
+        self.misses = 0
+
+    def version(self, chat_id: int) -> int:
+        return self._versions.get(chat_id, 0)
+
+    def bump(self, chat_id: int):
+        """Invalida as mensagens do grupo (chamado pelo worker do shard do grupo)."""
+        self._versions[chat_id] = self.version(chat_id) + 1
+
+    def bump_all(self):
+        """Invalida todos os grupos (placar/pote reconstruídos pelos admins)."""
+        for chat_id in {key[0] for key in list(self._entries)}:
+            self.bump(chat_id)
+
+    def get(self, chat_id: int, cycle_num: int, view: str):
+        """Texto em cache se ainda estiver na versão atual, senão None."""
+        entry = self._entries.get((chat_id, cycle_num, view))
+        if entry is not None and entry[0] == self.version(chat_id):
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, chat_id: int, cycle_num: int, view: str, version: int, text: str):
+        """Guarda o texto renderizado a partir dos dados da 'version' (lida ANTES da consulta)."""
+        self._entries[(chat_id, cycle_num, view)] = (version, text)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+
+render_cache = RenderCache()
+
+
+# --- Janelas de Prompt (1 hora para ganhar 5 pontos) ---
+
+
+class PromptWindowStore:
+    """
+    Janelas de prompt abertas, persistidas no SQLite.
+
+    A consulta em handle_photo é O(1) num dict em memória; um min-heap por
+    expires_at permite ao sweeper descartar as janelas vencidas sem varrer
+    tudo. No boot, load() recarrega as janelas ainda abertas do banco.
+    """
+
+    def __init__(self, duration: timedelta):
+        self.duration = duration
+        self._open = {}  # (chat_id, user_id) -> expires_at (epoch)
+        self._heap = []  # (expires_at, chat_id, user_id)
+
+    def __len__(self):
+        return len(self._open)
+
+    def _remember(self, chat_id: int, user_id: int, expires_at: float):
+        self._open[(chat_id, user_id)] = expires_at
+        heapq.heappush(self._heap, (expires_at, chat_id, user_id))
+
+    async def load(self):
+        """Recarrega as janelas abertas (e apaga as que venceram com o bot parado)."""
+        now = datetime.now(TIMEZONE).timestamp()
+        self._open.clear()
+        self._heap.clear()
+        for shard in _shards:
+            await shard.execute(
+                "DELETE FROM prompt_windows WHERE expires_at <= ?", (now,)
+            )
+            rows = await shard.fetch_all(
+                "SELECT chat_id, user_id, expires_at FROM prompt_windows"
+            )
+            for row in rows or []:
+                self._remember(row["chat_id"], row["user_id"], row["expires_at"])
+        logger.info(f"{len(self._open)} janela(s) de prompt recarregada(s) do banco.")
+
+    async def open(self, chat_id: int, user_id: int):
+        """Abre (ou reabre) a janela do usuário a partir de agora."""
+        opened_at = datetime.now(TIMEZONE)
+        expires_at = (opened_at + self.duration).timestamp()
+        self._remember(chat_id, user_id, expires_at)
+        await db_for(chat_id).execute(
+            "INSERT OR REPLACE INTO prompt_windows (chat_id, user_id, opened_at, expires_at) VALUES (?, ?, ?, ?)",
+            (chat_id, user_id, opened_at, expires_at),
+        )
+
+    def check(self, chat_id: int, user_id: int):
+        """Retorna (havia janela, dentro do prazo) sem fechar a janela."""
+        expires_at = self._open.get((chat_id, user_id))
+        if expires_at is None:
+            return False, False
+        return True, datetime.now(TIMEZONE).timestamp() < expires_at
+
+    def close(self, chat_id: int, user_id: int):
+        """
+        Fecha a janela só na memória, depois que o comprovante foi aceito; a
+        linha do banco é apagada por admit_submission, na mesma transação.
+        """
+        self._open.pop((chat_id, user_id), None)
+
+    async def sweep(self):
+        """Descarta proativamente as janelas vencidas (memória e banco)."""
+        now = datetime.now(TIMEZONE).timestamp()
+        expired = 0
+        shards = set()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, chat_id, user_id = heapq.heappop(self._heap)
+            # Entradas antigas do heap (janela reaberta depois) são só ignoradas
+            if self._open.get((chat_id, user_id)) == expires_at:
+                del self._open[(chat_id, user_id)]
+                shards.add(db_for(chat_id))
+                expired += 1
+        for shard in shards:
+            await shard.execute(
+                "DELETE FROM prompt_windows WHERE expires_at <= ?", (now,)
+            )
+        if expired:
+            logger.info(f"{expired} janela(s) de prompt expirada(s) removida(s).")
+
+
+prompt_windows = PromptWindowStore(PROMPT_WINDOW)
+
+
+async def sweep_prompt_windows(context: Application):
+    """Job periódico do sweeper de janelas de prompt."""
+    await prompt_windows.sweep()
+
+
+# --- Latência de Atendimento (chegada do update -> primeira resposta) ---
+
+
+class UpdateTiming:
+    """Momento em que um update chegou e quando saiu a primeira resposta a ele."""
+
+    __slots__ = ("arrived", "replied")
+
+    def __init__(self, arrived: float):
+        self.arrived = arrived
+        self.replied = None
+
+
+class LatencyWindow:
+    """Janela das últimas N amostras de latência, com percentis."""
+
+    def __init__(self, size: int = 1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict:
+        values = sorted(self.samples)
+
+        def pct(p):
+            return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+        return {
+            "count": self.count,
+            "avg": sum(values) / len(values) if values else 0.0,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": values[-1] if values else 0.0,
+        }
+
+
+# Timing do update sendo processado (definido pelo handler do grupo -1)
+_update_timing = ContextVar("update_timing", default=None)
+_update_arrivals = {}  # update_id -> monotonic() da chegada pelo webhook
+reply_latency = LatencyWindow()
+
+
+async def track_update_arrival(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Roda antes de todos os handlers. No webhook a chegada é o momento em que
+    o POST foi recebido; no polling, o início do processamento.
+    """
+    arrived = _update_arrivals.pop(update.update_id, None)
+    _update_timing.set(UpdateTiming(arrived if arrived is not None else monotonic()))
+
+
+# --- Fila de Envio para o Telegram (Rate Limit) ---
+# Todo envio passa por aqui: token buckets global e por chat, back-off
+# automático em RetryAfter e prioridade para prompts/lembretes.
+
+
+class TokenBucket:
+    """Token bucket simples: 'rate' tokens por segundo, até 'capacity' acumulados."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0  # Pausa imposta por um RetryAfter
+
+    def delay(self, now: float) -> float:
+        """Segundos até haver um token disponível (0 = pode enviar agora)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class Outbox:
+    """
+    Fila central de mensagens de saída com faixas de prioridade.
+
+    Um único worker escolhe a próxima mensagem da faixa mais urgente cujo
+    chat (e o bucket global) tenha token disponível, e dispara o envio em
+    uma task própria. Em RetryAfter o chat é pausado pelo tempo pedido e a
+    mensagem volta para o início da fila.
+    """
+
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.lanes = {priority: deque() for priority in PRIORITY_NAMES}
+        self._wakeup = None
+        self._task = None
+        self.sent = 0
+        self.retries = 0
+        self.failures = 0
+        self.waits = {priority: deque(maxlen=500) for priority in PRIORITY_NAMES}
+
+    def enqueue(self, chat_id: int, factory, priority: int = None) -> asyncio.Future:
+        """
+        Enfileira 'factory' (função que retorna a corrotina do envio) e
+        devolve o future do resultado. Cancelar o future tira a mensagem da
+        fila (ex: job que estourou o timeout).
+        """
+        if priority is None:
+            priority = PRIORITY_INTERACTIVE
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        item = {
+            "chat_id": chat_id,
+            "factory": factory,
+            "future": future,
+            "priority": priority,
+            "enqueued": monotonic(),
+            "not_before": 0.0,
+            "attempts": 0,
+            "timing": _update_timing.get(),  # Update que originou o envio (se houver)
+        }
+        future.add_done_callback(functools.partial(self._forget, item))
+        self.lanes[priority].append(item)
+        self._wakeup.set()
+        return future
+
+    async def submit(self, chat_id: int, factory, priority: int = None):
+        """Enfileira e espera o envio. Se quem espera for cancelado, a mensagem não sai."""
+        return await self.enqueue(chat_id, factory, priority)
+
+    def _forget(self, item, future: asyncio.Future):
+        if not future.cancelled():
+            return
+        try:
+            self.lanes[item["priority"]].remove(item)
+        except ValueError:
+            pass  # Já saiu da fila (em envio ou esperando um RetryAfter)
+
+    def depth(self) -> int:
+        return sum(len(lane) for lane in self.lanes.values())
+
+    def stats(self) -> dict:
+        """Profundidade e tempo de espera na fila, por faixa de prioridade."""
+        lanes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            waits = sorted(self.waits[priority])
+            lanes[name] = {
+                "depth": len(self.lanes[priority]),
+                "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "wait_max": waits[-1] if waits else 0.0,
+            }
+        return {
+            "lanes": lanes,
+            "sent": self.sent,
+            "retries": self.retries,
+            "failures": self.failures,
+            "chats": len(self.chat_buckets),
+        }
+
+    def _ensure_worker(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _next_ready(self, now: float):
+        """Escolhe o próximo item enviável. Retorna (lane, item) ou (None, espera)."""
+        min_wait = float("inf")
+        blocked_chats = set()
+        for priority in sorted(self.lanes):
+            lane = self.lanes[priority]
+            for item in lane:
+                chat_id = item["chat_id"]
+                if chat_id in blocked_chats:
+                    continue
+                wait = max(
+                    self._chat_bucket(chat_id).delay(now), item["not_before"] - now
+                )
+                if wait <= 0:
+                    return lane, item
+                blocked_chats.add(chat_id)
+                min_wait = min(min_wait, wait)
+        return None, min_wait
+
+    async def _worker(self):
+        while True:
+            if not self.depth():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = monotonic()
+            wait = self.global_bucket.delay(now)
+            lane = None
+            if wait <= 0:
+                lane, item_or_wait = self._next_ready(now)
+                if lane is None:
+                    wait = item_or_wait
+
+            if lane is None:
+                # Nada enviável agora: dorme até o próximo token (ou um novo item)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            item = item_or_wait
+            lane.remove(item)
+            self.global_bucket.consume()
+            self._chat_bucket(item["chat_id"]).consume()
+            if item["attempts"] == 0:
+                self.waits[item["priority"]].append(now - item["enqueued"])
+            asyncio.get_running_loop().create_task(self._dispatch(item))
+
+    async def _dispatch(self, item):
+        if item["future"].cancelled():
+            return  # Cancelado entre a escolha e o envio
+        item["attempts"] += 1
+        try:
+            result = await item["factory"]()
+        except RetryAfter as e:
+            seconds = _retry_after_seconds(e)
+            self.retries += 1
+            self._chat_bucket(item["chat_id"]).block(monotonic(), seconds)
+            if item["future"].cancelled():
+                return
+            if item["attempts"] < self.MAX_ATTEMPTS:
+                logger.warning(
+                    f"RetryAfter de {seconds:.0f}s no chat {item['chat_id']}; reenfileirando."
+                )
+                item["not_before"] = monotonic() + seconds
+                self.lanes[item["priority"]].appendleft(item)
+                self._wakeup.set()
+                return
+            self.failures += 1
+            if not item["future"].done():
+                item["future"].set_exception(e)
+        except Exception as e:
+            self.failures += 1
+            if not item["future"].done():
+                item["future"].set_exception(e)
+        else:
+            self.sent += 1
+            timing = item["timing"]
+            if timing is not None and timing.replied is None:
+                timing.replied = monotonic()
+                reply_latency.record(timing.replied - timing.arrived)
+            if not item["future"].done():
+                item["future"].set_result(result)
+
+
+outbox = Outbox(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    chat_rate=OUTBOX_CHAT_PER_MINUTE / 60,
+    chat_burst=OUTBOX_CHAT_BURST,
+)
+
+
+# Os helpers abaixo só enfileiram e retornam None: um handler não fica
+# esperando o bucket do chat (nem segurando o slot do update) por causa de
+# uma confirmação. Com wait=True esperam o envio e retornam a Message -
+# para quando o message_id importa, ou para que cancelar quem chamou (ex:
+# timeout de job) tire da fila o que ainda não saiu.
+
+
+def _log_send_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Falha ao enviar mensagem: {future.exception()}")
+
+
+async def _deliver(chat_id: int, factory, priority: int, wait: bool):
+    future = outbox.enqueue(chat_id, factory, priority)
+    if wait:
+        return await future
+    future.add_done_callback(_log_send_failure)
+    return None
+
+
+async def send_message(
+    bot, chat_id: int, text: str, priority: int = None, wait: bool = False, **kwargs
+):
+    """bot.send_message passando pela fila de envio."""
+    return await _deliver(
+        chat_id,
+        lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs),
+        priority,
+        wait,
+    )
+
+
+async def reply_text(
+    message, text: str, priority: int = None, wait: bool = False, **kwargs
+):
+    """message.reply_text passando pela fila de envio."""
+    return await _deliver(
+        message.chat_id, lambda: message.reply_text(text, **kwargs), priority, wait
+    )
+
+
+async def reply_document(
+    message, document, priority: int = None, wait: bool = False, **kwargs
+):
+    """message.reply_document passando pela fila de envio."""
+    return await _deliver(
+        message.chat_id,
+        lambda: message.reply_document(document, **kwargs),
+        priority,
+        wait,
+    )
+
+
+async def edit_message_text(
+    query, text: str, priority: int = None, wait: bool = False, **kwargs
+):
+    """query.edit_message_text passando pela fila de envio."""
+    return await _deliver(
+        query.message.chat_id,
+        lambda: query.edit_message_text(text, **kwargs),
+        priority,
+        wait,
+    )
+
+
+# --- Job Store do APScheduler no SQLite ---
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """
+    Job store do APScheduler persistido no próprio bot.db (tabela apscheduler_jobs).
+    Mesmo formato do SQLAlchemyJobStore: estado do job serializado com pickle
+    e next_run_time indexado como timestamp UTC.
+
+    O APScheduler chama o job store de forma síncrona, no event loop, a cada
+    disparo. Por isso quem responde é o índice em memória do MemoryJobStore
+    (jobs ordenados por próximo horário), e o SQLite só recebe as alterações,
+    gravadas pelo worker do banco sem o loop esperar (na ordem em que
+    aconteceram). O banco é lido uma vez, em load(), antes do scheduler.start().
+    """
+
+    def __init__(self, db: AsyncDB, pickle_protocol=pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db = db
+        self.pickle_protocol = pickle_protocol
+        self._stored = None  # [(id, estado)] lidos por load(), restaurados no start()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    async def load(self):
+        """Lê e despickla os jobs persistidos no worker do banco."""
+        self._stored = await self.db.run(self._read_states)
+
+    @staticmethod
+    def _read_states():
+        states = []
+        rows = db_query_all(
+            "SELECT id, job_state FROM apscheduler_jobs ORDER BY next_run_time"
+        )
+        for row in rows or []:
+            try:
+                states.append((row["id"], pickle.loads(row["job_state"])))
+            except BaseException:
+                logger.exception(
+                    f'Não foi possível restaurar o job "{row["id"]}" -- removendo'
+                )
+                db_execute("DELETE FROM apscheduler_jobs WHERE id = ?", (row["id"],))
+        return states
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        if self._stored is None:
+            # Sem load() (scheduler iniciado fora do post_init): lê aqui mesmo
+            with use_pool(self.db.pool):
+                self._stored = self._read_states()
+        for job_id, job_state in self._stored:
+            try:
+                job = self._restore(job_state)
+            except BaseException:
+                self._logger.exception(
+                    f'Não foi possível restaurar o job "{job_id}" -- removendo'
+                )
+                self._write(self._delete_state, job_id)
+                continue
+            super().add_job(job)
+        self._stored = []
+
+    def _restore(self, job_state):
+        job_state["jobstore"] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    # --- Escritas (memória já, banco pelo worker) ---
+
+    def add_job(self, job):
+        super().add_job(job)  # ConflictingIdError se o id já existe
+        self._save(job)
+
+    def update_job(self, job):
+        super().update_job(job)  # JobLookupError se o job não existe
+        self._save(job)
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._write(self._delete_state, job_id)
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._write(db_execute, "DELETE FROM apscheduler_jobs")
+
+    def shutdown(self):
+        MemoryJobStore.remove_all_jobs(self)  # Só a memória: os jobs continuam no banco
+
+    def _save(self, job):
+        # O pickle também fica para o worker; o estado é um snapshot do job
+        self._write(
+            self._store_state,
+            job.id,
+            datetime_to_utc_timestamp(job.next_run_time),
+            job.__getstate__(),
+            self.pickle_protocol,
+        )
+
+    @staticmethod
+    def _store_state(job_id, next_run_time, job_state, protocol):
+        db_execute(
+            "INSERT OR REPLACE INTO apscheduler_jobs (id, next_run_time, job_state) VALUES (?, ?, ?)",
+            (job_id, next_run_time, pickle.dumps(job_state, protocol)),
+        )
+
+    @staticmethod
+    def _delete_state(job_id):
+        db_execute("DELETE FROM apscheduler_jobs WHERE id = ?", (job_id,))
+
+    def _write(self, func, *args):
+        self.db.submit_write(func, *args).add_done_callback(self._log_write_error)
+
+    def _log_write_error(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._logger.error(f"Falha ao gravar o job store: {future.exception()}")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} (path={self.db.pool.path})>"
+
+
+# --- Funções Principais do Agendador (APScheduler) ---
 
 
-def db_query_all(query, params=()):
-    """Função helper para buscar múltiplos resultados no DB."""
-    try:
-        conn = sqlite3.connect("data/bot.db")
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        result = cursor.fetchall()
-        conn.close()
-        return result
-    except sqlite3.Error as e:
-        logger.error(f"Erro no DB (query_all): {e}")
-        return None
+def get_current_week(moment: datetime = None):
+    """Retorna o número da semana do ano (ISO) de agora (ou de 'moment')."""
+    moment = moment.astimezone(TIMEZONE) if moment else datetime.now(TIMEZONE)
+    return moment.isocalendar()[1]
 
 
-# --- Funções Principais do Agendador (APScheduler) ---
+# Contexto do ciclo ativo de um grupo: (número, início, fim). cycle_num=None
+# significa "nenhum ciclo ativo hoje" (e o cache vale só até o fim do dia).
+CycleContext = namedtuple("CycleContext", "cycle_num start_date end_date")
+
+_cycle_cache = {}  # chat_id -> CycleContext
+_cycle_cache_lock = threading.Lock()
 
 
-def get_current_week():
-    """Retorna o número da semana do ano (ISO)."""
-    return datetime.now(TIMEZONE).isocalendar()[1]
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
 
 
-def get_current_cycle():
-    """Retorna o ciclo ativo ou cria um novo."""
-    now = datetime.now(TIMEZONE).date()
+def _load_cycle_context(chat_id: int, now: date) -> CycleContext:
+    """Busca o ciclo ativo do grupo no banco, ou cria um novo."""
     cycle = db_query_one(
-        "SELECT * FROM cycles WHERE is_active = 1 AND start_date <= ? AND end_date >= ?",
-        (now, now),
+        "SELECT * FROM cycles WHERE chat_id = ? AND is_active = 1 AND start_date <= ? AND end_date >= ?",
+        (chat_id, now, now),
     )
 
     if cycle:
-        return cycle["cycle_num"]
+        return CycleContext(
+            cycle["cycle_num"],
+            _as_date(cycle["start_date"]),
+            _as_date(cycle["end_date"]),
+        )
 
     # Se não há ciclo ativo, cria um novo
-    db_execute("UPDATE cycles SET is_active = 0")  # Desativa antigos
+    db_execute(
+        "UPDATE cycles SET is_active = 0 WHERE chat_id = ?", (chat_id,)
+    )  # Desativa antigos
 
     # Lógica de início: 01/11/25
     # Este é um exemplo, você pode querer uma lógica mais robusta
@@ -268,60 +2860,222 @@ def get_current_cycle():
         # Lógica de parada 31/12/26
         if start_date > datetime(2026, 12, 31).date():
             logger.warning("O período do desafio terminou.")
-            return None
+            return CycleContext(None, now, now)
+
+    # Ciclos são numerados por grupo (1, 2, 3...)
+    last = db_query_one(
+        "SELECT MAX(cycle_num) AS last FROM cycles WHERE chat_id = ?", (chat_id,)
+    )
+    new_cycle_id = (last["last"] or 0) + 1 if last else 1
+    db_execute(
+        "INSERT INTO cycles (chat_id, cycle_num, start_date, end_date, is_active) VALUES (?, ?, ?, ?, 1)",
+        (chat_id, new_cycle_id, start_date, end_date),
+    )
+    logger.info(
+        f"Novo ciclo {new_cycle_id} criado no chat {chat_id}. De {start_date} até {end_date}"
+    )
+    return CycleContext(new_cycle_id, start_date, end_date)
+
+
+def _cached_cycle_context(chat_id: int):
+    """Retorna o contexto em cache se ele ainda vale para hoje (sem tocar no banco)."""
+    cached = _cycle_cache.get(chat_id)
+    if cached is None:
+        return None
+    today = datetime.now(TIMEZONE).date()
+    if cached.start_date <= today <= cached.end_date:
+        return cached
+    return None
+
+
+def get_cycle_context(chat_id: int) -> CycleContext:
+    """Contexto do ciclo ativo do grupo. Só consulta o banco quando o cache expira."""
+    cached = _cached_cycle_context(chat_id)
+    if cached is not None:
+        return cached
+    with _cycle_cache_lock:
+        cached = _cached_cycle_context(chat_id)  # Outra thread pode ter carregado
+        if cached is None:
+            cached = _load_cycle_context(chat_id, datetime.now(TIMEZONE).date())
+            _cycle_cache[chat_id] = cached
+        return cached
+
+
+def invalidate_cycle_cache(chat_id: int):
+    """Descarta o ciclo em cache do grupo (ex: quando o ciclo é encerrado)."""
+    with _cycle_cache_lock:
+        _cycle_cache.pop(chat_id, None)
+
+
+def get_current_cycle(chat_id: int):
+    """Retorna o ciclo ativo do grupo ou cria um novo (rodar no shard do grupo)."""
+    return get_cycle_context(chat_id).cycle_num
+
+
+async def current_cycle_context(chat_id: int) -> CycleContext:
+    """Versão para os handlers: só passa pelo worker do DB quando o cache expira."""
+    cached = _cached_cycle_context(chat_id)
+    if cached is not None:
+        return cached
+    return await db_for(chat_id).run(get_cycle_context, chat_id)
+
+
+async def current_cycle(chat_id: int):
+    """Número do ciclo ativo do grupo (ou None), sem tocar no banco no caminho quente."""
+    return (await current_cycle_context(chat_id)).cycle_num
 
-    new_cycle_id = db_execute(
-        "INSERT INTO cycles (start_date, end_date, is_active) VALUES (?, ?, 1)",
-        (start_date, end_date),
+
+async def _first_name(chat_id: int, user_id: int):
+    user = await db_for(chat_id).fetch_one(
+        "SELECT first_name FROM users WHERE user_id = ?", (user_id,)
     )
-    logger.info(f"Novo ciclo {new_cycle_id} criado. De {start_date} até {end_date}")
-    return new_cycle_id
+    return user["first_name"] if user else None
 
 
-async def send_reminder(context: Application, user_id: int, chat_id: int):
+async def send_reminder(
+    context: Application, user_id: int, chat_id: int, first_name: str = None
+):
     """Envia o lembrete de 15 minutos."""
-    user = db_query_one("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    if first_name is None:
+        first_name = await _first_name(chat_id, user_id)
 
-    if user:
-        await context.bot.send_message(
+    if first_name:
+        await send_message(
+            context.bot,
             chat_id=chat_id,
-            text=f"Ei <a href='tg://user?id={user_id}'>{user['first_name']}</a>, seu horário de dedicação começa em 15 minutos! 🚀",
+            text=f"Ei <a href='tg://user?id={user_id}'>{first_name}</a>, seu horário de dedicação começa em 15 minutos! 🚀",
             parse_mode=ParseMode.HTML,
+            priority=PRIORITY_CRITICAL,
         )
 
 
-async def send_prompt(context: Application, user_id: int, chat_id: int):
+async def send_prompt(
+    context: Application, user_id: int, chat_id: int, first_name: str = None
+):
     """Envia o pedido de comprovante na hora H."""
-    user = db_query_one("SELECT * FROM users WHERE user_id = ?", (user_id,))
-
-    if user:
-        # Armazena que este usuário está na "janela de 1 hora"
-        # Usamos context.bot_data, que é editável a partir do Application
-        # Criamos uma chave única combinando chat_id e user_id
-        prompt_key = f"prompt_{chat_id}_{user_id}"
+    if first_name is None:
+        first_name = await _first_name(chat_id, user_id)
 
-        context.bot_data[prompt_key] = {"time": datetime.now(TIMEZONE)}
+    if first_name:
+        # Abre a "janela de 1 hora" deste usuário (persistida no banco)
+        await prompt_windows.open(chat_id, user_id)
 
-        logger.info(f"Janela de prompt ativada para {prompt_key}")
+        logger.info(f"Janela de prompt ativada para chat {chat_id}, user {user_id}")
 
-        await context.bot.send_message(
+        await send_message(
+            context.bot,
             chat_id=chat_id,
-            text=f"Olá <a href='tg://user?id={user_id}'>{user['first_name']}</a>! 🌟\n\nÉ hora de começar sua 1h de foco no projeto. Você tem 1 hora a partir de agora para me enviar um print + descrição do que está fazendo para ganhar <b>5 pontos</b>.\n\nBoa sorte!",
+            text=f"Olá <a href='tg://user?id={user_id}'>{first_name}</a>! 🌟\n\nÉ hora de começar sua 1h de foco no projeto. Você tem 1 hora a partir de agora para me enviar um print + descrição do que está fazendo para ganhar <b>5 pontos</b>.\n\nBoa sorte!",
             parse_mode=ParseMode.HTML,
+            priority=PRIORITY_CRITICAL,
+        )
+
+
+def create_weekly_debts(chat_id: int, cycle_num: int, week_num: int, debts) -> int:
+    """
+    Grava as dívidas da semana antes de qualquer cobrança (message_id NULL
+    até a cobrança sair). Quem já tem dívida nesta semana do ciclo fica de
+    fora, então rodar o relatório de novo não duplica. Retorna quantas criou.
+    """
+    existing = db_query_all(
+        "SELECT user_id FROM debts WHERE chat_id = ? AND cycle_num = ? AND week_num = ?",
+        (chat_id, cycle_num, week_num),
+    )
+    charged = {row["user_id"] for row in existing or []}
+    rows = [
+        (chat_id, debt["user_id"], week_num, debt["amount"], cycle_num)
+        for debt in debts
+        if debt["user_id"] not in charged
+    ]
+    db_executemany(
+        "INSERT INTO debts (chat_id, user_id, week_num, amount, message_id_to_reply, paid, cycle_num) VALUES (?, ?, ?, ?, NULL, 0, ?)",
+        rows,
+    )
+    return len(rows)
+
+
+async def _send_debt_charge(
+    context: Application, chat_id: int, debt, limit: asyncio.Semaphore
+) -> bool:
+    """Envia uma cobrança e grava o message_id na dívida. Retorna False se falhar."""
+    user_id = debt["user_id"]
+    amount = debt["amount"]
+    async with limit:
+        try:
+            msg = await send_message(
+                context.bot,
+                chat_id=chat_id,
+                text=f"<a href='tg://user?id={user_id}'>{debt['name']}</a>, sua contribuição ... é de <b>R$ {amount:.2f}</b>. \n\nPor favor, responda a esta mensagem com o comprovante.",
+                parse_mode=ParseMode.HTML,
+                priority=PRIORITY_BULK,
+                wait=True,
+            )
+        except Exception as e:
+            logger.error(f"Falha ao enviar cobrança para user {user_id}: {e}")
+            return False
+    # Gravado já: se o job for cancelado depois, esta cobrança não sai de novo
+    await db_for(chat_id).execute(
+        "UPDATE debts SET message_id_to_reply = ? WHERE debt_id = ?",
+        (msg.message_id, debt["debt_id"]),
+    )
+    return True
+
+
+_charge_locks = {}  # chat_id -> asyncio.Lock (uma rodada de cobranças por vez)
+
+
+async def send_pending_charges(context: Application, chat_id: int):
+    """
+    Envia as cobranças das dívidas em aberto que ainda não têm mensagem: as
+    recém-criadas e as que falharam (ou foram interrompidas) antes. Roda no
+    relatório semanal e de novo no relatório diário. Retorna (enviadas, total).
+    """
+    lock = _charge_locks.setdefault(chat_id, asyncio.Lock())
+    async with lock:
+        pending = await db_for(chat_id).fetch_all(
+            """
+            SELECT d.debt_id, d.user_id, d.amount, u.first_name AS name
+            FROM debts d
+            JOIN users u ON u.user_id = d.user_id
+            WHERE d.chat_id = ? AND d.message_id_to_reply IS NULL AND d.paid = 0
+            ORDER BY d.debt_id
+        """,
+            (chat_id,),
         )
+        if not pending:
+            return 0, 0
+        # Em paralelo, com limite de envios simultâneos
+        limit = asyncio.Semaphore(WEEKLY_REPORT_SEND_CONCURRENCY)
+        results = await asyncio.gather(
+            *(_send_debt_charge(context, chat_id, debt, limit) for debt in pending)
+        )
+    return sum(results), len(pending)
 
 
-async def run_weekly_report(context: Application):
+async def run_weekly_report(context: Application, chat_id: int):
     """Roda no final do Domingo. Calcula pontos, dívidas e envia o leaderboard."""
-    chat_id = GROUP_CHAT_ID
-    week_num = get_current_week()
-    cycle_num = get_current_cycle()
+    db = db_for(chat_id)
+    week_num = get_current_week(job_reference_time())
+    cycle_num = await job_cycle(chat_id)
     if not cycle_num:
         return
 
-    logger.info(f"Rodando relatório semanal para a semana {week_num}...")
+    logger.info(f"Rodando relatório semanal do chat {chat_id}, semana {week_num}...")
 
-    users = db_query_all("SELECT * FROM users")
+    # Uma única consulta: participantes do grupo + placar da semana (0 se não enviou)
+    users = await db.fetch_all(
+        """
+        SELECT u.user_id, u.first_name, COALESCE(s.points, 0) AS points
+        FROM chat_members m
+        JOIN users u ON u.user_id = m.user_id
+        LEFT JOIN scores s
+            ON s.chat_id = m.chat_id AND s.user_id = m.user_id
+            AND s.cycle_num = ? AND s.week_num = ?
+        WHERE m.chat_id = ?
+        ORDER BY points DESC, u.user_id
+    """,
+        (cycle_num, week_num, chat_id),
+    )
     if not users:
         return
 
@@ -329,13 +3083,7 @@ async def run_weekly_report(context: Application):
     debts_to_create = []
 
     for user in users:
-        user_id = user["user_id"]
-        # Calcula pontos da semana
-        points_row = db_query_one(
-            "SELECT SUM(points_awarded) as total FROM submissions WHERE user_id = ? AND week_num = ? AND cycle_num = ?",
-            (user_id, week_num, cycle_num),
-        )
-        points_this_week = points_row["total"] if points_row["total"] else 0
+        points_this_week = user["points"]
 
         # Calcula aposta (dívida)
         debt_amount = max(0, 50 - (points_this_week * 5))
@@ -349,12 +3097,23 @@ async def run_weekly_report(context: Application):
         )
 
         if debt_amount > 0:
-            debts_to_create.append({"user_id": user_id, "amount": debt_amount})
+            debts_to_create.append(
+                {
+                    "user_id": user["user_id"],
+                    "name": user["first_name"],
+                    "week_num": week_num,
+                    "amount": debt_amount,
+                }
+            )
 
-    # Ordena o leaderboard
-    leaderboard.sort(key=lambda x: x["points"], reverse=True)
+    # As dívidas são gravadas antes de qualquer envio: nem uma cobrança que
+    # falhe nem o timeout do job fazem a dívida da semana sumir
+    if debts_to_create:
+        await db.run_in_transaction(
+            create_weekly_debts, chat_id, cycle_num, week_num, debts_to_create
+        )
 
-    # Monta a mensagem do leaderboard
+    # Monta a mensagem do leaderboard (já vem ordenado do banco)
     text = f"🏆 <b>Leaderboard da Semana {week_num}</b> 🏆\n\n"
     for i, entry in enumerate(leaderboard):
         emoji = ["🥇", "🥈", "🥉"][i] if i < 3 else "🔹"
@@ -371,50 +3130,36 @@ async def run_weekly_report(context: Application):
                 text += f"• {entry['name']}: R$ {entry['debt']:.2f}\n"
         text += "\nPor favor, enviem o comprovante do PIX/depósito respondendo à mensagem de cobrança que vou enviar a seguir."
 
-    await context.bot.send_message(
-        chat_id=chat_id, text=text, parse_mode=ParseMode.HTML
+    await send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=text,
+        parse_mode=ParseMode.HTML,
+        priority=PRIORITY_BULK,
+        wait=True,
     )
 
-    # Envia as mensagens de cobrança individuais e salva no DB
-    for debt in debts_to_create:
-        user_id = debt["user_id"]
-        amount = debt["amount"]
-        user = db_query_one("SELECT * FROM users WHERE user_id = ?", (user_id,))
-
-        msg = await context.bot.send_message(
-            chat_id=chat_id,
-            text=f"<a href='tg://user?id={user_id}'>{user['first_name']}</a>, sua contribuição ... é de <b>R$ {amount:.2f}</b>. \n\nPor favor, responda a esta mensagem com o comprovante.",
-            parse_mode=ParseMode.HTML,
-        )
-
-        # Salva a dívida no banco com o ID da mensagem para futura verificação
-        db_execute(
-            "INSERT INTO debts (user_id, week_num, amount, message_id_to_reply, paid) VALUES (?, ?, ?, ?, 0)",
-            (user_id, week_num, amount, msg.message_id),
-        )
+    if not debts_to_create:
+        return
 
+    # As cobranças saem depois; o message_id de cada uma é gravado ao sair
+    sent, total = await send_pending_charges(context, chat_id)
+    logger.info(f"Relatório semanal: {sent}/{total} cobranças enviadas.")
 
-async def run_daily_pote_report(context: Application):
-    """Envia a contabilidade do pote no final do dia."""
-    chat_id = GROUP_CHAT_ID
-    cycle_num = get_current_cycle()
-    if not cycle_num:
-        return
 
-    total_row = db_query_one(
-        "SELECT SUM(amount) as total FROM pote WHERE cycle_num = ?", (cycle_num,)
-    )
-    total_in_pote = total_row["total"] if total_row["total"] else 0.0
+async def render_pote_report(db: AsyncDB, chat_id: int, cycle_num: int) -> str:
+    """Monta o texto da contabilidade do pote a partir dos saldos."""
+    total_in_pote = await db.run(pote_total, chat_id, cycle_num)
 
-    contributions = db_query_all(
+    contributions = await db.fetch_all(
         """
-        SELECT u.first_name, SUM(p.amount) as total_contributed
-        FROM pote p
-        JOIN users u ON p.user_id = u.user_id
-        WHERE p.cycle_num = ?
-        GROUP BY u.user_id
+        SELECT u.first_name, pb.total as total_contributed
+        FROM pote_balances pb
+        JOIN users u ON pb.user_id = u.user_id
+        WHERE pb.chat_id = ? AND pb.cycle_num = ? AND pb.deposits > 0
+        ORDER BY pb.total DESC, u.user_id
     """,
-        (cycle_num,),
+        (chat_id, cycle_num),
     )
 
     text = f"💰 <b>Contabilidade do Pote (Ciclo {cycle_num})</b> 💰\n\n"
@@ -426,40 +3171,65 @@ async def run_daily_pote_report(context: Application):
     else:
         for c in contributions:
             text += f"• {c['first_name']}: R$ {c['total_contributed']:.2f}\n"
+    return text
+
 
-    await context.bot.send_message(
-        chat_id=chat_id, text=text, parse_mode=ParseMode.HTML
+async def pote_report_text(chat_id: int, cycle_num: int) -> str:
+    """Texto da contabilidade do pote, do cache quando o pote não mudou."""
+    text = render_cache.get(chat_id, cycle_num, "pote")
+    if text is None:
+        version = render_cache.version(chat_id)
+        text = await render_pote_report(db_for(chat_id), chat_id, cycle_num)
+        render_cache.put(chat_id, cycle_num, "pote", version, text)
+    return text
+
+
+async def run_daily_pote_report(context: Application, chat_id: int):
+    """Envia a contabilidade do pote no final do dia (só pelo job agendado)."""
+    cycle_num = await current_cycle(chat_id)
+    if not cycle_num:
+        return
+
+    text = await pote_report_text(chat_id, cycle_num)
+    await send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=text,
+        parse_mode=ParseMode.HTML,
+        priority=PRIORITY_BULK,
+        wait=True,
     )
 
+    # Tenta de novo as cobranças que não saíram no relatório semanal
+    sent, total = await send_pending_charges(context, chat_id)
+    if total:
+        logger.info(f"Chat {chat_id}: {sent}/{total} cobranças pendentes enviadas.")
 
-async def run_bi_monthly_cycle_end(context: Application):
+
+async def run_bi_monthly_cycle_end(context: Application, chat_id: int):
     """Roda a cada 2 meses. Encontra o vencedor, anuncia e zera o pote (contabilidade)."""
-    chat_id = GROUP_CHAT_ID
-    cycle_num = get_current_cycle()
+    db = db_for(chat_id)
+    cycle_num = await job_cycle(chat_id)
     if not cycle_num:
         return
 
-    logger.info(f"Finalizando ciclo {cycle_num}...")
+    logger.info(f"Finalizando ciclo {cycle_num} do chat {chat_id}...")
 
     # Encontra o vencedor do ciclo
-    winner = db_query_one(
+    winner = await db.fetch_one(
         """
-        SELECT u.user_id, u.first_name, SUM(s.points_awarded) as total_points
-        FROM submissions s
-        JOIN users u ON s.user_id = u.user_id
-        WHERE s.cycle_num = ?
-        GROUP BY u.user_id
-        ORDER BY total_points DESC
+        SELECT u.user_id, u.first_name, cs.points as total_points
+        FROM cycle_scores cs
+        JOIN users u ON cs.user_id = u.user_id
+        WHERE cs.chat_id = ? AND cs.cycle_num = ? AND cs.submissions > 0
+        ORDER BY total_points DESC, u.user_id
         LIMIT 1
     """,
-        (cycle_num,),
+        (chat_id, cycle_num),
     )
 
     # Pega o total do pote
-    total_row = db_query_one(
-        "SELECT SUM(amount) as total FROM pote WHERE cycle_num = ?", (cycle_num,)
-    )
-    total_in_pote = total_row["total"] if total_row["total"] else 0.0
+    total_in_pote = await db.run(pote_total, chat_id, cycle_num)
 
     text = f"🎉 <b>FIM DO CICLO {cycle_num}</b> 🎉\n\n"
 
@@ -472,153 +3242,639 @@ async def run_bi_monthly_cycle_end(context: Application):
         text += f"Parabéns <a href='tg://user?id={winner_id}'>{winner_name}</a>, você resgata o prêmio total de <b>R$ {total_in_pote:.2f}</b>! 🤑"
 
         # Atualiza o ciclo como finalizado e com vencedor
-        db_execute(
-            "UPDATE cycles SET winner_user_id = ?, is_active = 0 WHERE cycle_num = ?",
-            (winner_id, cycle_num),
+        await db.execute(
+            "UPDATE cycles SET winner_user_id = ?, is_active = 0 WHERE chat_id = ? AND cycle_num = ?",
+            (winner_id, chat_id, cycle_num),
         )
 
     elif winner:
         text += f"O ciclo terminou, e o vencedor em pontos foi <b>{winner['first_name']}</b> com {winner['total_points']} pontos.\n\n"
         text += "Como o pote está zerado, não há prêmio em dinheiro. Mas parabéns pela disciplina!"
-        db_execute(
-            "UPDATE cycles SET winner_user_id = ?, is_active = 0 WHERE cycle_num = ?",
-            (winner["user_id"], cycle_num),
+        await db.execute(
+            "UPDATE cycles SET winner_user_id = ?, is_active = 0 WHERE chat_id = ? AND cycle_num = ?",
+            (winner["user_id"], chat_id, cycle_num),
         )
     else:
         text += "O ciclo terminou sem vencedores ou pontos registrados. O pote de R$ {total_in_pote:.2f} será zerado."
-        db_execute("UPDATE cycles SET is_active = 0 WHERE cycle_num = ?", (cycle_num,))
+        await db.execute(
+            "UPDATE cycles SET is_active = 0 WHERE chat_id = ? AND cycle_num = ?",
+            (chat_id, cycle_num),
+        )
+
+    # O ciclo em cache acabou de ser encerrado
+    invalidate_cycle_cache(chat_id)
 
-    await context.bot.send_message(
-        chat_id=chat_id, text=text, parse_mode=ParseMode.HTML
+    await send_message(
+        context.bot,
+        chat_id=chat_id,
+        text=text,
+        parse_mode=ParseMode.HTML,
+        priority=PRIORITY_BULK,
+        wait=True,
     )
 
     # Cria o próximo ciclo (a função get_current_cycle() fará isso automaticamente na próxima vez que for chamada)
-    get_current_cycle()
+    await db.run(get_current_cycle, chat_id)
 
 
-def schedule_user_jobs(
-    scheduler: AsyncIOScheduler, user_id: int, chat_id: int, application: Application
-):
-    """Lê os horários do DB e agenda os lembretes para um usuário."""
-    schedules = db_query_all("SELECT * FROM schedules WHERE user_id = ?", (user_id,))
-
-    # Mapeia dia da semana (texto) para o formato do cron (inglês)
-    day_map = {
-        "monday": "mon",
-        "tuesday": "tue",
-        "wednesday": "wed",
-        "thursday": "thu",
-        "friday": "fri",
-        "saturday": "sat",
-        "sunday": "sun",
-    }
+# --- Roda de Horários (lembretes e prompts) ---
+# Em vez de 2 CronTriggers por horário, um único job por minuto consulta um
+# índice (dia da semana, HH:MM) -> [(schedule_id, tipo)] pré-calculado.
+
+WEEKDAY_INDEX = {
+    "monday": 0,
+    "tuesday": 1,
+    "wednesday": 2,
+    "thursday": 3,
+    "friday": 4,
+    "saturday": 5,
+    "sunday": 6,
+}
+
+REMINDER_ADVANCE = timedelta(minutes=15)  # Lembrete 15 min antes da Hora H
+
+
+def schedule_slots(schedule):
+    """Slots de uma linha de schedules: [((weekday, "HH:MM"), tipo)]."""
+    day_str = schedule["day_of_week"].lower()
+    if day_str not in WEEKDAY_INDEX:
+        raise ValueError(f"Dia da semana inválido '{day_str}'")
+
+    time_obj = time.fromisoformat(schedule["time_of_day"])
+    weekday = WEEKDAY_INDEX[day_str]
+
+    # O lembrete pode cair no dia anterior (ex: prompt às 00:10)
+    prompt_at = datetime.combine(date(2024, 1, 1) + timedelta(days=weekday), time_obj)
+    reminder_at = prompt_at - REMINDER_ADVANCE
+    return [
+        ((reminder_at.weekday(), reminder_at.strftime("%H:%M")), "reminder"),
+        ((weekday, prompt_at.strftime("%H:%M")), "prompt"),
+    ]
+
+
+class ScheduleWheel:
+    """Índice em memória de lembretes/prompts por minuto da semana."""
+
+    def __init__(self):
+        # (weekday, "HH:MM") -> {(chat_id, schedule_id, tipo): user_id}
+        self._slots = {}
+        # (chat_id, schedule_id) -> (user_id, slots)
+        self._schedules = {}
+        self.last_minute = None  # Último minuto já despachado
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def set_schedule(self, schedule) -> bool:
+        """Adiciona ou atualiza um horário. Retorna False se nada mudou."""
+        key = (schedule["chat_id"], schedule["schedule_id"])
+        entry = (schedule["user_id"], schedule_slots(schedule))
+        if self._schedules.get(key) == entry:
+            return False
+        self.remove_schedule(key)
+        self._schedules[key] = entry
+        user_id, slots = entry
+        for slot, kind in slots:
+            self._slots.setdefault(slot, {})[(*key, kind)] = user_id
+        return True
+
+    def remove_schedule(self, key) -> bool:
+        entry = self._schedules.pop(key, None)
+        if entry is None:
+            return False
+        for slot, kind in entry[1]:
+            bucket = self._slots.get(slot)
+            if bucket is not None:
+                bucket.pop((*key, kind), None)
+                if not bucket:
+                    del self._slots[slot]
+        return True
+
+    def keys(self, chat_id: int):
+        """Chaves (chat_id, schedule_id) dos horários de um grupo."""
+        return {key for key in self._schedules if key[0] == chat_id}
+
+    def due(self, moment: datetime):
+        """[(tipo, user_id, chat_id)] marcados para o minuto de 'moment'."""
+        bucket = self._slots.get((moment.weekday(), moment.strftime("%H:%M")), {})
+        return [
+            (kind, user_id, chat_id) for (chat_id, _, kind), user_id in bucket.items()
+        ]
+
+
+schedule_wheel = ScheduleWheel()
+
+
+def apply_schedule(schedule) -> bool:
+    """Atualiza um horário na roda (incremental). Retorna True se mudou."""
+    try:
+        return schedule_wheel.set_schedule(schedule)
+    except ValueError as e:
+        logger.warning(f"{e} para schedule_id {schedule['schedule_id']}")
+        return schedule_wheel.remove_schedule(
+            (schedule["chat_id"], schedule["schedule_id"])
+        )
 
+
+async def reconcile_schedules(chat_id: int):
+    """
+    Sincroniza a tabela schedules do grupo com a roda de horários.
+
+    Lê todos os horários do grupo numa única consulta e só adiciona, altera
+    ou remove as entradas que mudaram. Pode ser chamada a qualquer momento
+    (não precisa reiniciar o bot). Retorna (adicionados, alterados, removidos).
+    """
+    schedules = (
+        await db_for(chat_id).fetch_all(
+            "SELECT * FROM schedules WHERE chat_id = ?", (chat_id,)
+        )
+        or []
+    )
+    known = schedule_wheel.keys(chat_id)
+
+    added = modified = 0
     for s in schedules:
-        schedule_id = s["schedule_id"]
-        day_str = s["day_of_week"].lower()
-        time_str = s["time_of_day"]
+        if apply_schedule(s):
+            if (chat_id, s["schedule_id"]) in known:
+                modified += 1
+            else:
+                added += 1
 
-        if day_str not in day_map:
-            logger.warning(
-                f"Dia da semana inválido '{day_str}' para schedule_id {schedule_id}"
-            )
-            continue
+    removed = 0
+    for key in known - {(chat_id, s["schedule_id"]) for s in schedules}:
+        schedule_wheel.remove_schedule(key)
+        removed += 1
+
+    logger.info(
+        f"Horários do chat {chat_id} reconciliados: +{added} ~{modified} -{removed} "
+        f"({len(schedule_wheel)} horário(s) na roda)"
+    )
+    return added, modified, removed
+
+
+async def _fetch_first_names(shard: AsyncDB, user_ids) -> dict:
+    user_ids = sorted(user_ids)
+    placeholders = ",".join("?" * len(user_ids))
+    rows = await shard.fetch_all(
+        f"SELECT user_id, first_name FROM users WHERE user_id IN ({placeholders})",
+        user_ids,
+    )
+    return {row["user_id"]: row["first_name"] for row in rows or []}
 
+
+def restore_dispatch_cursor(next_run_time):
+    """
+    Retoma o dispatcher de onde ele parou antes do restart. 'next_run_time' é
+    o próximo disparo persistido no job store (timestamp UTC), então o minuto
+    anterior foi o último despachado.
+    """
+    if next_run_time is None:
+        return
+    schedule_wheel.last_minute = datetime.fromtimestamp(
+        next_run_time, TIMEZONE
+    ) - timedelta(minutes=1)
+
+
+async def dispatch_schedules(context: Application):
+    """
+    Job de 1 em 1 minuto: envia todos os lembretes e prompts do minuto.
+    Se o job atrasar (ou o bot reiniciar), recupera os minutos pulados desde
+    o último despachado, até o limite de misfire.
+    """
+    now = datetime.now(TIMEZONE).replace(second=0, microsecond=0)
+    start = now
+    if schedule_wheel.last_minute is not None:
+        start = max(
+            schedule_wheel.last_minute + timedelta(minutes=1),
+            now - timedelta(seconds=JOB_MISFIRE_GRACE["dispatch_schedules"]),
+        )
+    schedule_wheel.last_minute = now
+
+    due = []
+    moment = start
+    while moment <= now:
+        due.extend(schedule_wheel.due(moment))
+        moment += timedelta(minutes=1)
+    if not due:
+        return
+
+    # Uma consulta de nomes por shard (em paralelo), não uma por usuário
+    by_shard = {}
+    for _, user_id, chat_id in due:
+        by_shard.setdefault(db_for(chat_id), set()).add(user_id)
+    names = {}
+    for found in await asyncio.gather(
+        *(_fetch_first_names(shard, ids) for shard, ids in by_shard.items())
+    ):
+        names.update(found)
+
+    senders = {"reminder": send_reminder, "prompt": send_prompt}
+    results = await asyncio.gather(
+        *(
+            senders[kind](context, user_id, chat_id, names[user_id])
+            for kind, user_id, chat_id in due
+            if user_id in names
+        ),
+        return_exceptions=True,
+    )
+    for error in results:
+        if isinstance(error, Exception):
+            logger.error(f"Erro ao enviar lembrete/prompt: {error}")
+    logger.info(f"Despachados {len(results)} lembrete(s)/prompt(s) de {now:%a %H:%M}")
+
+
+# Funções que podem ser agendadas. O job guarda só o nome e kwargs simples
+# (nunca o Application), então pode ser serializado no job store do SQLite.
+JOB_FUNCTIONS = {
+    "dispatch_schedules": dispatch_schedules,
+    "run_weekly_report": run_weekly_report,
+    "run_daily_pote_report": run_daily_pote_report,
+    "run_bi_monthly_cycle_end": run_bi_monthly_cycle_end,
+    "run_cycle_archival": run_cycle_archival,
+    "sweep_prompt_windows": sweep_prompt_windows,
+}
+
+# Política de misfire (segundos de atraso tolerados; None = sempre executa).
+# Relatório semanal e fim de ciclo nunca podem ser perdidos; um lembrete
+# atrasado demais não serve para nada.
+JOB_MISFIRE_GRACE = {
+    "dispatch_schedules": 5 * 60,
+    "run_weekly_report": None,
+    "run_daily_pote_report": 60 * 60,
+    "run_bi_monthly_cycle_end": None,
+    "run_cycle_archival": 6 * 60 * 60,
+    "sweep_prompt_windows": 60,
+}
+
+# Tempo máximo de cada execução (segundos). Estourou, a execução é cancelada
+# (um relatório travado no Telegram não segura o job para sempre).
+JOB_TIMEOUTS = {
+    "dispatch_schedules": 50,
+    "run_weekly_report": 15 * 60,
+    "run_daily_pote_report": 5 * 60,
+    "run_bi_monthly_cycle_end": 10 * 60,
+    "run_cycle_archival": 30 * 60,
+    "sweep_prompt_windows": 60,
+}
+
+# Execuções simultâneas permitidas de um mesmo job (padrão: 1)
+JOB_MAX_INSTANCES = {
+    "dispatch_schedules": 2,  # Um minuto lento não atrasa o seguinte
+}
+
+# Jobs que não podem se perder: cada execução fica registrada em job_runs e,
+# no boot, a que foi interrompida (ou não rodou) é refeita uma única vez, se
+# o horário previsto ainda estiver dentro desta janela.
+JOB_CATCHUP_WINDOW = {
+    "run_weekly_report": timedelta(days=2),
+    "run_bi_monthly_cycle_end": timedelta(days=7),
+}
+
+# Jobs que existem uma vez por grupo (kwargs={"chat_id": ...})
+CHAT_JOB_NAMES = (
+    "run_weekly_report",
+    "run_daily_pote_report",
+    "run_bi_monthly_cycle_end",
+    "run_cycle_archival",
+)
+
+_application = None  # Definido no post_init; usado pelos jobs em tempo de execução
+
+# (job_id, horário previsto) da execução sendo submetida pelo JobExecutor
+_job_submission = ContextVar("job_submission", default=None)
+# Horário previsto da execução em curso (o da execução perdida, num replay)
+_job_reference = ContextVar("job_reference", default=None)
+
+
+class JobExecutor(AsyncIOExecutor):
+    """Executor do asyncio que informa ao run_job o horário previsto da execução."""
+
+    def _do_submit_job(self, job, run_times):
+        # A task do job copia o contexto aqui (com coalesce, run_times tem 1 item)
+        token = _job_submission.set((job.id, run_times[-1]))
         try:
-            time_obj = time.fromisoformat(time_str)
-            day_cron = day_map[day_str]
-
-            # --- Agenda o Lembrete (15 min antes) ---
-            reminder_time = (
-                datetime.combine(datetime.today(), time_obj) - timedelta(minutes=15)
-            ).time()
-            job_id_reminder = f"reminder_{schedule_id}"
-
-            scheduler.add_job(
-                send_reminder,
-                trigger=CronTrigger(
-                    day_of_week=day_cron,
-                    hour=reminder_time.hour,
-                    minute=reminder_time.minute,
-                    timezone=TIMEZONE,
-                ),
-                id=job_id_reminder,
-                replace_existing=True,
-                kwargs={"context": application, "user_id": user_id, "chat_id": chat_id},
-            )
+            super()._do_submit_job(job, run_times)
+        finally:
+            _job_submission.reset(token)
 
-            # --- Agenda o Prompt (Hora H) ---
-            job_id_prompt = f"prompt_{schedule_id}"
-            scheduler.add_job(
-                send_prompt,
-                trigger=CronTrigger(
-                    day_of_week=day_cron,
-                    hour=time_obj.hour,
-                    minute=time_obj.minute,
-                    timezone=TIMEZONE,
-                ),
-                id=job_id_prompt,
-                replace_existing=True,
-                kwargs={"context": application, "user_id": user_id, "chat_id": chat_id},
-            )
 
-            # Salva os Job IDs no DB para poder editá-los/removê-los
-            db_execute(
-                "UPDATE schedules SET job_id_reminder = ?, job_id_prompt = ? WHERE schedule_id = ?",
-                (job_id_reminder, job_id_prompt, schedule_id),
-            )
-            logger.info(
-                f"Agendado {day_cron} às {time_str} (e lembrete) para user {user_id}"
-            )
+class JobTelemetry:
+    """Atraso (previsto -> início real) e duração das últimas execuções de cada job."""
 
-        except Exception as e:
-            logger.error(f"Erro ao agendar job para schedule {schedule_id}: {e}")
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._jobs = {}  # job_name -> {"lateness", "duration", "last", "statuses"}
+
+    def record(self, job_name: str, lateness: float, duration: float, status: str):
+        entry = self._jobs.get(job_name)
+        if entry is None:
+            entry = self._jobs[job_name] = {
+                "lateness": LatencyWindow(self.size),
+                "duration": LatencyWindow(self.size),
+                "statuses": {},
+            }
+        entry["lateness"].record(lateness)
+        entry["duration"].record(duration)
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+        entry["last"] = status
+
+    def summary(self) -> dict:
+        return {
+            job_name: {
+                "lateness": entry["lateness"].summary(),
+                "duration": entry["duration"].summary(),
+                "statuses": dict(entry["statuses"]),
+                "last": entry["last"],
+            }
+            for job_name, entry in sorted(self._jobs.items())
+        }
 
 
-def schedule_global_jobs(
-    scheduler: AsyncIOScheduler, chat_id: int, application: Application
+job_telemetry = JobTelemetry()
+
+
+def job_reference_time() -> datetime:
+    """Horário previsto do job em execução (fora de um job, agora)."""
+    return _job_reference.get() or datetime.now(TIMEZONE)
+
+
+async def job_cycle(chat_id: int):
+    """
+    Ciclo do dia previsto do job em execução. Num replay atrasado o ciclo
+    ativo pode já ter virado; aí vale o ciclo que continha aquele dia.
+    """
+    day = job_reference_time().astimezone(TIMEZONE).date()
+    if day == datetime.now(TIMEZONE).date():
+        return await current_cycle(chat_id)
+    row = await db_for(chat_id).fetch_one(
+        "SELECT cycle_num FROM cycles WHERE chat_id = ? AND start_date <= ? AND end_date >= ? "
+        "ORDER BY cycle_num DESC LIMIT 1",
+        (chat_id, day, day),
+    )
+    return row["cycle_num"] if row else await current_cycle(chat_id)
+
+
+def claim_job_run(job_id: str, job_name: str, scheduled_at: float, replay: bool):
+    """
+    Reserva a execução (job_id, scheduled_at). Uma execução normal só entra
+    se ninguém reservou antes; um replay também pode retomar uma execução
+    interrompida que ainda não foi refeita. Retorna True se reservou.
+    """
+    with transaction(immediate=True) as conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO job_runs (job_id, job_name, scheduled_at, started_at, status, replayed)
+            VALUES (?, ?, ?, ?, 'running', ?)
+            ON CONFLICT (job_id, scheduled_at) DO UPDATE SET
+                status = 'running', started_at = excluded.started_at,
+                finished_at = NULL, replayed = 1
+            WHERE job_runs.status = 'interrupted' AND job_runs.replayed = 0
+                AND excluded.replayed = 1
+            """,
+            (
+                job_id,
+                job_name,
+                scheduled_at,
+                datetime.now(TIMEZONE).timestamp(),
+                replay,
+            ),
+        )
+        return cursor.rowcount > 0
+
+
+async def run_job(job_name: str, **kwargs):
+    """Ponto de entrada de todos os jobs agendados."""
+    job_id, scheduled_at = _job_submission.get() or (None, None)
+    await execute_job(job_id, job_name, scheduled_at, kwargs)
+
+
+async def execute_job(
+    job_id: str, job_name: str, scheduled_at: datetime, kwargs: dict, replay=False
 ):
-    """Agenda os relatórios semanais, diários e de ciclo."""
+    """
+    Executa um job com timeout, registrando atraso e duração. Jobs críticos
+    (JOB_CATCHUP_WINDOW) são reservados em job_runs antes de rodar, então
+    cada horário previsto roda uma única vez mesmo com replay no boot.
+    """
+    scheduled_at = scheduled_at or datetime.now(TIMEZONE)
+    tracked = job_id is not None and job_name in JOB_CATCHUP_WINDOW
+    key = scheduled_at.timestamp()
+    if tracked and not await _shards[0].run_in_transaction(
+        claim_job_run, job_id, job_name, key, replay
+    ):
+        logger.info(f"Job {job_id} ({scheduled_at}) já foi executado; ignorando.")
+        return
 
-    # Relatório Semanal - Domingo 23:00
-    scheduler.add_job(
-        run_weekly_report,
-        trigger=CronTrigger(day_of_week="sun", hour=23, minute=0, timezone=TIMEZONE),
-        id=f"weekly_report_{chat_id}",
-        replace_existing=True,
-        data={"chat_id": chat_id},
-        kwargs={"context": application},
+    lateness = (datetime.now(TIMEZONE) - scheduled_at).total_seconds()
+    JOB_LATENESS.observe(max(0.0, lateness), job_name)
+    token = _job_reference.set(scheduled_at)
+    started = perf_counter()
+    status = "ok"
+    try:
+        await asyncio.wait_for(
+            JOB_FUNCTIONS[job_name](_application, **kwargs),
+            JOB_TIMEOUTS.get(job_name),
+        )
+    except asyncio.TimeoutError:
+        status = "timeout"
+        JOB_ERRORS.inc(job_name)
+        logger.error(
+            f"Job {job_id or job_name} passou de {JOB_TIMEOUTS[job_name]}s e foi cancelado."
+        )
+    except Exception:
+        status = "error"
+        JOB_ERRORS.inc(job_name)
+        raise
+    finally:
+        _job_reference.reset(token)
+        duration = perf_counter() - started
+        JOB_SECONDS.observe(duration, job_name)
+        job_telemetry.record(job_name, lateness, duration, status)
+        if tracked:
+            await _shards[0].execute(
+                "UPDATE job_runs SET status = ?, finished_at = ? "
+                "WHERE job_id = ? AND scheduled_at = ?",
+                (status, datetime.now(TIMEZONE).timestamp(), job_id, key),
+            )
+
+
+async def mark_interrupted_job_runs() -> int:
+    """No boot (antes do scheduler): execuções 'running' morreram com o processo anterior."""
+    rows = await _shards[0].fetch_all(
+        "SELECT job_id FROM job_runs WHERE status = 'running'"
     )
+    if rows:
+        await _shards[0].execute(
+            "UPDATE job_runs SET status = 'interrupted' WHERE status = 'running'"
+        )
+        logger.warning(
+            f"{len(rows)} execução(ões) de job interrompida(s) pelo último restart: "
+            + ", ".join(row["job_id"] for row in rows)
+        )
+    return len(rows or [])
+
+
+def last_fire_time(trigger, since: datetime, now: datetime):
+    """Último disparo do trigger em [since, now] (ou None)."""
+    last = None
+    fire = trigger.get_next_fire_time(None, since)
+    while fire is not None and fire <= now:
+        last = fire
+        fire = trigger.get_next_fire_time(fire, fire + timedelta(microseconds=1))
+    return last
+
+
+async def replay_missed_jobs(scheduler: AsyncIOScheduler, pending: dict):
+    """
+    Refaz, uma única vez, o último disparo de cada job crítico que foi
+    interrompido por um restart ou que ainda estava pendente no job store
+    ('pending': job_id -> next_run_time persistido, lido antes do start).
+    """
+    now = datetime.now(TIMEZONE)
+    interrupted = {
+        (row["job_id"], row["scheduled_at"])
+        for row in await _shards[0].fetch_all(
+            "SELECT job_id, scheduled_at FROM job_runs "
+            "WHERE status = 'interrupted' AND replayed = 0"
+        )
+        or []
+    }
+    for job in scheduler.get_jobs():
+        job_name = job_label(job)
+        window = JOB_CATCHUP_WINDOW.get(job_name)
+        if window is None or job.id not in pending:
+            continue
+        fire = last_fire_time(job.trigger, now - window, now)
+        if fire is None:
+            continue
+        next_run = pending[job.id]
+        was_pending = next_run is not None and next_run <= fire.timestamp()
+        if not was_pending and (job.id, fire.timestamp()) not in interrupted:
+            continue
+        logger.warning(f"Refazendo o job {job.id} previsto para {fire}.")
+        try:
+            await execute_job(job.id, job_name, fire, job.kwargs, replay=True)
+        except Exception as e:
+            logger.error(f"Replay do job {job.id} falhou: {e}", exc_info=True)
+
+
+def job_label(job) -> str:
+    """Nome legível de um job (a função real, não o run_job)."""
+    if job.func is run_job and job.args:
+        return job.args[0]
+    return getattr(job.func, "__name__", str(job.func))
+
+
+def ensure_job(
+    scheduler: AsyncIOScheduler,
+    job_id: str,
+    job_name: str,
+    trigger,
+    kwargs: dict = None,
+    existing: dict = None,
+) -> bool:
+    """
+    Garante que o job existe com este trigger/kwargs. Se já estiver igual no
+    job store, não mexe (preservando execuções perdidas durante o downtime).
+    Retorna True se o job foi (re)criado.
+    """
+    kwargs = kwargs or {}
+    job = existing.get(job_id) if existing is not None else scheduler.get_job(job_id)
+    if (
+        job is not None
+        and tuple(job.args) == (job_name,)
+        and job.kwargs == kwargs
+        and str(job.trigger) == str(trigger)
+        and job.max_instances == JOB_MAX_INSTANCES.get(job_name, 1)
+    ):
+        return False
 
-    # Contabilidade Diária - Todo dia 22:00
     scheduler.add_job(
-        run_daily_pote_report,
-        trigger=CronTrigger(hour=22, minute=0, timezone=TIMEZONE),
-        id=f"daily_pote_report_{chat_id}",
+        run_job,
+        trigger=trigger,
+        args=[job_name],
+        kwargs=kwargs,
+        id=job_id,
         replace_existing=True,
-        data={"chat_id": chat_id},
-        kwargs={"context": application},
+        misfire_grace_time=JOB_MISFIRE_GRACE.get(job_name, 60),
+        max_instances=JOB_MAX_INSTANCES.get(job_name, 1),
     )
+    return True
 
-    # Fim do Ciclo - A cada 2 meses, no último dia do mês, às 23:30
-    scheduler.add_job(
-        run_bi_monthly_cycle_end,
-        trigger=CronTrigger(
-            day="last", month="*/2", hour=23, minute=30, timezone=TIMEZONE
+
+def schedule_global_jobs(
+    scheduler: AsyncIOScheduler, chat_id: int, existing: dict = None
+):
+    """Agenda os relatórios semanais, diários e de ciclo do grupo. Retorna os IDs."""
+    kwargs = {"chat_id": chat_id}
+    jobs = [
+        # Relatório Semanal - Domingo 23:00
+        (
+            f"weekly_report_{chat_id}",
+            "run_weekly_report",
+            CronTrigger(day_of_week="sun", hour=23, minute=0, timezone=TIMEZONE),
         ),
-        id=f"cycle_end_{chat_id}",
-        replace_existing=True,
-        data={"chat_id": chat_id},
-        kwargs={"context": application},
-    )
+        # Contabilidade Diária - Todo dia 22:00
+        (
+            f"daily_pote_report_{chat_id}",
+            "run_daily_pote_report",
+            CronTrigger(hour=22, minute=0, timezone=TIMEZONE),
+        ),
+        # Fim do Ciclo - A cada 2 meses, no último dia do mês, às 23:30
+        (
+            f"cycle_end_{chat_id}",
+            "run_bi_monthly_cycle_end",
+            CronTrigger(day="last", month="*/2", hour=23, minute=30, timezone=TIMEZONE),
+        ),
+        # Arquivo morto dos ciclos encerrados - Todo dia 04:30 (fora do horário de uso)
+        (
+            f"cycle_archival_{chat_id}",
+            "run_cycle_archival",
+            CronTrigger(hour=4, minute=30, timezone=TIMEZONE),
+        ),
+    ]
+    for job_id, job_name, trigger in jobs:
+        ensure_job(scheduler, job_id, job_name, trigger, kwargs, existing=existing)
     logger.info(
-        f"Agendados jobs globais (semanal, diário, ciclo) para o chat {chat_id}"
+        f"Agendados jobs globais (semanal, diário, ciclo, arquivo) para o chat {chat_id}"
     )
+    return [job_id for job_id, _, _ in jobs]
+
+
+def remove_stale_chat_jobs(scheduler: AsyncIOScheduler, keep, existing: dict):
+    """Remove os jobs de grupos que saíram do GROUP_CHAT_ID."""
+    for job_id, job in existing.items():
+        if job_label(job) in CHAT_JOB_NAMES and job_id not in keep:
+            scheduler.remove_job(job_id)
+            logger.info(f"Job {job_id} removido (grupo não está mais configurado).")
 
 
 # --- Comandos do Bot (Handlers) ---
 
 
+def chat_scope(update: Update):
+    """
+    Grupo a que o update se refere. No privado vale o grupo principal;
+    grupos não autorizados retornam None (o handler ignora o update).
+    """
+    chat = update.effective_chat
+    if chat is None or chat.type == "private":
+        return GROUP_CHAT_ID
+    return chat.id if chat.id in _chat_shards else None
+
+
+def register_member(chat_id: int, user_id: int, username: str, first_name: str):
+    """Cadastra o usuário e sua participação no grupo (não faz mal rodar de novo)."""
+    db_execute(
+        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+        (user_id, username, first_name),
+    )
+    db_execute(
+        "INSERT OR IGNORE INTO chat_members (chat_id, user_id, joined_at) VALUES (?, ?, ?)",
+        (chat_id, user_id, datetime.now(TIMEZONE)),
+    )
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Comando /start - Configura usuários iniciais no banco DE FORMA SEGURA.
@@ -626,29 +3882,30 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     chat = update.effective_chat
     if chat.type == "private":
-        await update.message.reply_text("Olá! Por favor, me adicione a um grupo.")
+        await reply_text(update.message, "Olá! Por favor, me adicione a um grupo.")
         return
 
-    # Verifica se o chat é o grupo correto
-    if chat.id != GROUP_CHAT_ID:
-        await update.message.reply_text("Este grupo não está autorizado.")
+    # Verifica se o chat é um dos grupos configurados
+    if chat.id not in _chat_shards:
+        await reply_text(update.message, "Este grupo não está autorizado.")
         logger.warning(f"Comando /start recebido de um chat não autorizado: {chat.id}")
         return
 
     user = update.effective_user
+    db = db_for(chat.id)
 
-    await update.message.reply_text(
+    await reply_text(
+        update.message,
         f"Olá, {user.first_name}! Verificando configuração inicial...\n"
         "Este comando (/start) agora é seguro e só adicionará horários "
-        "padrões para usuários novos."
+        "padrões para usuários novos.",
     )
 
     # --- Lógica de Cadastro Inicial ---
 
     # Registra o usuário que deu /start (não faz mal rodar de novo)
-    db_execute(
-        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
-        (user.id, user.username, user.first_name),
+    await db.run_in_transaction(
+        register_member, chat.id, user.id, user.username, user.first_name
     )
 
     # Tenta mapear o ID de quem deu /start para os nomes no dicionário
@@ -665,15 +3922,19 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Só processa se soubermos o ID do usuário
         if user_id != 0:
 
-            # Garante que o usuário está na tabela 'users'
-            db_execute(
-                "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
-                (user_id, f"user_{user_id}", name),  # Adiciona um username placeholder
+            # Garante que o usuário está na tabela 'users' e no grupo
+            await db.run_in_transaction(
+                register_member,
+                chat.id,
+                user_id,
+                f"user_{user_id}",  # Adiciona um username placeholder
+                name,
             )
 
-            # 1. Verifica se o usuário JÁ TEM horários
-            existing_schedules = db_query_one(
-                "SELECT COUNT(*) as count FROM schedules WHERE user_id = ?", (user_id,)
+            # 1. Verifica se o usuário JÁ TEM horários neste grupo
+            existing_schedules = await db.fetch_one(
+                "SELECT COUNT(*) as count FROM schedules WHERE chat_id = ? AND user_id = ?",
+                (chat.id, user_id),
             )
 
             # 2. SÓ ADICIONA SE O COUNT FOR ZERO
@@ -683,11 +3944,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 users_processed_count += 1
 
-                for day_name, time_obj in data["schedules"]:
-                    db_execute(
-                        "INSERT INTO schedules (user_id, day_of_week, time_of_day) VALUES (?, ?, ?)",
-                        (user_id, day_name, time_obj.strftime("%H:%M")),
-                    )
+                await db.executemany(
+                    "INSERT INTO schedules (chat_id, user_id, day_of_week, time_of_day) VALUES (?, ?, ?, ?)",
+                    [
+                        (chat.id, user_id, day_name, time_obj.strftime("%H:%M"))
+                        for day_name, time_obj in data["schedules"]
+                    ],
+                )
             else:
                 # Se o usuário já tem horários (count > 0), não fazemos NADA.
                 logger.info(
@@ -695,14 +3958,32 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
 
     if users_processed_count > 0:
-        await update.message.reply_text(
+        # Agenda os novos horários sem precisar reiniciar o bot
+        await reconcile_schedules(chat.id)
+        await reply_text(
+            update.message,
             f"{users_processed_count} usuário(s) tiveram seus horários padrões definidos no banco.\n"
-            "Reinicie o bot para carregar os novos agendamentos."
+            "Os novos agendamentos já estão ativos.",
         )
     else:
-        await update.message.reply_text(
-            "Tudo certo. Os usuários já existentes não foram modificados."
+        await reply_text(
+            update.message,
+            "Tudo certo. Os usuários já existentes não foram modificados.",
+        )
+
+
+def pay_debt(chat_id: int, debt_id: int, user_id: int, amount: float, cycle_num: int):
+    """
+    Marca a dívida como paga e lança o depósito no pote (rodar em transação).
+    Retorna o novo total do pote no ciclo, ou None se a dívida já estava paga.
+    """
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE debts SET paid = 1 WHERE debt_id = ? AND paid = 0", (debt_id,)
         )
+        if cursor.rowcount == 0:
+            return None
+        return record_pote_deposit(chat_id, user_id, amount, cycle_num)
 
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -710,141 +3991,126 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat = update.effective_chat
     message = update.message
-
-    # Registra o usuário se for a primeira vez que ele interage
-    db_execute(
-        "INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
-        (user.id, user.username, user.first_name),
-    )
+    if chat.id not in _chat_shards:
+        return  # Grupo não autorizado
+    db = db_for(chat.id)
 
     # --- Lógica 1: É um Comprovante de PIX? ---
     if message.reply_to_message:
         reply_msg_id = message.reply_to_message.message_id
 
         # Verifica se é resposta a uma cobrança de dívida
-        debt = db_query_one(
-            "SELECT * FROM debts WHERE message_id_to_reply = ? AND user_id = ? AND paid = 0",
-            (reply_msg_id, user.id),
+        debt = await db.fetch_one(
+            "SELECT * FROM debts WHERE chat_id = ? AND message_id_to_reply = ? AND user_id = ? AND paid = 0",
+            (chat.id, reply_msg_id, user.id),
         )
 
-        if debt:
+        if debt:  # Quem tem dívida já está cadastrado no grupo
             amount = debt["amount"]
             week_num = debt["week_num"]
-            cycle_num = get_current_cycle()
+            cycle_num = await current_cycle(chat.id)
 
-            # Marca como pago
-            db_execute(
-                "UPDATE debts SET paid = 1 WHERE debt_id = ?", (debt["debt_id"],)
+            # Marca como pago e lança no pote na mesma transação (que já
+            # devolve o saldo do ciclo)
+            total_in_pote = await db.run_in_transaction(
+                pay_debt, chat.id, debt["debt_id"], user.id, amount, cycle_num
             )
+            if total_in_pote is None:
+                return  # Outro comprovante já quitou esta dívida
 
-            # Adiciona ao pote
-            db_execute(
-                "INSERT INTO pote (user_id, amount, timestamp, cycle_num) VALUES (?, ?, ?, ?)",
-                (user.id, amount, datetime.now(TIMEZONE), cycle_num),
-            )
-
-            total_row = db_query_one(
-                "SELECT SUM(amount) as total FROM pote WHERE cycle_num = ?",
-                (cycle_num,),
-            )
-            total_in_pote = total_row["total"] if total_row["total"] else 0.0
-
-            await message.reply_text(
-                f"✅ Pagamento ... (Ciclo {cycle_num}): <b>R$ {total_in_pote:.2f}</b>",
+            await reply_text(
+                message,
+                f"✅ Pagamento de <b>R$ {amount:.2f}</b> (semana {week_num}) registrado!\n\n"
                 f"Total no pote (Ciclo {cycle_num}): <b>R$ {total_in_pote:.2f}</b>",
                 parse_mode=ParseMode.HTML,
             )
             return
 
     # --- Lógica 2: É um Comprovante de Hábito? ---
-
-    # Verifica se o usuário está na janela de 1h (5 pontos)
-    # A flag agora está em bot_data, com a chave (chat_id)_(user_id)
-    prompt_key = f"prompt_{chat.id}_{user.id}"
-
-    if prompt_key in context.bot_data:
-        prompt_time = context.bot_data[prompt_key]["time"]
-        time_diff = datetime.now(TIMEZONE) - prompt_time
-
-        if time_diff.total_seconds() < 3600:  # Dentro de 1 hora
-            points_to_award = 5
-            del context.bot_data[prompt_key]  # Remove a flag para não pontuar duplo
-        else:
-            # Já passou de 1h, mas ainda estava na "janela"
-            points_to_award = 3  # Fora do horário
-            del context.bot_data[prompt_key]
-    else:
-        # Envio fora da janela (3 pontos)
-        points_to_award = 3
-
-    # Verifica limite de 2 por semana
     week_num = get_current_week()
-    cycle_num = get_current_cycle()
+    cycle_num = await current_cycle(chat.id)  # Vem do cache do ciclo
 
     if not cycle_num:
-        await message.reply_text(
-            "Erro: Não há um ciclo de desafio ativo no momento. O desafio ainda não começou ou já terminou."
+        # Registra o usuário se for a primeira vez que ele interage
+        await db.run_in_transaction(
+            register_member, chat.id, user.id, user.username, user.first_name
+        )
+        await reply_text(
+            message,
+            "Erro: Não há um ciclo de desafio ativo no momento. O desafio ainda não começou ou já terminou.",
         )
         return
 
-    submissions_row = db_query_one(
-        "SELECT COUNT(*) as count FROM submissions WHERE user_id = ? AND week_num = ? AND cycle_num = ?",
-        (user.id, week_num, cycle_num),
+    # Dentro da janela de 1h vale 5 pontos, fora dela 3. A janela só é
+    # fechada quando o comprovante é aceito (no banco junto da submissão, na
+    # memória logo depois), para não pontuar duplo; as fotos de um mesmo
+    # usuário são serializadas pelo PerUserUpdateProcessor.
+    had_window, in_window = prompt_windows.check(chat.id, user.id)
+    points_to_award = 5 if in_window else 3
+
+    # Cadastro + limite de 2 por semana + submissão + placar: uma transação só
+    submissions_this_week = await db.run_in_transaction(
+        admit_submission,
+        chat.id,
+        user.id,
+        user.username,
+        user.first_name,
+        points_to_award,
+        week_num,
+        cycle_num,
+        had_window,
     )
-    submissions_this_week = submissions_row["count"] if submissions_row else 0
+    if submissions_this_week is not None and had_window:
+        prompt_windows.close(chat.id, user.id)
 
-    if submissions_this_week >= 2:
-        await message.reply_text(
-            f"Limite atingido! {user.first_name}, você já enviou seus 2 comprovantes desta semana."
+    if submissions_this_week is None:
+        await reply_text(
+            message,
+            f"Limite atingido! {user.first_name}, você já enviou seus {WEEKLY_SUBMISSION_LIMIT} comprovantes desta semana.",
         )
         return
 
-    # Registra a submissão
-    db_execute(
-        "INSERT INTO submissions (user_id, timestamp, points_awarded, week_num, cycle_num) VALUES (?, ?, ?, ?, ?)",
-        (user.id, datetime.now(TIMEZONE), points_to_award, week_num, cycle_num),
-    )
-
-    await message.reply_text(
+    await reply_text(
+        message,
         f"Comprovante recebido, {user.first_name}! 🥳\n\n"
         f"<b>+{points_to_award} pontos</b> para você!\n"
-        f"({submissions_this_week + 1} de 2 esta semana)",
+        f"({submissions_this_week} de {WEEKLY_SUBMISSION_LIMIT} esta semana)",
         parse_mode=ParseMode.HTML,
     )
 
 
 async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /leaderboard - Mostra o placar do ciclo atual."""
-    cycle_num = get_current_cycle()
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
+
+    # O contexto do ciclo (número, início e fim) vem do cache, sem ir ao banco
+    cycle = await current_cycle_context(chat_id)
+    cycle_num = cycle.cycle_num
     if not cycle_num:
-        await update.message.reply_text("Nenhum ciclo de desafio ativo no momento.")
+        await reply_text(update.message, "Nenhum ciclo de desafio ativo no momento.")
         return
 
-    # ---- ADICIONE ESTA PARTE ----
-    # Busca os detalhes do ciclo (start_date, end_date)
-    cycle = db_query_one("SELECT * FROM cycles WHERE cycle_num = ?", (cycle_num,))
-    if not cycle:
-        await update.message.reply_text(
-            "Erro: Não consegui encontrar os detalhes do ciclo atual."
-        )
+    # Sem escrita no placar desde a última vez, reenvia o mesmo texto
+    text = render_cache.get(chat_id, cycle_num, "leaderboard")
+    if text is not None:
+        await reply_text(update.message, text, parse_mode=ParseMode.HTML)
         return
-    # ---- FIM DA ADIÇÃO ----
 
-    scores = db_query_all(
+    version = render_cache.version(chat_id)
+    scores = await db_for(chat_id).fetch_all(
         """
-        SELECT u.first_name, SUM(s.points_awarded) as total_points
-        FROM submissions s
-        JOIN users u ON s.user_id = u.user_id
-        WHERE s.cycle_num = ?
-        GROUP BY u.user_id
-        ORDER BY total_points DESC
+        SELECT u.first_name, cs.points as total_points
+        FROM cycle_scores cs
+        JOIN users u ON cs.user_id = u.user_id
+        WHERE cs.chat_id = ? AND cs.cycle_num = ? AND cs.submissions > 0
+        ORDER BY total_points DESC, u.user_id
     """,
-        (cycle_num,),
+        (chat_id, cycle_num),
     )
 
-    # Agora esta linha (que era a 793) vai funcionar, pois 'cycle' existe
-    text = f"🏆 <b>Leaderboard do Ciclo {cycle_num}</b> 🏆\n(de {cycle['start_date']} até {cycle['end_date']})\n\n"
-    # ... (resto da função)
+    text = f"🏆 <b>Leaderboard do Ciclo {cycle_num}</b> 🏆\n(de {cycle.start_date} até {cycle.end_date})\n\n"
 
     if not scores:
         text += "Ninguém pontuou ainda neste ciclo."
@@ -853,26 +4119,39 @@ async def leaderboard_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             emoji = ["🥇", "🥈", "🥉"][i] if i < 3 else "🔹"
             text += f"{emoji} {score['first_name']}: {score['total_points']} pontos\n"
 
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    render_cache.put(chat_id, cycle_num, "leaderboard", version, text)
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
 async def pote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /pote - Mostra o status do pote (chama a função de relatório diário)."""
-    # Passa o 'application' para a função, que agora espera por ele
-    await run_daily_pote_report(context.application)
+    """Comando /pote - Mostra o status do pote."""
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
+    cycle_num = await current_cycle(chat_id)
+    if not cycle_num:
+        return
+
+    # Só o relatório: as cobranças pendentes ficam para o job das 22:00
+    text = await pote_report_text(chat_id, cycle_num)
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
 async def meus_horarios_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /meus_horarios - Mostra os horários agendados do usuário."""
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
     user_id = update.effective_user.id
-    schedules = db_query_all(
-        "SELECT * FROM schedules WHERE user_id = ? ORDER BY day_of_week, time_of_day",
-        (user_id,),
+    schedules = await db_for(chat_id).fetch_all(
+        "SELECT * FROM schedules WHERE chat_id = ? AND user_id = ? ORDER BY day_of_week, time_of_day",
+        (chat_id, user_id),
     )
 
     if not schedules:
-        await update.message.reply_text(
-            "Você não tem nenhum horário cadastrado. Use /editar_horario para adicionar."
+        await reply_text(
+            update.message,
+            "Você não tem nenhum horário cadastrado. Use /editar_horario para adicionar.",
         )
         return
 
@@ -891,53 +4170,120 @@ async def meus_horarios_command(update: Update, context: ContextTypes.DEFAULT_TY
     for s in schedules:
         text += f"• <b>{day_map_pt.get(s['day_of_week'], s['day_of_week'].capitalize())}</b> às <b>{s['time_of_day']}</b>\n"
 
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
 # --- Comandos Adicionais ---
 
 
 async def list_users_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Comando /usuarios - Lista todos os usuários cadastrados."""
-    users = db_query_all(
-        "SELECT user_id, first_name, username FROM users ORDER BY first_name"
+    """Comando /usuarios - Lista os usuários cadastrados no grupo."""
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
+    users = await db_for(chat_id).fetch_all(
+        """
+        SELECT u.user_id, u.first_name, u.username
+        FROM chat_members m
+        JOIN users u ON u.user_id = m.user_id
+        WHERE m.chat_id = ?
+        ORDER BY u.first_name
+    """,
+        (chat_id,),
     )
 
     if not users:
-        await update.message.reply_text("Nenhum usuário cadastrado no bot ainda.")
+        await reply_text(update.message, "Nenhum usuário cadastrado no bot ainda.")
         return
 
     text = "👥 <b>Usuários no Desafio</b> 👥\n\n"
     for user in users:
         text += f"• {user['first_name']} (@{user['username']})\n    (ID: `{user['user_id']}`)\n"
 
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
-def build_submissions_keyboard(cycle_num: int, page: int = 0):
-    """Função helper para criar o teclado paginado de submissões."""
-    PAGE_SIZE = 8  # Quantidade de submissões por página
-    offset = page * PAGE_SIZE
+SUBMISSIONS_PAGE_SIZE = 8  # Quantidade de submissões por página
 
-    # Busca as submissões da página
-    submissions = db_query_all(
-        """
-        SELECT s.submission_id, s.timestamp, s.points_awarded, u.first_name 
-        FROM submissions s 
-        JOIN users u ON s.user_id = u.user_id 
-        WHERE s.cycle_num = ? 
-        ORDER BY s.timestamp DESC
-        LIMIT ? OFFSET ?
-    """,
-        (cycle_num, PAGE_SIZE, offset),
-    )
+# Paginação por cursor (keyset): cada botão carrega a página e a última
+# (ou primeira) linha vista, "{página}_{submission_id}", e a próxima consulta
+# parte direto desse ponto do índice (chat_id, cycle_num, submission_id).
+# Virar a página 500 custa o mesmo que a 1. O submission_id cresce com a
+# ordem de chegada, então sozinho já ordena a lista.
+#
+# O Telegram aceita até 64 bytes de callback_data. O mais longo é
+# "del_sub_{id}_{página}_{id}": 8 + 19 + 1 + 6 + 1 + 19 = 54 bytes com o
+# maior rowid do SQLite (19 dígitos) e um milhão de páginas.
+_SUBMISSIONS_PAGE_SQL = """
+    SELECT s.submission_id, s.timestamp, s.points_awarded, u.first_name
+    FROM submissions s
+    JOIN users u ON s.user_id = u.user_id
+    WHERE s.chat_id = ? AND s.cycle_num = ? {after}
+    ORDER BY s.submission_id {order}
+    LIMIT ?
+"""
+
+
+def page_anchor(page: int, sub=None) -> str:
+    """Codifica a página e o cursor (linha de referência) para o callback_data."""
+    if sub is None:
+        return str(page)
+    return f"{page}_{sub['submission_id']}"
 
-    # Conta o total
-    total_row = db_query_one(
-        "SELECT COUNT(*) as count FROM submissions WHERE cycle_num = ?", (cycle_num,)
+
+def parse_page_anchor(anchor: str):
+    """Inverso de page_anchor(): (página, submission_id ou None)."""
+    parts = anchor.split("_", 1)
+    page = int(parts[0])
+    if len(parts) == 1:
+        return page, None
+    return page, int(parts[1])
+
+
+def _fetch_submissions_page(chat_id: int, cycle_num: int, mode: str, cursor):
+    """
+    Uma página de submissões, da mais nova para a mais velha. 'mode':
+    'a' a partir do cursor (inclusive), 'n' depois dele, 'p' antes dele.
+    Sem cursor, começa do topo. Busca uma linha a mais para saber se há próxima.
+    """
+    params = [chat_id, cycle_num]
+    after, order = "", "DESC"
+    if cursor is not None:
+        after = {
+            "a": "AND s.submission_id <= ?",
+            "n": "AND s.submission_id < ?",
+            "p": "AND s.submission_id > ?",
+        }[mode]
+        params.append(cursor)
+        if mode == "p":
+            order = "ASC"  # Anda para trás no índice e desinverte abaixo
+    rows = db_query_all(
+        _SUBMISSIONS_PAGE_SQL.format(after=after, order=order),
+        (*params, SUBMISSIONS_PAGE_SIZE + 1),
     )
-    total_subs = total_row["count"] if total_row else 0
-    total_pages = max(1, (total_subs + PAGE_SIZE - 1) // PAGE_SIZE)  # Cálculo de teto
+    if order == "ASC":
+        return rows[:SUBMISSIONS_PAGE_SIZE][::-1], True
+    return rows[:SUBMISSIONS_PAGE_SIZE], len(rows) > SUBMISSIONS_PAGE_SIZE
+
+
+def build_submissions_keyboard(
+    chat_id: int, cycle_num: int, page: int = 0, mode: str = "a", cursor=None
+):
+    """Função helper para criar o teclado paginado de submissões."""
+    submissions, has_next = _fetch_submissions_page(chat_id, cycle_num, mode, cursor)
+
+    if mode == "p" and len(submissions) < SUBMISSIONS_PAGE_SIZE:
+        # Voltou até o topo (ou entraram submissões novas): recomeça da 1ª página
+        page, mode, cursor = 0, "a", None
+        submissions, has_next = _fetch_submissions_page(chat_id, cycle_num, mode, None)
+    elif not submissions and page > 0:
+        # A página ficou vazia (ex: deletou a única linha dela): volta uma
+        return build_submissions_keyboard(chat_id, cycle_num, page - 1, "p", cursor)
+
+    total_subs = submission_count(chat_id, cycle_num)
+    total_pages = max(
+        1, (total_subs + SUBMISSIONS_PAGE_SIZE - 1) // SUBMISSIONS_PAGE_SIZE
+    )  # Cálculo de teto
 
     text = f"📋 <b>Submissões do Ciclo {cycle_num}</b> (Pág {page + 1} de {total_pages})\n\n"
     buttons = []
@@ -945,6 +4291,9 @@ def build_submissions_keyboard(cycle_num: int, page: int = 0):
     if not submissions:
         text += "Nenhuma submissão encontrada para este ciclo."
 
+    # Onde voltar depois de deletar/cancelar: esta mesma página
+    anchor = page_anchor(page, submissions[0] if submissions and page else None)
+
     for sub in submissions:
         # Formata o timestamp (que vem do DB como string ISO)
         try:
@@ -960,23 +4309,25 @@ def build_submissions_keyboard(cycle_num: int, page: int = 0):
             [
                 InlineKeyboardButton(
                     f"❌ Deletar ({ts_str} - {sub['first_name']})",
-                    callback_data=f"del_sub_{sub['submission_id']}_{page}",
+                    callback_data=f"del_sub_{sub['submission_id']}_{anchor}",
                 )
             ]
         )
 
     # Adiciona botões de navegação
     nav_buttons = []
-    if page > 0:
+    if page > 0 and submissions:
         nav_buttons.append(
             InlineKeyboardButton(
-                "⬅️ Anterior", callback_data=f"list_subs_page_{page - 1}"
+                "⬅️ Anterior",
+                callback_data=f"subs_p_{page_anchor(page - 1, submissions[0])}",
             )
         )
-    if (page + 1) < total_pages:
+    if has_next:
         nav_buttons.append(
             InlineKeyboardButton(
-                "Próxima ➡️", callback_data=f"list_subs_page_{page + 1}"
+                "Próxima ➡️",
+                callback_data=f"subs_n_{page_anchor(page + 1, submissions[-1])}",
             )
         )
 
@@ -988,14 +4339,19 @@ def build_submissions_keyboard(cycle_num: int, page: int = 0):
 
 async def list_submissions_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /submissoes - Lista submissões do ciclo com botões para deletar."""
-    cycle_num = get_current_cycle()
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
+    cycle_num = await current_cycle(chat_id)
     if not cycle_num:
-        await update.message.reply_text("Nenhum ciclo de desafio ativo no momento.")
+        await reply_text(update.message, "Nenhum ciclo de desafio ativo no momento.")
         return
 
-    keyboard, text = build_submissions_keyboard(cycle_num, page=0)
-    await update.message.reply_text(
-        text, reply_markup=keyboard, parse_mode=ParseMode.HTML
+    keyboard, text = await db_for(chat_id).run(
+        build_submissions_keyboard, chat_id, cycle_num
+    )
+    await reply_text(
+        update.message, text, reply_markup=keyboard, parse_mode=ParseMode.HTML
     )
 
 
@@ -1007,19 +4363,43 @@ async def submission_button_callback(
     await query.answer()  # Responde ao clique
 
     data = query.data
-    cycle_num = get_current_cycle()
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return
+    db = db_for(chat_id)
+    cycle_num = await current_cycle(chat_id)
 
     if not cycle_num:
-        await query.edit_message_text("O ciclo já foi encerrado.")
+        await edit_message_text(query, "O ciclo já foi encerrado.")
+        return
+
+    # Botões antigos (paginação por OFFSET) ou callback_data malformado
+    try:
+        if data.startswith("subs_"):
+            _, mode, anchor = data.split("_", 2)
+            page, cursor = parse_page_anchor(anchor)
+        else:
+            _, _, submission_id, anchor = data.split("_", 3)
+            submission_id = int(submission_id)
+            page, cursor = parse_page_anchor(anchor)
+    except ValueError:
+        await edit_message_text(
+            query, "Esta lista expirou. Use /submissoes para abrir de novo."
+        )
         return
 
     # --- Lógica de Paginação ---
-    if data.startswith("list_subs_page_"):
-        page = int(data.split("_")[3])
-        keyboard, text = build_submissions_keyboard(cycle_num, page)
+    if data.startswith("subs_"):
+        keyboard, text = await db.run(
+            build_submissions_keyboard, chat_id, cycle_num, page, mode, cursor
+        )
         try:
-            await query.edit_message_text(
-                text, reply_markup=keyboard, parse_mode=ParseMode.HTML
+            await edit_message_text(
+                query,
+                text,
+                wait=True,  # Para cair no except abaixo
+                reply_markup=keyboard,
+                parse_mode=ParseMode.HTML,
             )
         except Exception as e:
             logger.info(
@@ -1027,19 +4407,18 @@ async def submission_button_callback(
             )
 
     # --- Lógica de Confirmação de Deleção ---
-    elif data.startswith("del_sub_confirm_"):
-        parts = data.split("_")
-        submission_id = int(parts[3])
-        page_to_return = int(parts[4])
-
-        # Deleta do DB
-        db_execute("DELETE FROM submissions WHERE submission_id = ?", (submission_id,))
+    elif data.startswith("del_ok_"):
+        # Deleta do DB (e desconta do placar na mesma transação)
+        await db.run_in_transaction(delete_submission, chat_id, submission_id)
 
-        await query.edit_message_text("✅ Submissão deletada com sucesso.")
+        await edit_message_text(query, "✅ Submissão deletada com sucesso.")
 
         # Envia a lista atualizada
-        keyboard, text = build_submissions_keyboard(cycle_num, page_to_return)
-        await query.message.reply_text(
+        keyboard, text = await db.run(
+            build_submissions_keyboard, chat_id, cycle_num, page, "a", cursor
+        )
+        await reply_text(
+            query.message,
             f"Lista de submissões atualizada:\n\n{text}",
             reply_markup=keyboard,
             parse_mode=ParseMode.HTML,
@@ -1047,33 +4426,86 @@ async def submission_button_callback(
 
     # --- Lógica de Deleção (1º clique, pede confirmação) ---
     elif data.startswith("del_sub_"):
-        parts = data.split("_")
-        submission_id = int(parts[2])
-        page = int(parts[3])
-
         # Pede confirmação
         keyboard = InlineKeyboardMarkup(
             [
                 [
                     InlineKeyboardButton(
                         "✅ SIM, DELETAR AGORA",
-                        callback_data=f"del_sub_confirm_{submission_id}_{page}",
+                        callback_data=f"del_ok_{submission_id}_{anchor}",
                     )
                 ],
                 [
                     InlineKeyboardButton(
-                        "❌ NÃO, VOLTAR", callback_data=f"list_subs_page_{page}"
+                        "❌ NÃO, VOLTAR", callback_data=f"subs_a_{anchor}"
                     )
                 ],
             ]
         )
-        await query.edit_message_text(
+        await edit_message_text(
+            query,
             "⚠️ <b>Tem certeza?</b>\n\nEsta ação não pode ser desfeita e irá recalcular os pontos e dívidas na próxima vez que o relatório semanal rodar.",
             reply_markup=keyboard,
             parse_mode=ParseMode.HTML,
         )
 
 
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /exportar [ciclo] [csv|jsonl] - Envia os dados do ciclo como arquivos .gz (admins)."""
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
+        return
+
+    args = [arg.lower() for arg in context.args or []]
+    numbers = [arg for arg in args if arg.isdigit()]
+    formats = [arg for arg in args if arg in EXPORT_FORMATS]
+    if len(numbers) + len(formats) != len(args) or len(numbers) > 1 or len(formats) > 1:
+        await reply_text(
+            update.message,
+            "Uso: /exportar [ciclo] [csv|jsonl]\n"
+            "Sem o número, exporta o ciclo atual. O padrão é csv.",
+        )
+        return
+    fmt = formats[0] if formats else "csv"
+    cycle_num = int(numbers[0]) if numbers else await current_cycle(chat_id)
+    if not cycle_num:
+        await reply_text(update.message, "Nenhum ciclo de desafio ativo no momento.")
+        return
+    cycle = await db_for(chat_id).fetch_one(
+        "SELECT cycle_num FROM cycles WHERE chat_id = ? AND cycle_num = ?",
+        (chat_id, cycle_num),
+    )
+    if cycle is None:
+        await reply_text(update.message, f"O ciclo {cycle_num} não existe.")
+        return
+
+    await reply_text(
+        update.message, f"Gerando a exportação do ciclo {cycle_num} ({fmt})..."
+    )
+    files = await asyncio.to_thread(export_cycle, chat_id, cycle_num, fmt)
+    try:
+        for name, path, count in files:
+            filename = f"ciclo{cycle_num}_{name}.{fmt}.gz"
+            if os.path.getsize(path) > EXPORT_MAX_BYTES:
+                await reply_text(
+                    update.message,
+                    f"{filename} passou do limite de 50 MB do Telegram e não foi enviado.",
+                )
+                continue
+            await reply_document(
+                update.message,
+                Path(path),
+                priority=PRIORITY_BULK,
+                wait=True,  # O arquivo é apagado logo depois
+                filename=filename,
+                caption=f"{name}: {count} linhas",
+                write_timeout=120,
+            )
+    finally:
+        remove_export_files(files)
+    logger.info(f"Chat {chat_id}: ciclo {cycle_num} exportado ({fmt}).")
+
+
 # --- Comandos de Debug (Somente Admins) ---
 
 
@@ -1081,8 +4513,8 @@ async def debug_check_admin(update: Update) -> bool:
     """Função helper para checar se o usuário é admin."""
     user_id = update.effective_user.id
     if user_id not in ADMIN_USER_IDS:
-        await update.message.reply_text(
-            "⛔ Você não tem permissão para usar este comando."
+        await reply_text(
+            update.message, "⛔ Você não tem permissão para usar este comando."
         )
         logger.warning(
             f"Tentativa de uso de comando admin negada para o user_id: {user_id}"
@@ -1093,29 +4525,31 @@ async def debug_check_admin(update: Update) -> bool:
 
 async def debug_weekly_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /debug_weekly - Roda o relatório semanal manualmente."""
-    if not await debug_check_admin(update):
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
         return
 
-    await update.message.reply_text("Executando relatório semanal manualmente... ⏳")
+    await reply_text(update.message, "Executando relatório semanal manualmente... ⏳")
     try:
-        await run_weekly_report(context.application)
-        await update.message.reply_text("✅ Relatório semanal manual concluído.")
+        await run_weekly_report(context.application, chat_id)
+        await reply_text(update.message, "✅ Relatório semanal manual concluído.")
     except Exception as e:
-        await update.message.reply_text(f"❌ Erro ao rodar relatório semanal: {e}")
+        await reply_text(update.message, f"❌ Erro ao rodar relatório semanal: {e}")
         logger.error("Erro no /debug_weekly", exc_info=True)
 
 
 async def debug_cycle_end_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /debug_cycle_end - Roda o fim de ciclo manualmente."""
-    if not await debug_check_admin(update):
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
         return
 
-    await update.message.reply_text("Executando fim de ciclo manualmente... ⏳")
+    await reply_text(update.message, "Executando fim de ciclo manualmente... ⏳")
     try:
-        await run_bi_monthly_cycle_end(context.application)
-        await update.message.reply_text("✅ Fim de ciclo manual concluído.")
+        await run_bi_monthly_cycle_end(context.application, chat_id)
+        await reply_text(update.message, "✅ Fim de ciclo manual concluído.")
     except Exception as e:
-        await update.message.reply_text(f"❌ Erro ao rodar fim de ciclo: {e}")
+        await reply_text(update.message, f"❌ Erro ao rodar fim de ciclo: {e}")
         logger.error("Erro no /debug_cycle_end", exc_info=True)
 
 
@@ -1126,55 +4560,299 @@ async def debug_list_jobs_command(update: Update, context: ContextTypes.DEFAULT_
 
     scheduler = context.application.bot_data.get("scheduler")
     if not scheduler or not scheduler.running:
-        await update.message.reply_text(
-            "Agendador não está rodando ou não foi encontrado."
+        await reply_text(
+            update.message, "Agendador não está rodando ou não foi encontrado."
         )
         return
 
     jobs = scheduler.get_jobs()
     if not jobs:
-        await update.message.reply_text("Nenhum job agendado no momento.")
+        await reply_text(update.message, "Nenhum job agendado no momento.")
         return
 
-    text = f"Jobs Agendados (Total: {len(jobs)}):\n\n"
+    text = (
+        f"Jobs Agendados (Total: {len(jobs)}):\n"
+        f"Horários na roda do dispatcher: {len(schedule_wheel)}\n\n"
+    )
     for job in jobs:
         text += (
             f"• <b>ID:</b> `{job.id}`\n"
             f"  <b>Próxima Execução:</b> `{job.next_run_time}`\n"
-            f"  <b>Função:</b> `{job.func.__name__}`\n\n"
+            f"  <b>Função:</b> `{job_label(job)}`\n\n"
         )
 
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    # Atraso (previsto -> início) e duração das execuções desde o boot
+    stats = job_telemetry.summary()
+    if stats:
+        text += "<b>Execuções desde o boot</b> (atraso / duração):\n"
+        for job_name, entry in stats.items():
+            lateness, duration = entry["lateness"], entry["duration"]
+            statuses = ", ".join(
+                f"{k}={v}" for k, v in sorted(entry["statuses"].items())
+            )
+            text += (
+                f"• <code>{job_name}</code>: {lateness['count']}x ({statuses})\n"
+                f"  atraso p50 {lateness['p50']:.2f}s, p95 {lateness['p95']:.2f}s, "
+                f"máx {lateness['max']:.2f}s\n"
+                f"  duração p50 {duration['p50']:.2f}s, máx {duration['max']:.2f}s\n"
+            )
+
+    # Jobs críticos: últimas execuções registradas (inclusive replays)
+    runs = await _shards[0].fetch_all(
+        "SELECT job_id, scheduled_at, started_at, finished_at, status, replayed "
+        "FROM job_runs ORDER BY scheduled_at DESC LIMIT 10"
+    )
+    if runs:
+        text += "\n<b>Últimas execuções críticas:</b>\n"
+        for run in runs:
+            scheduled = datetime.fromtimestamp(run["scheduled_at"], TIMEZONE)
+            late = run["started_at"] - run["scheduled_at"]
+            took = (
+                f", {run['finished_at'] - run['started_at']:.1f}s"
+                if run["finished_at"]
+                else ""
+            )
+            text += (
+                f"• <code>{run['job_id']}</code> {scheduled:%d/%m %H:%M}: "
+                f"{run['status']}{' (replay)' if run['replayed'] else ''}, "
+                f"atraso {late:.0f}s{took}\n"
+            )
+
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
 async def debug_cycle_info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /debug_cycle - Mostra infos do ciclo atual."""
-    if not await debug_check_admin(update):
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
         return
 
-    cycle_num = get_current_cycle()
+    cycle_num = await current_cycle(chat_id)
     if not cycle_num:
-        await update.message.reply_text(
-            "get_current_cycle() retornou None. Nenhum ciclo ativo."
+        await reply_text(
+            update.message, "get_current_cycle() retornou None. Nenhum ciclo ativo."
         )
         return
 
-    cycle = db_query_one("SELECT * FROM cycles WHERE cycle_num = ?", (cycle_num,))
+    cycle = await db_for(chat_id).fetch_one(
+        "SELECT * FROM cycles WHERE chat_id = ? AND cycle_num = ?", (chat_id, cycle_num)
+    )
     if not cycle:
-        await update.message.reply_text(
-            f"Ciclo {cycle_num} não encontrado no banco de dados."
+        await reply_text(
+            update.message, f"Ciclo {cycle_num} não encontrado no banco de dados."
         )
         return
 
     text = (
         f"<b>Informações do Ciclo Ativo</b>\n"
+        f"<b>Grupo:</b> {chat_id} (shard {_chat_shards.get(chat_id, 0)})\n"
         f"<b>Número:</b> {cycle['cycle_num']}\n"
         f"<b>Início:</b> {cycle['start_date']}\n"
         f"<b>Fim:</b> {cycle['end_date']}\n"
         f"<b>Ativo:</b> {cycle['is_active']}\n"
         f"<b>Vencedor:</b> {cycle['winner_user_id'] or 'N/A'}"
     )
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
+
+
+async def debug_scores_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_scores - Verifica o placar materializado e reconstrói se divergir."""
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
+        return
+
+    db = db_for(chat_id)
+    drift = await db.run(verify_scores)
+    if not drift:
+        await reply_text(update.message, "✅ Placar consistente com as submissões.")
+        return
+
+    await reply_text(
+        update.message,
+        f"⚠️ {drift} linha(s) divergente(s) no placar. Reconstruindo... ⏳",
+    )
+    await db.run_in_transaction(rebuild_scores)
+    drift = await db.run(verify_scores)
+    await reply_text(
+        update.message, f"✅ Placar reconstruído. Divergências restantes: {drift}."
+    )
+
+
+async def debug_pote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_pote - Audita os saldos do pote contra o livro-caixa e reconstrói se divergir."""
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
+        return
+
+    db = db_for(chat_id)
+    drift = await db.run(verify_pote_balances)
+    if not drift:
+        await reply_text(update.message, "✅ Saldos do pote batem com o livro-caixa.")
+        return
+
+    await reply_text(
+        update.message,
+        f"⚠️ {drift} saldo(s) divergente(s) no pote. Reconstruindo... ⏳",
+    )
+    await db.run_in_transaction(rebuild_pote_balances)
+    drift = await db.run(verify_pote_balances)
+    await reply_text(
+        update.message, f"✅ Saldos reconstruídos. Divergências restantes: {drift}."
+    )
+
+
+async def debug_cache_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_cache - Acertos/erros do cache de /leaderboard e /pote."""
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
+        return
+
+    stats = render_cache.stats()
+    text = (
+        "🗂️ <b>Cache de mensagens</b>\n\n"
+        f"<b>Acertos:</b> {stats['hits']}\n"
+        f"<b>Erros:</b> {stats['misses']}\n"
+        f"<b>Taxa de acerto:</b> {stats['hit_rate']:.0%}\n"
+        f"<b>Entradas:</b> {stats['entries']}\n"
+        f"<b>Versão dos dados deste grupo:</b> {render_cache.version(chat_id)}"
+    )
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
+
+
+async def debug_latency_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_latencia - Latência da chegada do update até a 1ª resposta."""
+    if not await debug_check_admin(update):
+        return
+
+    lat = reply_latency.summary()
+    text = (
+        f"<b>Latência de Atendimento</b> (modo {BOT_MODE})\n"
+        f"Respostas medidas: {lat['count']}\n"
+        f"média {lat['avg'] * 1000:.0f}ms | p50 {lat['p50'] * 1000:.0f}ms | "
+        f"p95 {lat['p95'] * 1000:.0f}ms | p99 {lat['p99'] * 1000:.0f}ms | "
+        f"máx {lat['max'] * 1000:.0f}ms\n"
+    )
+    receiver = context.application.bot_data.get("webhook")
+    if receiver is not None:
+        text += (
+            f"\nWebhook: {receiver.accepted} aceitos, {receiver.rejected} rejeitados, "
+            f"{context.application.update_queue.qsize()} na fila"
+        )
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
+
+
+async def debug_slow_queries_command(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+):
+    """Comando /debug_slow_queries - Consultas mais caras (profiler dos helpers db_*)."""
+    if not await debug_check_admin(update):
+        return
+
+    if not query_profiler.enabled:
+        await reply_text(
+            update.message,
+            "Profiler de consultas desligado. Suba o bot com DB_PROFILE=1 para ligar.",
+        )
+        return
+    if context.args and context.args[0] == "reset":
+        query_profiler.reset()
+        await reply_text(update.message, "Estatísticas do profiler zeradas.")
+        return
+
+    report = query_profiler.report(top=5)
+
+    def describe(row):
+        line = (
+            f"<code>{html.escape(row['sql'][:300])}</code>\n"
+            f"  {row['count']}x | total {row['total'] * 1000:.0f}ms | "
+            f"média {row['avg'] * 1000:.2f}ms | p99 {row['p99'] * 1000:.2f}ms | "
+            f"máx {row['max'] * 1000:.1f}ms | lentas {row['slow']}\n"
+        )
+        if row["plan"]:
+            plan = "\n".join(row["plan"])
+            line += f"  plano: <code>{html.escape(plan[:300])}</code>\n"
+        return line
+
+    parts = [
+        f"<b>Consultas</b> ({report['fingerprints']} fingerprints, "
+        f"lenta = acima de {DB_PROFILE_SLOW_MS:.0f}ms)\n"
+    ]
+    for title, rows in (
+        ("Por tempo total", report["by_total"]),
+        ("Por p99", report["by_p99"]),
+    ):
+        parts.append(f"\n<b>{title}:</b>\n")
+        parts.extend(describe(row) for row in rows)
+
+    # Limite de 4096 caracteres por mensagem: corta entre itens, nunca no meio do HTML
+    text = ""
+    for part in parts:
+        if len(text) + len(part) > 4000:
+            break
+        text += part
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
+
+
+def archive_stats(chat_id: int) -> dict:
+    """Linhas do grupo na tabela quente e no arquivo morto, por tabela."""
+    stats = {}
+    for table in ARCHIVED_TABLES:
+        hot = db_query_one(
+            f"SELECT COUNT(*) AS n FROM main.{table} WHERE chat_id = ?", (chat_id,)
+        )
+        cold = db_query_one(
+            f"SELECT COUNT(*) AS n FROM archive.{table} WHERE chat_id = ?", (chat_id,)
+        )
+        stats[table] = (hot["n"], cold["n"])
+    archived = db_query_all(
+        "SELECT cycle_num FROM cycles WHERE chat_id = ? AND archived_at IS NOT NULL "
+        "ORDER BY cycle_num",
+        (chat_id,),
+    )
+    stats["cycles"] = [row["cycle_num"] for row in archived or []]
+    return stats
+
+
+async def debug_archive_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_archive - Arquiva agora os ciclos encerrados e mostra os volumes."""
+    chat_id = chat_scope(update)
+    if chat_id is None or not await debug_check_admin(update):
+        return
+
+    db = db_for(chat_id)
+    archived = await db.run(archive_closed_cycles, chat_id)
+    stats = await db.run(archive_stats, chat_id)
+
+    lines = ["<b>Arquivo morto</b>"]
+    for cycle_num, moved in archived.items():
+        lines.append(f"Arquivado agora: ciclo {cycle_num} ({moved})")
+    if not archived:
+        lines.append("Nenhum ciclo novo para arquivar.")
+    cycles = ", ".join(str(n) for n in stats.pop("cycles")) or "nenhum"
+    lines.append(f"Ciclos arquivados: {cycles}")
+    for table, (hot, cold) in stats.items():
+        lines.append(f"{table}: {hot} quentes | {cold} no arquivo")
+    await reply_text(update.message, "\n".join(lines), parse_mode=ParseMode.HTML)
+
+
+async def debug_outbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /debug_envios - Mostra a fila de envio (profundidade e espera)."""
+    if not await debug_check_admin(update):
+        return
+
+    stats = outbox.stats()
+    text = (
+        f"<b>Fila de Envio</b>\n"
+        f"Enviadas: {stats['sent']} | RetryAfter: {stats['retries']} | "
+        f"Falhas: {stats['failures']} | Chats: {stats['chats']}\n\n"
+    )
+    for name, lane in stats["lanes"].items():
+        text += (
+            f"• <b>{name}</b>: {lane['depth']} na fila | espera média "
+            f"{lane['wait_avg']:.2f}s, p95 {lane['wait_p95']:.2f}s, "
+            f"máx {lane['wait_max']:.2f}s\n"
+        )
+    await reply_text(update.message, text, parse_mode=ParseMode.HTML)
 
 
 # --- Lógica da Conversa de Edição de Horário ---
@@ -1182,8 +4860,14 @@ async def debug_cycle_info_command(update: Update, context: ContextTypes.DEFAULT
 
 async def edit_schedule_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Inicia a conversa para editar/adicionar um horário."""
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return ConversationHandler.END
     user_id = update.effective_user.id
-    schedules = db_query_all("SELECT * FROM schedules WHERE user_id = ?", (user_id,))
+    schedules = await db_for(chat_id).fetch_all(
+        "SELECT * FROM schedules WHERE chat_id = ? AND user_id = ?",
+        (chat_id, user_id),
+    )
 
     # Mapeamento para português
     day_map_pt = {
@@ -1212,8 +4896,10 @@ async def edit_schedule_start(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     reply_markup = InlineKeyboardMarkup(buttons)
 
-    await update.message.reply_text(
-        "Qual horário você gostaria de editar ou adicionar?", reply_markup=reply_markup
+    await reply_text(
+        update.message,
+        "Qual horário você gostaria de editar ou adicionar?",
+        reply_markup=reply_markup,
     )
 
     return STATE_SELECT_SCHEDULE
@@ -1229,15 +4915,15 @@ async def select_schedule_callback(update: Update, context: ContextTypes.DEFAULT
     if query.data == "add_new":
         user_data["action"] = "add"
         user_data["schedule_id"] = None
-        await query.edit_message_text("Ok, vamos adicionar um novo horário.")
+        await edit_message_text(query, "Ok, vamos adicionar um novo horário.")
     elif query.data == "cancel":
-        await query.edit_message_text("Edição cancelada.")
+        await edit_message_text(query, "Edição cancelada.")
         return ConversationHandler.END
     elif query.data.startswith("edit_"):
         schedule_id = int(query.data.split("_")[1])
         user_data["action"] = "edit"
         user_data["schedule_id"] = schedule_id
-        await query.edit_message_text("Ok, vamos editar este horário.")
+        await edit_message_text(query, "Ok, vamos editar este horário.")
 
     # Pergunta o dia da semana
     buttons = [
@@ -1246,7 +4932,8 @@ async def select_schedule_callback(update: Update, context: ContextTypes.DEFAULT
         ["Domingo"],
         ["❌ Cancelar"],
     ]
-    await query.message.reply_text(
+    await reply_text(
+        query.message,
         "Qual o novo dia da semana?",
         reply_markup=ReplyKeyboardMarkup(buttons, one_time_keyboard=True),
     )
@@ -1260,8 +4947,8 @@ async def get_day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = context.user_data
 
     if day_pt == "❌ Cancelar":
-        await update.message.reply_text(
-            "Edição cancelada.", reply_markup=ReplyKeyboardRemove()
+        await reply_text(
+            update.message, "Edição cancelada.", reply_markup=ReplyKeyboardRemove()
         )
         user_data.clear()
         return ConversationHandler.END
@@ -1279,12 +4966,13 @@ async def get_day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     day_en = day_map_en.get(day_pt)
 
     if not day_en:
-        await update.message.reply_text("Dia inválido. Por favor, use os botões.")
+        await reply_text(update.message, "Dia inválido. Por favor, use os botões.")
         return STATE_GET_DAY  # Permanece no mesmo estado
 
     user_data["new_day"] = day_en
 
-    await update.message.reply_text(
+    await reply_text(
+        update.message,
         "Entendido. Agora, por favor, me envie a nova hora no formato <b>HH:MM</b> (ex: 21:00 ou 09:30).",
         reply_markup=ReplyKeyboardRemove(),
         parse_mode=ParseMode.HTML,
@@ -1298,8 +4986,10 @@ async def get_time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     time_str = update.message.text
     user_data = context.user_data
     user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
-    scheduler = context.bot_data["scheduler"]
+    chat_id = chat_scope(update)
+    if chat_id is None:
+        return ConversationHandler.END
+    db = db_for(chat_id)
 
     try:
         # Valida o formato da hora
@@ -1311,41 +5001,41 @@ async def get_time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if action == "add":
             # Adiciona novo horário no DB
-            db_execute(
-                "INSERT INTO schedules (user_id, day_of_week, time_of_day) VALUES (?, ?, ?)",
-                (user_id, new_day, new_time_str),
+            schedule_id = await db.execute(
+                "INSERT INTO schedules (chat_id, user_id, day_of_week, time_of_day) VALUES (?, ?, ?, ?)",
+                (chat_id, user_id, new_day, new_time_str),
             )
-            await update.message.reply_text(
-                f"✅ Horário adicionado: {new_day.capitalize()} às {new_time_str}."
+            await reply_text(
+                update.message,
+                f"✅ Horário adicionado: {new_day.capitalize()} às {new_time_str}.",
             )
 
         elif action == "edit":
-            # Remove jobs antigos
-            old_schedule = db_query_one(
-                "SELECT * FROM schedules WHERE schedule_id = ?", (schedule_id,)
-            )
-            if old_schedule["job_id_reminder"]:
-                scheduler.remove_job(old_schedule["job_id_reminder"])
-            if old_schedule["job_id_prompt"]:
-                scheduler.remove_job(old_schedule["job_id_prompt"])
-
             # Atualiza no DB
-            db_execute(
-                "UPDATE schedules SET day_of_week = ?, time_of_day = ? WHERE schedule_id = ?",
-                (new_day, new_time_str, schedule_id),
+            await db.execute(
+                "UPDATE schedules SET day_of_week = ?, time_of_day = ? WHERE schedule_id = ? AND chat_id = ?",
+                (new_day, new_time_str, schedule_id, chat_id),
             )
-            await update.message.reply_text(
-                f"✅ Horário atualizado para: {new_day.capitalize()} às {new_time_str}."
+            await reply_text(
+                update.message,
+                f"✅ Horário atualizado para: {new_day.capitalize()} às {new_time_str}.",
             )
 
-        # Reagenda os jobs para este usuário
-        schedule_user_jobs(scheduler, user_id, chat_id, context.application)
+        # Atualiza só este horário na roda de horários (vale na hora)
+        if schedule_id:
+            schedule = await db.fetch_one(
+                "SELECT * FROM schedules WHERE schedule_id = ? AND chat_id = ?",
+                (schedule_id, chat_id),
+            )
+            if schedule:
+                apply_schedule(schedule)
 
         user_data.clear()  # Limpa os dados temporários
         return ConversationHandler.END
 
     except ValueError:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             "Formato de hora inválido. Por favor, envie no formato <b>HH:MM</b> (ex: 21:00).",
             parse_mode=ParseMode.HTML,
         )
@@ -1355,8 +5045,8 @@ async def get_time_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancela a conversa de edição."""
     context.user_data.clear()
-    await update.message.reply_text(
-        "Edição cancelada.", reply_markup=ReplyKeyboardRemove()
+    await reply_text(
+        update.message, "Edição cancelada.", reply_markup=ReplyKeyboardRemove()
     )
     return ConversationHandler.END
 
@@ -1368,48 +5058,93 @@ async def post_init(application: Application):
     2. Carrega TODOS os agendamentos do banco de dados.
     """
 
-    # 1. Inicia o Scheduler
+    # Os jobs persistidos buscam o Application por aqui ao executar
+    global _application
+    _application = application
+
+    # 1. Inicia o Scheduler (carrega os jobs persistidos no SQLite)
     scheduler = application.bot_data.get("scheduler")
     if not scheduler:
         logger.error("Scheduler não encontrado no bot_data durante o post_init!")
         return
 
+    # Antes do scheduler disparar os atrasados: execuções que o restart
+    # interrompeu e os horários que estavam pendentes no job store
+    await mark_interrupted_job_runs()
+    pending = {
+        row["id"]: row["next_run_time"]
+        for row in await _shards[0].fetch_all(
+            "SELECT id, next_run_time FROM apscheduler_jobs"
+        )
+        or []
+    }
+
+    jobstore = application.bot_data.get("jobstore")
+    if jobstore is not None:
+        await jobstore.load()  # Fora do loop; o scheduler.start() só restaura
+
+    # A roda de horários é carregada antes do 1º dispatch, que recupera os
+    # minutos que o restart pulou a partir do último disparo persistido
+    for chat_id in GROUP_CHAT_IDS:
+        await reconcile_schedules(chat_id)
+    restore_dispatch_cursor(pending.get("schedule_dispatcher"))
+
     try:
         scheduler.start()
         logger.info("APScheduler iniciado com sucesso via hook post_init.")
     except Exception as e:
         logger.warning(f"APScheduler já estava rodando? Erro: {e}")
 
-    # 2. Verifica se o CHAT_ID está configurado
-    if "GROUP_CHAT_ID" not in globals() or GROUP_CHAT_ID == 0:
-        logger.critical(
-            "GROUP_CHAT_ID não está configurado! Os agendamentos não serão carregados."
-        )
-        return
-
-    chat_id = GROUP_CHAT_ID
-    logger.info(f"Carregando agendamentos para o chat ID: {chat_id}...")
+    # 2. Carrega os agendamentos de cada grupo configurado
+    logger.info(f"Carregando agendamentos para os chats: {GROUP_CHAT_IDS}...")
 
     try:
-        # 3. Agenda os Jobs Globais (Relatórios)
-        schedule_global_jobs(scheduler, chat_id, application)
+        # Jobs já persistidos: uma única leitura do job store. Só o que
+        # estiver faltando ou diferente é (re)criado abaixo.
+        existing = {job.id: job for job in scheduler.get_jobs()}
+        logger.info(f"{len(existing)} job(s) carregado(s) do job store.")
+
+        keep = set()
+        for chat_id in GROUP_CHAT_IDS:
+            # 3. Agenda os Jobs Globais do grupo (Relatórios)
+            chat_jobs = schedule_global_jobs(scheduler, chat_id, existing)
+
+            # 4. Garante que o ciclo atual do grupo existe
+            await current_cycle(chat_id)
+
+            keep.update(chat_jobs)
+        remove_stale_chat_jobs(scheduler, keep, existing)
         logger.info("Agendamentos Globais (semanal, diário, ciclo) carregados.")
 
-        # 4. Agenda os Jobs Individuais (Lembretes)
-        users = db_query_all("SELECT user_id FROM users")
-        if not users:
-            logger.warning(
-                "Nenhum usuário no banco de dados. Agendamentos de usuários pulados."
-            )
-        else:
-            logger.info(f"Carregando agendamentos para {len(users)} usuário(s)...")
-            for user in users:
-                user_id = user["user_id"]
-                schedule_user_jobs(scheduler, user_id, chat_id, application)
-            logger.info("Agendamentos de usuários carregados com sucesso.")
+        ensure_job(
+            scheduler,
+            "schedule_dispatcher",
+            "dispatch_schedules",
+            CronTrigger(second=0, timezone=TIMEZONE),
+            existing=existing,
+        )
+
+        # 5. Recarrega as janelas de prompt abertas e agenda o sweeper
+        await prompt_windows.load()
+        ensure_job(
+            scheduler,
+            "prompt_window_sweeper",
+            "sweep_prompt_windows",
+            IntervalTrigger(minutes=5, timezone=TIMEZONE),
+            existing=existing,
+        )
+
+        # 6. Refaz (uma única vez) os jobs críticos perdidos no restart
+        application.bot_data["job_replay"] = asyncio.get_running_loop().create_task(
+            replay_missed_jobs(scheduler, pending)
+        )
 
-        # 5. Garante que o ciclo atual existe
-        get_current_cycle()
+        # 7. Endpoint de métricas (opcional)
+        if METRICS_PORT:
+            application.bot_data["metrics_server"] = await start_http_server(
+                metrics_endpoint, METRICS_LISTEN, METRICS_PORT
+            )
+            logger.info(f"Métricas em http://{METRICS_LISTEN}:{METRICS_PORT}/metrics")
 
         logger.info("Bot Coach está pronto e totalmente sincronizado.")
 
@@ -1419,25 +5154,350 @@ async def post_init(application: Application):
         )
 
 
-# --- Função Principal (Main) ---
+async def post_shutdown(application: Application):
+    """Fecha as conexões do pool do banco ao desligar o bot."""
+    replay = application.bot_data.pop("job_replay", None)
+    if replay is not None and not replay.done():
+        replay.cancel()
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await outbox.stop()
+    for shard in _shards:
+        shard.stop()
+        shard.pool.close()
+    logger.info("Conexões do banco de dados fechadas.")
 
 
-def main() -> None:
-    """Função principal que inicia o bot."""
+# --- Processamento Concorrente de Updates ---
 
-    # 1. Inicializa o banco de dados
-    init_db()
 
-    # 2. Cria o Application (o "cérebro" do bot)
-    application = (
-        Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processa até 'limit' updates em paralelo, mas serializa os de um mesmo
+    (chat_id, user_id) com um lock por chave, na ordem de chegada. Assim
+    usuários diferentes não esperam uns pelos outros, e as sequências
+    "verifica e depois grava" de um mesmo usuário (limite de 2 por semana,
+    pagamento de dívida, conversa de edição) nunca se intercalam.
+
+    O slot de concorrência só é pego depois do lock da chave: um update
+    esperando a vez do seu usuário não ocupa slot, então uma rajada de um
+    grupo (ou de um usuário) não trava os updates dos outros. Por isso o
+    semáforo do PTB fica praticamente ilimitado e o limite real é _slots.
+    """
+
+    PTB_LIMIT = 1_000_000  # O PTB só cria a task do update; quem limita é _slots
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(self.PTB_LIMIT)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}  # (chat_id, user_id) -> [asyncio.Lock, updates na chave]
+
+    @staticmethod
+    def update_key(update):
+        """Chave de ordenação do update (None = pode rodar sem trava)."""
+        if not isinstance(update, Update):
+            return None
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+
+    def pending(self) -> int:
+        """Quantas chaves têm updates rodando ou esperando."""
+        return len(self._locks)
+
+    async def do_process_update(self, update, coroutine):
+        key = self.update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:  # asyncio.Lock é FIFO: mantém a ordem de chegada
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# --- Modo Webhook (servidor HTTP embutido) ---
+# Servidor HTTP/1.1 mínimo sobre asyncio (sem dependências extras). O handler
+# recebe (método, caminho, headers, corpo) e devolve (status, content-type, corpo).
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+HTTP_MAX_BODY = 1024 * 1024  # Updates do Telegram são bem menores que isso
+HTTP_IDLE_TIMEOUT = 60  # Segundos de conexão keep-alive ociosa
+
+
+def _http_response(status: int, content_type: str, body: bytes, keep_alive: bool):
+    head = (
+        f"HTTP/1.1 {status} {HTTP_REASONS.get(status, 'OK')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    return head.encode("latin-1") + body
+
+
+async def _serve_http_connection(handler, reader, writer):
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(
+                    reader.readline(), timeout=HTTP_IDLE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                break
+            if not request_line:
+                break
+
+            parts = request_line.decode("latin-1").split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if len(parts) != 3:
+                writer.write(_http_response(400, "text/plain", b"", False))
+                break
+            method, target, version = parts
+
+            length = int(headers.get("content-length") or 0)
+            if length > HTTP_MAX_BODY:
+                writer.write(_http_response(413, "text/plain", b"", False))
+                break
+            body = await reader.readexactly(length) if length else b""
+
+            try:
+                status, content_type, payload = await handler(
+                    method, target.split("?", 1)[0], headers, body
+                )
+            except Exception as e:
+                logger.error(f"Erro no servidor HTTP ({method} {target}): {e}")
+                status, content_type, payload = 500, "text/plain", b""
+
+            keep_alive = (
+                version == "HTTP/1.1"
+                and headers.get("connection", "").lower() != "close"
+            )
+            writer.write(_http_response(status, content_type, payload, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(handler, host: str, port: int):
+    """Sobe o servidor HTTP embutido. Retorna o asyncio.Server."""
+    return await asyncio.start_server(
+        lambda reader, writer: _serve_http_connection(handler, reader, writer),
+        host,
+        port,
     )
 
-    # 3. Inicia o Agendador (Scheduler)
-    scheduler = AsyncIOScheduler(timezone=TIMEZONE)
+
+class WebhookReceiver:
+    """
+    Recebe os POSTs do Telegram: confere o secret token, coloca o update na
+    update_queue do Application e responde 200 na hora (o processamento é
+    assíncrono, então o Telegram nunca espera pelos handlers).
+    """
+
+    SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.accepted = 0
+        self.rejected = 0
+
+    async def handle(self, method: str, path: str, headers: dict, body: bytes):
+        if path != self.path:
+            return 404, "text/plain", b""
+        if method != "POST":
+            return 405, "text/plain", b""
+        if not hmac.compare_digest(
+            headers.get(self.SECRET_HEADER, "").encode(), self.secret
+        ):
+            self.rejected += 1
+            logger.warning("Webhook: secret token inválido, update recusado.")
+            return 403, "text/plain", b""
+
+        arrived = monotonic()
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            update = None
+            logger.warning(f"Webhook: corpo inválido ({e}).")
+        if update is None:
+            self.rejected += 1
+            return 400, "text/plain", b""
+
+        _update_arrivals[update.update_id] = arrived
+        self.application.update_queue.put_nowait(update)
+        self.accepted += 1
+        return 200, "text/plain", b""
+
+
+async def run_webhook(application: Application):
+    """Ciclo de vida do bot em modo webhook (equivalente ao run_polling)."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    receiver = WebhookReceiver(application, WEBHOOK_PATH, WEBHOOK_SECRET)
+    application.bot_data["webhook"] = receiver
+
+    async with application:  # initialize() / shutdown()
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()  # Começa a consumir a update_queue
+
+        server = await start_http_server(receiver.handle, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        logger.info(
+            f"Webhook ouvindo em http://{WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+        )
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook registrado no Telegram: {WEBHOOK_URL}")
+        else:
+            logger.warning("WEBHOOK_URL não definida: o setWebhook não foi chamado.")
+
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+
+
+# --- Endpoint de Métricas ---
+
+
+def _scheduled_jobs() -> int:
+    jobstore = _application.bot_data.get("jobstore") if _application else None
+    return len(jobstore) if jobstore is not None else 0
+
+
+metrics.gauge(
+    "prove_it_prompt_windows_open",
+    "Janelas de prompt abertas.",
+    lambda: len(prompt_windows),
+)
+metrics.gauge("prove_it_scheduler_jobs", "Jobs no APScheduler.", _scheduled_jobs)
+metrics.gauge(
+    "prove_it_schedule_wheel_entries",
+    "Horários de lembrete/prompt na roda de horários.",
+    lambda: len(schedule_wheel),
+)
+metrics.gauge(
+    "prove_it_outbox_depth",
+    "Mensagens aguardando na fila de envio, por prioridade.",
+    lambda: {(PRIORITY_NAMES[p],): len(lane) for p, lane in outbox.lanes.items()},
+    ("priority",),
+)
+
+
+async def metrics_endpoint(method: str, path: str, headers: dict, body: bytes):
+    """GET /metrics no formato texto do Prometheus."""
+    if path != "/metrics":
+        return 404, "text/plain", b""
+    if method != "GET":
+        return 405, "text/plain", b""
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics.render().encode()
+
+
+def instrument_handlers(application: Application):
+    """Mede todos os handlers registrados (inclusive os de dentro das conversas)."""
+
+    def wrap(handler):
+        if isinstance(handler, ConversationHandler):
+            for child in (
+                handler.entry_points
+                + [h for state in handler.states.values() for h in state]
+                + handler.fallbacks
+            ):
+                wrap(child)
+        else:
+            handler.callback = timed_handler(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+
+
+# --- Função Principal (Main) ---
+
+
+def build_application(
+    token: str = TELEGRAM_TOKEN, base_url: str = TELEGRAM_API_URL
+) -> Application:
+    """Cria o Application com o agendador e todos os handlers (sem iniciar nada)."""
+
+    # 2. Cria o Application (o "cérebro" do bot)
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(InstrumentedRequest(connection_pool_size=256))
+        .get_updates_request(InstrumentedRequest())
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+
+    # 3. Inicia o Agendador (Scheduler), com os jobs persistidos no próprio bot.db
+    jobstore = SQLiteJobStore(_shards[0])
+    scheduler = AsyncIOScheduler(
+        timezone=TIMEZONE,
+        jobstores={"default": jobstore},
+        executors={"default": JobExecutor()},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 60},
+    )
 
     # Armazena o scheduler no contexto do bot para ser acessível em qualquer handler
     application.bot_data["scheduler"] = scheduler
+    application.bot_data["jobstore"] = jobstore
 
     # 4. Define a Conversa de Edição de Horário
     edit_conv_handler = ConversationHandler(
@@ -1458,6 +5518,8 @@ def main() -> None:
     )
 
     # 5. Registra todos os Handlers (Comandos)
+    # Grupo -1: marca a chegada de cada update (latência até a 1ª resposta)
+    application.add_handler(TypeHandler(Update, track_update_arrival), group=-1)
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("leaderboard", leaderboard_command))
     application.add_handler(CommandHandler("pote", pote_command))
@@ -1466,14 +5528,26 @@ def main() -> None:
     application.add_handler(CommandHandler("submissoes", list_submissions_command))
     application.add_handler(
         CallbackQueryHandler(
-            submission_button_callback, pattern="^del_sub_|^list_subs_page_"
+            submission_button_callback,
+            pattern="^del_sub_|^del_ok_|^subs_|^list_subs_page_",
         )
     )
 
+    application.add_handler(CommandHandler("exportar", export_command))
+
     application.add_handler(CommandHandler("debug_weekly", debug_weekly_command))
     application.add_handler(CommandHandler("debug_cycle_end", debug_cycle_end_command))
     application.add_handler(CommandHandler("debug_jobs", debug_list_jobs_command))
     application.add_handler(CommandHandler("debug_cycle", debug_cycle_info_command))
+    application.add_handler(CommandHandler("debug_scores", debug_scores_command))
+    application.add_handler(CommandHandler("debug_pote", debug_pote_command))
+    application.add_handler(CommandHandler("debug_cache", debug_cache_command))
+    application.add_handler(CommandHandler("debug_envios", debug_outbox_command))
+    application.add_handler(CommandHandler("debug_latencia", debug_latency_command))
+    application.add_handler(
+        CommandHandler("debug_slow_queries", debug_slow_queries_command)
+    )
+    application.add_handler(CommandHandler("debug_archive", debug_archive_command))
 
     application.add_handler(edit_conv_handler)  # Adiciona a conversa
 
@@ -1483,9 +5557,26 @@ def main() -> None:
         MessageHandler(filters.PHOTO & filters.ChatType.GROUPS, handle_photo)
     )
 
-    # 6. Inicia o Bot
-    logger.info("Iniciando o bot...")
-    application.run_polling()
+    # 6. Latência e erros por handler (prove_it_handler_seconds)
+    instrument_handlers(application)
+    return application
+
+
+def main() -> None:
+    """Função principal que inicia o bot."""
+
+    # 1. Inicializa o banco de dados
+    init_db()
+
+    application = build_application()
+
+    # 7. Inicia o Bot
+    if BOT_MODE == "webhook":
+        logger.info("Iniciando o bot em modo webhook...")
+        asyncio.run(run_webhook(application))
+    else:
+        logger.info("Iniciando o bot...")
+        application.run_polling()
 
 
 if __name__ == "__main__":
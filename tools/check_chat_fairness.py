@@ -0,0 +1,174 @@
+"""
+Confere que uma rajada de updates de um grupo não atrasa os outros grupos.
+
+Dois cenários, com o bot importado num diretório temporário (só a API do
+Telegram é simulada):
+
+1. Processador de updates: muitos updates lentos de um mesmo usuário e um
+   de outro usuário. O do outro usuário não pode esperar a fila do primeiro
+   (os que esperam o lock da chave não ocupam slot).
+2. Application real com os limites de envio de verdade: uma rajada de fotos
+   no grupo A (que esgota o bucket de 20/min do chat) e uma foto no grupo B.
+   A resposta de B tem que sair logo, sem esperar as de A.
+
+    python tools/check_chat_fairness.py
+    python tools/check_chat_fairness.py --fotos 80 --concorrencia 4
+
+Sai com código 1 se algum dos cenários atrasar o outro grupo/usuário.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+parser.add_argument("--fotos", type=int, default=40, help="rajada no grupo A")
+parser.add_argument("--concorrencia", type=int, default=16, help="UPDATE_CONCURRENCY")
+parser.add_argument(
+    "--limite", type=float, default=2.0, help="espera máxima aceita para B (s)"
+)
+args = parser.parse_args()
+
+CHAT_A, CHAT_B = -100111, -100222
+
+# Banco e configuração isolados, antes de importar o bot
+workdir = tempfile.mkdtemp(prefix="fairness-")
+os.environ.update(
+    TELEGRAM_TOKEN="123:fairness",
+    GROUP_CHAT_ID=f"{CHAT_A},{CHAT_B}",
+    DB_PATH=os.path.join(workdir, "bot.db"),
+    UPDATE_CONCURRENCY=str(args.concorrencia),
+)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import ExtBot  # noqa: E402
+
+import bot  # noqa: E402
+
+# --- API do Telegram simulada ---
+replied_at = {}  # chat_id -> instantes das respostas
+message_ids = itertools.count(1)
+
+
+async def fake_get_me(self, *a, **kw):
+    self._bot_user = User(1, "Bot", True, username="fairness_bot")
+    return self._bot_user
+
+
+async def fake_send_message(self, chat_id, text, *a, **kw):
+    await asyncio.sleep(0.01)
+    replied_at.setdefault(chat_id, []).append(time.perf_counter())
+    return Message(next(message_ids), datetime.now(), Chat(chat_id, "supergroup"))
+
+
+ExtBot.get_me = fake_get_me
+ExtBot.send_message = fake_send_message
+
+
+def photo_update(update_id: int, chat_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup"},
+            "from": {
+                "id": user_id,
+                "is_bot": False,
+                "first_name": f"User{user_id}",
+                "username": f"user{user_id}",
+            },
+            "photo": [{"file_id": "x", "file_unique_id": "x", "width": 1, "height": 1}],
+        },
+    }
+
+
+async def check_processor(application) -> int:
+    """Cenário 1: quantos updates de A terminaram antes do de B (enfileirado por último)."""
+    processor = bot.PerUserUpdateProcessor(args.concorrencia)
+    update_ids = itertools.count(1)
+    done = {}
+
+    async def slow(name):
+        await asyncio.sleep(0.05)
+        done[name] = time.perf_counter()
+
+    tasks = [
+        asyncio.create_task(
+            processor.process_update(
+                Update.de_json(
+                    photo_update(next(update_ids), CHAT_A, 1000), application.bot
+                ),
+                slow(f"a{i}"),
+            )
+        )
+        for i in range(args.fotos)
+    ]
+    tasks.append(
+        asyncio.create_task(
+            processor.process_update(
+                Update.de_json(
+                    photo_update(next(update_ids), CHAT_B, 2000), application.bot
+                ),
+                slow("b"),
+            )
+        )
+    )
+    await asyncio.gather(*tasks)
+    return sum(1 for name, at in done.items() if name != "b" and at < done["b"])
+
+
+async def check_application(application) -> float:
+    """Cenário 2: segundos até a 1ª resposta no grupo B, com a rajada de A antes."""
+    update_ids = itertools.count(10_000)
+    started = time.perf_counter()
+    for i in range(args.fotos):
+        data = photo_update(next(update_ids), CHAT_A, 3000 + i)
+        application.update_queue.put_nowait(Update.de_json(data, application.bot))
+    data = photo_update(next(update_ids), CHAT_B, 4000)
+    application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    deadline = started + max(args.limite * 5, 10)
+    while CHAT_B not in replied_at and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    if CHAT_B not in replied_at:
+        return float("inf")
+    return replied_at[CHAT_B][0] - started
+
+
+async def main():
+    bot.init_db()
+    application = bot.build_application()
+    await application.initialize()
+    await application.start()
+
+    ahead = await check_processor(application)
+    application_wait = await check_application(application)
+    replies_a = len(replied_at.get(CHAT_A, []))
+
+    await application.stop()
+    await application.shutdown()
+    await bot.post_shutdown(application)
+
+    print(
+        f"Processador (x{args.concorrencia}): {ahead} de {args.fotos} updates "
+        "lentos de A terminaram antes do de B"
+    )
+    print(
+        f"Application: 1ª resposta em B após {application_wait:.2f}s "
+        f"({replies_a}/{args.fotos} respostas de A tinham saído)"
+    )
+    # B roda junto com o 1º de A; antes da correção esperava quase a fila toda
+    late = ahead > 1 or application_wait > args.limite
+    print("FALHOU: B esperou pela rajada de A" if late else "OK")
+    return 1 if late else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
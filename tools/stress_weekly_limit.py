@@ -0,0 +1,158 @@
+"""
+Estresse do limite de 2 comprovantes por semana com updates concorrentes.
+
+Dispara várias fotos simultâneas de cada usuário pelo Application real
+(processador de updates, handlers e banco num diretório temporário; só a
+API do Telegram é simulada) e confere no banco que nenhum usuário passou
+de 2 submissões na semana, e que as respostas de cada usuário saíram em ordem.
+
+    python tools/stress_weekly_limit.py --usuarios 50 --fotos 8
+    python tools/stress_weekly_limit.py --sem-trava   # sem o lock por usuário
+
+Com --sem-trava o limite continua valendo (a admissão é atômica no banco);
+só a ordem das respostas de um mesmo usuário deixa de ser garantida.
+
+Sai com código 1 se o limite ou a ordem das respostas for violado.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+parser.add_argument("--usuarios", type=int, default=20)
+parser.add_argument("--fotos", type=int, default=6, help="fotos por usuário")
+parser.add_argument("--chat-id", type=int, default=-100999)
+parser.add_argument(
+    "--latencia", type=float, default=0.01, help="RTT simulado da API (s)"
+)
+parser.add_argument(
+    "--sem-trava",
+    action="store_true",
+    help="usa o SimpleUpdateProcessor do PTB (sem ordenação por usuário)",
+)
+args = parser.parse_args()
+
+# Banco e configuração isolados, antes de importar o bot
+workdir = tempfile.mkdtemp(prefix="stress-")
+os.environ.update(
+    TELEGRAM_TOKEN="123:stress",
+    GROUP_CHAT_ID=str(args.chat_id),
+    DB_PATH=os.path.join(workdir, "bot.db"),
+)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import ExtBot, SimpleUpdateProcessor  # noqa: E402
+
+import bot  # noqa: E402
+
+# --- API do Telegram simulada ---
+replies = {}  # user_id -> textos, na ordem em que saíram
+message_ids = itertools.count(1)
+
+
+async def fake_get_me(self, *a, **kw):
+    self._bot_user = User(1, "Bot", True, username="stress_bot")
+    return self._bot_user
+
+
+async def fake_send_message(self, chat_id, text, *a, **kw):
+    await asyncio.sleep(args.latencia)
+    user_id = int(text.split("User")[1].split("!")[0].split(",")[0])
+    replies.setdefault(user_id, []).append(text)
+    return Message(next(message_ids), datetime.now(), Chat(chat_id, "supergroup"))
+
+
+ExtBot.get_me = fake_get_me
+ExtBot.send_message = fake_send_message
+
+
+def photo_update(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": args.chat_id, "type": "supergroup"},
+            "from": {
+                "id": user_id,
+                "is_bot": False,
+                "first_name": f"User{user_id}",
+                "username": f"user{user_id}",
+            },
+            "photo": [{"file_id": "x", "file_unique_id": "x", "width": 1, "height": 1}],
+        },
+    }
+
+
+async def main():
+    if args.sem_trava:
+        bot.PerUserUpdateProcessor = SimpleUpdateProcessor
+    bot.init_db()
+    # Sem rate limit: queremos o máximo de sobreposição entre os handlers
+    bot.outbox = bot.Outbox(global_rate=1e6, chat_rate=1e6, chat_burst=1e6)
+
+    application = bot.build_application()
+    await application.initialize()
+    await application.start()
+
+    users = [1000 + i for i in range(args.usuarios)]
+    update_ids = itertools.count(1)
+    started = time.perf_counter()
+    # Intercala os usuários: user1, user2, ..., user1, user2, ...
+    for _ in range(args.fotos):
+        for user_id in users:
+            data = photo_update(next(update_ids), user_id)
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+
+    total = args.usuarios * args.fotos
+    processor = application.update_processor
+    while application.update_queue.qsize() or processor.current_concurrent_updates:
+        await asyncio.sleep(0.01)
+    # As respostas saem pela fila de envio, depois que o handler retorna
+    deadline = time.perf_counter() + 30
+    while sum(map(len, replies.values())) < total and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+
+    over_limit = await bot.db_for(args.chat_id).fetch_all(
+        """
+        SELECT user_id, week_num, COUNT(*) AS n FROM submissions
+        WHERE chat_id = ? GROUP BY user_id, cycle_num, week_num HAVING n > 2
+    """,
+        (args.chat_id,),
+    )
+    out_of_order = [
+        user_id
+        for user_id, texts in replies.items()
+        if not (
+            "(1 de 2" in texts[0]
+            and "(2 de 2" in texts[1]
+            and all("Limite" in t for t in texts[2:])
+        )
+    ]
+
+    await application.stop()
+    await application.shutdown()
+    await bot.post_shutdown(application)
+
+    print(
+        f"{total} fotos de {args.usuarios} usuários em {elapsed:.2f}s "
+        f"({total / elapsed:.0f} updates/s, processador "
+        f"{type(processor).__name__} "
+        f"x{getattr(processor, 'limit', processor.max_concurrent_updates)})"
+    )
+    print(f"Usuários acima do limite: {len(over_limit)}")
+    print(f"Usuários com respostas fora de ordem: {len(out_of_order)}")
+    print(f"Respostas enviadas: {sum(map(len, replies.values()))}/{total}")
+    return 1 if over_limit or out_of_order else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
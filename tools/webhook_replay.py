@@ -0,0 +1,151 @@
+"""
+Simula o Telegram contra o webhook local: faz POST de updates gravados
+(um JSON por linha) no endpoint do bot, com o secret token, e mede o tempo
+até o 200 de cada POST.
+
+Exemplos:
+    # Updates gravados (ex: salvos do getUpdates, um por linha)
+    python tools/webhook_replay.py updates.jsonl
+
+    # 200 fotos sintéticas no grupo -100123, 20 POSTs simultâneos
+    python tools/webhook_replay.py --sintetico 200 --chat-id -100123 --concorrencia 20
+
+A latência até a primeira resposta de cada update aparece no /debug_latencia.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import httpx
+
+
+def load_updates(path: str):
+    """Lê updates de um arquivo JSONL (ou de um array JSON)."""
+    with open(path, encoding="utf-8") as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        return json.loads(content)
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def synthetic_updates(count: int, chat_id: int, users: int):
+    """Fotos (comprovantes) de 'users' usuários diferentes no grupo."""
+    now = int(time.time())
+    for i in range(count):
+        user_id = 1000 + (i % users)
+        yield {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": chat_id, "type": "supergroup", "title": "Replay"},
+                "from": {
+                    "id": user_id,
+                    "is_bot": False,
+                    "first_name": f"User{user_id}",
+                    "username": f"user{user_id}",
+                },
+                "photo": [
+                    {
+                        "file_id": f"photo-{i}",
+                        "file_unique_id": f"u-{i}",
+                        "width": 90,
+                        "height": 90,
+                    }
+                ],
+                "caption": "comprovante",
+            },
+        }
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def replay(args, updates):
+    update_ids = itertools.count(args.primeiro_id)
+    limit = asyncio.Semaphore(args.concorrencia)
+    latencies = []
+    statuses = {}
+    interval = 1 / args.taxa if args.taxa else 0
+
+    async with httpx.AsyncClient(timeout=10) as client:
+
+        async def post(update):
+            if args.renumerar:
+                update = {**update, "update_id": next(update_ids)}
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(
+                        args.url,
+                        json=update,
+                        headers={"X-Telegram-Bot-Api-Secret-Token": args.secret},
+                    )
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started = time.perf_counter()
+        tasks = []
+        for update in updates:
+            tasks.append(asyncio.create_task(post(update)))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        f"{len(latencies)} updates em {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s)"
+    )
+    print(f"Status: {statuses}")
+    print(
+        "Tempo até o 200: "
+        f"p50 {percentile(latencies, 0.50) * 1000:.1f}ms | "
+        f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms | "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms | "
+        f"máx {latencies[-1] * 1000 if latencies else 0:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("arquivo", nargs="?", help="updates gravados (JSONL)")
+    parser.add_argument(
+        "--url",
+        default=f"http://127.0.0.1:{os.environ.get('WEBHOOK_PORT', '8080')}"
+        f"{os.environ.get('WEBHOOK_PATH', '/telegram')}",
+    )
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", ""))
+    parser.add_argument("--sintetico", type=int, help="gera N fotos sintéticas")
+    parser.add_argument("--chat-id", type=int, default=-100)
+    parser.add_argument("--usuarios", type=int, default=10)
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument(
+        "--taxa", type=float, help="updates por segundo (padrão: sem limite)"
+    )
+    parser.add_argument(
+        "--renumerar", action="store_true", help="dá update_ids novos a cada replay"
+    )
+    parser.add_argument("--primeiro-id", type=int, default=int(time.time()))
+    args = parser.parse_args()
+
+    if args.sintetico:
+        updates = list(synthetic_updates(args.sintetico, args.chat_id, args.usuarios))
+    elif args.arquivo:
+        updates = load_updates(args.arquivo)
+    else:
+        parser.error("informe um arquivo de updates ou --sintetico N")
+
+    asyncio.run(replay(args, updates))
+
+
+if __name__ == "__main__":
+    main()